@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks (throughput and peak memory) of degradation engine, P.56 leveling and LTASS
+"""
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of applySpecSub(), calculateP56ASL()/calculateP56ASLEx(), ltassP50FB() and a reduced
+end-to-end sweep on synthetic speech-like signals (no downloads, no plots), and of the cold start of a
+new process (import and first call of applySpecSub()).
+
+Usage:
+    python -m benchmarks.benchmark -o benchmark.json [-d 10] [-r 3] [--baseline old.json]
+"""
+
+import sys
+import json
+import time
+import tempfile
+import subprocess
+import platform
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List
+import numpy as np
+import scipy
+from scipy.signal import lfilter
+
+from degradeSpecSub import applySpecSub, makeParameterGrid
+from p56.asl import calculateP56ASL, calculateP56ASLEx
+from p56.prefilter import P56Prefilter
+from helper import FS
+from helper.coeffs import getCoeffsP50
+from helper.ltass import ltassP50FB
+from sweep.pipeline import processSweepTask
+
+# (n_fft, hop_length) settings of the sweep (see tests/test_degradeSpecSub.py)
+SWEEP_SETTINGS = [(8192, 2048), (8192, 128), (8192, 64)]
+
+def speechLikeSignal(duration=10.0, seed=0, level=-26.0):
+    '''
+    Synthetic speech-like test signal at FS: P.50-shaped noise, switched on/off in syllable-like
+    segments (0.1...0.3 s) with pauses (0.05...0.5 s), active speech level <level> dBov.
+    '''
+    rng = np.random.default_rng(seed)
+    nbrSamples = int(duration * FS)
+
+    b, a = getCoeffsP50()
+    x = lfilter(b, a, rng.standard_normal(nbrSamples))
+
+    # on/off envelope with 10 ms ramps
+    envelope = np.zeros(nbrSamples)
+    ramp = np.hanning(2 * int(0.01 * FS))
+    idx = 0
+    while idx < nbrSamples:
+        idx += int(rng.uniform(0.05, 0.5) * FS)
+        length = int(rng.uniform(0.1, 0.3) * FS)
+        segment = np.ones(length)
+        segment[:ramp.shape[0] // 2] = ramp[:ramp.shape[0] // 2]
+        segment[-(ramp.shape[0] // 2):] = ramp[ramp.shape[0] // 2:]
+        segment = segment[:max(nbrSamples - idx, 0)]
+        envelope[idx:idx + segment.shape[0]] = segment
+        idx += length
+
+    x *= envelope
+    asl, _ = calculateP56ASL(x, FS)
+    x *= np.power(10, (level - asl) / 20)
+    return x.astype(np.float32)
+
+def _measure(func: Callable, repeat: int) -> dict:
+    # warm-up (numba compilation, STFT plans, filter designs), then best-of-<repeat> wall time
+    func()
+    wallTimes, cpuTimes = [], []
+    for _ in range(repeat):
+        t0, c0 = time.perf_counter(), time.process_time()
+        func()
+        wallTimes.append(time.perf_counter() - t0)
+        cpuTimes.append(time.process_time() - c0)
+
+    # peak memory in separate run (tracemalloc slows down execution)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return dict(wallTime=min(wallTimes), meanWallTime=float(np.mean(wallTimes)), cpuTime=min(cpuTimes),
+                peakMemoryBytes=peak)
+
+# cold start in new process: import and first/second call of applySpecSub() on 1 s (numpy is imported before)
+_COLD_START_SCRIPT = '''
+import sys, json, time, tracemalloc
+import numpy as np
+memory = len(sys.argv) > 1
+if memory:
+    tracemalloc.start()
+times, cpuTimes, peaks = [], [], []
+def mark():
+    times.append(time.perf_counter())
+    cpuTimes.append(time.process_time())
+    if memory:
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+mark()
+from degradeSpecSub import applySpecSub
+mark()
+s = 0.05 * np.random.default_rng(0).standard_normal(48000)
+for _ in range(2):
+    applySpecSub(s, 48000, -26.0, 5.0, n_fft=%d, hop_length=%d, seed=0)
+    mark()
+print(json.dumps(dict(times=np.diff(times).tolist(), cpuTimes=np.diff(cpuTimes).tolist(), peaks=peaks[1:])))
+'''
+
+# stages of cold start (times of _COLD_START_SCRIPT)
+COLD_START_STAGES = ['import', 'firstCall', 'secondCall']
+
+def _coldStart(n_fft: int, hop_length: int, memory: bool = False) -> dict:
+    args = [sys.executable, '-c', _COLD_START_SCRIPT % (n_fft, hop_length)] + (['memory'] if memory else [])
+    output = subprocess.run(args, cwd=Path(__file__).parent.parent, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def _result(name: str, params: dict, timing: dict, audioSeconds: float = None, calls: int = 1) -> dict:
+    if audioSeconds is not None:
+        throughput, unit = audioSeconds / timing['wallTime'], 'audio s/s'
+    else:
+        throughput, unit = calls / timing['wallTime'], 'calls/s'
+    return dict(name=name, params=params, audioSeconds=audioSeconds, throughput=throughput,
+                throughputUnit=unit, **timing)
+
+def benchmarkSpecSub(s, repeat=3) -> List[dict]:
+    results = []
+    for n_fft, hop in SWEEP_SETTINGS:
+        timing = _measure(lambda: applySpecSub(s, FS, -26.0, 5.0, n_fft=n_fft, hop_length=hop, seed=0), repeat)
+        results.append(_result('applySpecSub', dict(n_fft=n_fft, hop_length=hop), timing, s.shape[0] / FS))
+    return results
+
+def benchmarkP56(s, repeat=3) -> List[dict]:
+    results = [_result('calculateP56ASL', dict(), _measure(lambda: calculateP56ASL(s, FS), repeat), s.shape[0] / FS)]
+    for preFilter in P56Prefilter:
+        timing = _measure(lambda: calculateP56ASLEx(s, FS, preFilter=preFilter), repeat)
+        results.append(_result('calculateP56ASLEx', dict(preFilter=preFilter.value), timing, s.shape[0] / FS))
+    return results
+
+def benchmarkLtass(repeat=3, n_fft=8192, calls=100) -> List[dict]:
+    freq = np.fft.rfftfreq(n_fft, 1 / FS)
+    def func():
+        for _ in range(calls):
+            ltassP50FB(freq)
+
+    return [_result('ltassP50FB', dict(n_fft=n_fft), _measure(func, repeat), calls=calls)]
+
+def benchmarkSweep(s, repeat=1) -> List[dict]:
+    # reduced end-to-end sweep: one task of the sweep driver (shared STFTs, engine, leveling within the inverse
+    # STFT, cache entries and FLAC output files, in a temporary directory)
+    n_fft, hop = SWEEP_SETTINGS[0]
+    conditions = makeParameterGrid(n_fft=n_fft, hop_length=hop, snr=[5, -5], osf=[0.5, 1.0], tc=[0.035], pow_exp=[1.0, 2.0])
+    with tempfile.TemporaryDirectory() as tmpDir:
+        tasks = [dict(cond, cacheKey='%064d' % i, params=cond, outputFile=Path(tmpDir) / ('%d.flac' % i))
+                 for i, cond in enumerate(conditions)]
+        timing = _measure(lambda: processSweepTask(s, FS, tasks, Path(tmpDir) / 'cache', noiseSeed=0), repeat)
+
+    params = dict(n_fft=n_fft, hop_length=hop, nbrConditions=len(conditions))
+    return [_result('sweep', params, timing, len(conditions) * s.shape[0] / FS)]
+
+def benchmarkColdStart(repeat=3) -> List[dict]:
+    '''
+    Import and first calls of applySpecSub() in new processes (1 s signal), best-of-<repeat> per stage. The first
+    run fills the on-disk cache of numba (as warm-up in _measure()), so the first call includes numba import and
+    loading of the kernels from the cache (see degradeSpecSub.warmupKernels()), but not their compilation.
+    '''
+    n_fft, hop = SWEEP_SETTINGS[0]
+    _coldStart(n_fft, hop)
+    runs = [_coldStart(n_fft, hop) for _ in range(repeat)]
+    peaks = _coldStart(n_fft, hop, memory=True)['peaks']
+
+    results = []
+    for i, name in enumerate(COLD_START_STAGES):
+        wallTimes = [run['times'][i] for run in runs]
+        timing = dict(wallTime=min(wallTimes), meanWallTime=float(np.mean(wallTimes)),
+                      cpuTime=min([run['cpuTimes'][i] for run in runs]), peakMemoryBytes=peaks[i])
+        results.append(_result('coldStart', dict(stage=name, n_fft=n_fft, hop_length=hop), timing))
+    return results
+
+def runBenchmarks(duration=10.0, repeat=3, seed=0) -> dict:
+    '''
+    Run all benchmarks on one synthetic signal of <duration> seconds.
+    Returns:
+        dict with environment information ('meta') and list of results (name, params, throughput, wall/CPU time,
+        peak memory of Python/numpy allocations)
+    '''
+    s = speechLikeSignal(duration, seed=seed)
+    results = benchmarkSpecSub(s, repeat) + benchmarkP56(s, repeat) + benchmarkLtass(repeat) + benchmarkSweep(s, max(repeat // 3, 1)) + \
+              benchmarkColdStart(repeat)
+
+    meta = dict(date=datetime.now().isoformat(timespec='seconds'), duration=duration, repeat=repeat, fs=FS,
+                python=platform.python_version(), numpy=np.__version__, scipy=scipy.__version__,
+                platform=platform.platform(), processor=platform.processor())
+    return dict(meta=meta, results=results)
+
+def _resultKey(result: dict) -> str:
+    return json.dumps([result['name'], result['params']], sort_keys=True)
+
+def compareResults(baseline: dict, current: dict, tolerance=0.2) -> List[dict]:
+    # results with throughput more than <tolerance> (relative) below baseline
+    reference = {_resultKey(r): r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        ref = reference.get(_resultKey(result))
+        if (ref is not None) and (result['throughput'] < (1 - tolerance) * ref['throughput']):
+            regressions.append(dict(name=result['name'], params=result['params'], baseline=ref['throughput'],
+                                    current=result['throughput'], ratio=result['throughput'] / ref['throughput']))
+    return regressions
+
+def writeResults(results: dict, jsonFile: Path):
+    with open(jsonFile, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmarks of NoiseSuppressionDegradation')
+    parser.add_argument('-o', '--output', type=Path, default=Path('benchmark.json'))
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help='duration of test signal (s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('--baseline', type=Path, default=None, help='JSON file of previous run for comparison')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    res = runBenchmarks(args.duration, args.repeat)
+    writeResults(res, args.output)
+    for r in res['results']:
+        print('%-18s %-40s %10.1f %-9s %8.1f MB' % (r['name'], json.dumps(r['params']), r['throughput'],
+                                                  r['throughputUnit'], r['peakMemoryBytes'] / 2**20))
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compareResults(json.load(f), res, args.tolerance)
+        for r in regressions:
+            print('Regression: %s %s: %.1f -> %.1f (%.0f %%)' % (r['name'], json.dumps(r['params']), r['baseline'],
+                                                              r['current'], 100 * r['ratio']))
+        if len(regressions) > 0:
+            raise SystemExit(1)
@@ -5,75 +5,620 @@ Created on Apr 14 2021 13:08
 @author: Jan.Reimes
 """
 
+import threading
+from itertools import product
+from collections import OrderedDict
 import numpy as np
-import librosa
-from scipy.signal import lfilter
+import scipy.fft
+from numpy.lib.stride_tricks import sliding_window_view
 
+from helper.jit import lazyJit, warmup
 from helper.ltass import ltassP50FB
+from helper.stft import STFT
+from helper.noise import speechShapedNoise, SpeechShapedNoise
+from helper.profiling import stage, condition, conditionLabel
+from p56.asl import ASLMeter, calculateP56ASLEx
+
+SWEEP_PARAMETERS = ('n_fft', 'hop_length', 'snr', 'osf', 'tc', 'pow_exp')
+
+# max. number of cached plans (see getSpecSubPlan())
+PLAN_CACHE_SIZE = 16
+
+def _getHopLength(n_fft, hop_length=None, overlap=0.75):
+    # explicit hop length has priority over overlap
+    if hop_length is None:
+        overlap = np.maximum(np.minimum(overlap, 0.99), 0.0)
+        hop_length = int(n_fft * (1-overlap))
+    return int(hop_length)
+
+def _whiteNoise(shape, seed=None):
+    # white noise at 0 dB: global np.random state if seed is None, else seed (int) or np.random.Generator
+    if seed is None:
+        return np.random.randn(*shape).astype(np.float32)
+    return np.random.default_rng(seed).standard_normal(shape, dtype=np.float32)
+
+def _blockRate(fs, n_fft, hop_length, overlap=None):
+    # frame rate of smoothing: as first version (fs / ((1-overlap)*n_fft)) if hop length is derived from overlap,
+    # differs from fs / hop_length if n_fft*(1-overlap) is not an integer (e.g. n_fft=2048, overlap=0.9)
+    if (overlap is None) or (_getHopLength(n_fft, None, overlap) != hop_length):
+        return fs / hop_length
+    overlap = np.maximum(np.minimum(overlap, 0.99), 0.0)
+    return fs / ((1 - overlap) * n_fft)
+
+def _smoothingFactor(tc, fsBlock):
+    # coefficient of 1st order recursive smoothing along time axis
+    return np.exp(-1/(tc * fsBlock))
+
+@lazyJit(nopython=True, nogil=True, cache=True)
+def _wienerGain(S_est, absN, pow_exp):
+    # Wiener gain (S_est^p / (S_est^p + absN^p))^(1/p), fast paths for pow_exp of 1 and 2
+    if pow_exp == 2.0:
+        den = np.sqrt(S_est*S_est + absN*absN)
+        return S_est / den if den > 0.0 else 0.0
+    elif pow_exp == 1.0:
+        den = S_est + absN
+        return S_est / den if den > 0.0 else 0.0
+    elif S_est > 0.0:
+        return (1.0 + (absN / S_est)**pow_exp)**(-1.0/pow_exp)
+    else:
+        return 0.0
+
+@lazyJit(nopython=True, nogil=True, cache=True)
+def _specSubKernel(S, N, noiseGain, aS, aN, osf, floorSubtractFactor, pow_exp, stateY, stateN, out):
+    '''
+    Fused smoothing, spectral subtraction and Wiener gain (frequency x frames), one pass per bin:
+        Y = S + noiseGain*N, smoothed magnitudes of Y and N (recursive, states per bin updated in-place),
+        out = S * G (out may be S)
+    '''
+    nbrBins, nbrFrames = S.shape
+    for f in range(nbrBins):
+        absY = stateY[f]
+        absN = stateN[f]
+        for t in range(nbrFrames):
+            s = S[f, t]
+            nRe = noiseGain * N[f, t].real
+            nIm = noiseGain * N[f, t].imag
+            yRe = s.real + nRe
+            yIm = s.imag + nIm
+
+            # smooth
+            absY = (1-aS)*np.sqrt(yRe*yRe + yIm*yIm) + aS*absY
+            absN = (1-aN)*np.sqrt(nRe*nRe + nIm*nIm) + aN*absN
+
+            # spectral subtraction, taking into account over-subtraction and minimum noise floor
+            S_est = max(absY - osf*absN, floorSubtractFactor*absY)
+
+            out[f, t] = s * _wienerGain(S_est, absN, pow_exp)
+
+        stateY[f] = absY
+        stateN[f] = absN
+
+class SpecSubPlan(STFT):
+    '''
+    Precomputed setup of applySpecSub() for fixed (fs, n_fft, hop_length, window).
+
+    Window, frequency grid, LTASS weights and ISTFT normalization envelopes (per number of frames)
+    are computed once. STFT/ISTFT (helper.stft.STFT, as librosa with center=True) use batched real FFTs on
+    blocks of frames with reused block buffers, so repeated calls (e.g. in a sweep) skip setup. The STFT of a
+    call is processed in-place and released on return (no signal-sized memory is kept by the plan).
+
+    Optionally (noiseCacheBytes > 0, default: disabled), speech-shaped noise STFTs (at 0 dB) of seeded noise
+    are cached per (shape, seed) up to noiseCacheBytes in total, so calls sharing a noise realization skip the
+    noise FFT. Plans are thread-safe (work buffers per thread, locked noise cache), the gain kernel releases the GIL.
+
+    With dtype=np.float32, STFTs are complex64 and all magnitudes, gains, states and buffers are float32
+    (half the memory traffic and size of the STFTs of the float64 default). Same noise realization as float64;
+    the output deviates from float64 by less than -80 dB relative to the output RMS (max. absolute error).
+
+    Usage:
+        plan = getSpecSubPlan(fs, n_fft, hop_length, dtype='float32')
+        degraded = plan.apply(signal, speechLevel, snr, **kwargs)
+    '''
+    def __init__(self, fs, n_fft=8192, hop_length=2048, window='hann', blockBytes=2**22, noiseCacheBytes=0,
+                 dtype=np.float64):
+        super().__init__(n_fft, hop_length, window, blockBytes, dtype)
+        self.fs = fs
+        self.fsBlock = fs / self.hop_length # hops derived from overlap: see _blockRate()
+        self.freq = np.fft.rfftfreq(self.n_fft, d=1.0/fs)
+
+        # LTASS of P.50 at 0 dB (linear), only shifted by target level in ltassWeights()
+        self._ltass = np.power(10, ltassP50FB(self.freq, targetLevelDbPa=0.0)/20).astype(self.complexType(self.dtype))
+
+        # RMS of white noise weighted by LTASS at 0 dB (power of all bins of the full spectrum), time-domain noise
+        # at 0 dB (unit RMS, e.g. speechShapedNoise()) is scaled by it to the same level (depends on n_fft as
+        # ltassP50FB() normalizes its complex level over the frequency grid). Only the level is matched: the LTASS
+        # weights floor bins where the P.50 response has a negative real part, time-domain noise has the P.50 shape.
+        power = np.power(np.abs(self._ltass.astype(complex)), 2)
+        power[1:(self.n_fft + 1)//2] *= 2
+        self.noiseCalibration = float(np.sqrt(np.sum(power) / self.n_fft))
+
+        self._noise = OrderedDict()
+        self._noiseLock = threading.Lock()
+        self.noiseCacheBytes = int(noiseCacheBytes)
+
+    def ltassWeights(self, level):
+        # linear LTASS weights per frequency bin (speech-shaped noise at target level)
+        return self._ltass * np.power(10, level/20)
+
+    @property
+    def noiseCacheSize(self):
+        # bytes of cached noise STFTs
+        with self._noiseLock:
+            return sum(N.nbytes for N in self._noise.values())
+
+    def _trimNoiseCache(self, maxBytes):
+        # remove least recently used noise STFTs until at most maxBytes are cached (lock held by caller)
+        size = sum(N.nbytes for N in self._noise.values())
+        while (size > maxBytes) and (len(self._noise) > 0):
+            size -= self._noise.popitem(last=False)[1].nbytes
+
+    def setNoiseCacheBytes(self, noiseCacheBytes):
+        # limit of noise cache (0: disabled), cached STFTs beyond the limit are removed
+        with self._noiseLock:
+            self.noiseCacheBytes = int(noiseCacheBytes)
+            self._trimNoiseCache(self.noiseCacheBytes)
+
+    def clearCache(self):
+        # release cached noise STFTs and ISTFT envelopes (e.g. if plan is removed from plan cache)
+        with self._noiseLock:
+            self._noise.clear()
+        with self._envelopeLock:
+            self._envelopes.clear()
+
+    def noiseStft(self, shape, seed=None, noiseShaping='stft', workers=None):
+        '''
+        STFT of speech-shaped noise at 0 dB for signals of given shape (... x samples).
+        Results for integer seeds are cached if enabled (noiseCacheBytes, read-only arrays), see _whiteNoise() for seed.
+        noiseShaping: 'stft' (white noise weighted by LTASS per bin) or 'time' (P.50 FB filter, see speechShapedNoise(),
+        scaled by noiseCalibration to the level of 'stft')
+        workers: see STFT.stft()
+        '''
+        shape = tuple(np.atleast_1d(shape).tolist())
+        cacheable = isinstance(seed, (int, np.integer)) and (self.noiseCacheBytes > 0)
+        key = (shape, int(seed), noiseShaping) if cacheable else None
+        if cacheable:
+            with self._noiseLock:
+                if key in self._noise:
+                    self._noise.move_to_end(key)
+                    return self._noise[key]
+
+        if noiseShaping == 'time':
+            N = self.stft(speechShapedNoise(shape, self.fs, 0.0, seed), workers=workers)
+            N *= self.noiseCalibration
+        elif noiseShaping == 'stft':
+            N = self.stft(_whiteNoise(shape, seed), workers=workers)
+            N *= np.reshape(self.ltassWeights(0.0), (N.shape[-2], 1))
+        else:
+            raise ValueError('Unknown noise shaping: %s' % noiseShaping)
+
+        if cacheable and (N.nbytes <= self.noiseCacheBytes):
+            N.flags.writeable = False
+            with self._noiseLock:
+                self._noise[key] = N
+                self._trimNoiseCache(self.noiseCacheBytes)
+        return N
+
+    def apply(self, signal, speechLevel, snr, **kwargs):
+        '''
+        Same as applySpecSub() (STFT parameters of plan, other arguments as keyword arguments)
+        '''
+        pow_exp = kwargs.get('pow_exp', 2.0)
+        osf = kwargs.get('osf', 0.99) # 1.0: highest musical tones, less noise; 0.0: less distortions, more noise
+        tcNoise = kwargs.get('tcNoise', 0.100)
+        tcSpeech = kwargs.get('tcSpeech', 0.100)
+        floorSubtractFactor = kwargs.get('floorSubtractFactor', 0.0)
+
+        # check arguments
+        floorSubtractFactor = np.maximum(floorSubtractFactor, 0.0)
+        osf = np.maximum(np.minimum(osf, 2.0), 0.0)
+
+        # transform input (1-D or channels x samples)
+        signal = np.asarray(signal)
+        nbrFrames = self.nbrFrames(signal.shape[-1])
+        shape = signal.shape[:-1] + (self.freq.shape[0], nbrFrames)
+        workers = kwargs.get('fftWorkers', None)
+        with stage('stft'):
+            S = self.stft(signal, workers=workers)
+
+        # speech-shaped noise at 0 dB (independent per channel): precomputed, cached (seed) or new
+        N = kwargs.get('noiseStft', None)
+        noiseSignal = kwargs.get('noiseSignal', None)
+        if N is None:
+            with stage('noise'):
+                if noiseSignal is not None:
+                    N = self.stft(np.asarray(noiseSignal), workers=workers)
+                    N *= self.noiseCalibration
+                else:
+                    N = self.noiseStft(signal.shape, kwargs.get('seed', None), kwargs.get('noiseShaping', 'stft'), workers)
+        if N.shape != shape:
+            raise ValueError('Shape of noise STFT %s does not match signal STFT %s' % (N.shape, shape))
+
+        # noise at target level is scaled within kernel (precomputed noise is not modified)
+        targetNoiseLevel = speechLevel - snr
+        noiseGain = np.power(10, targetNoiseLevel/20)
+
+        # smoothing, spectral subtraction and Wiener gain, processed signal/STFT in-place (all channels at once)
+        real = self.dtype.type
+        overlap = kwargs.get('overlap', None) if kwargs.get('hop_length', None) is None else None
+        fsBlock = _blockRate(self.fs, self.n_fft, self.hop_length, overlap)
+        aS = _smoothingFactor(tcSpeech, fsBlock)
+        aN = _smoothingFactor(tcNoise, fsBlock)
+        S2 = S.reshape(-1, nbrFrames)
+        with stage('gain'):
+            _specSubKernel(S2, N.reshape(-1, nbrFrames), real(noiseGain), real(aS), real(aN), real(osf),
+                           real(floorSubtractFactor), real(pow_exp), np.zeros(S2.shape[0], dtype=self.dtype),
+                           np.zeros(S2.shape[0], dtype=self.dtype), S2)
+
+        # transform back to time domain
+        with stage('istft'):
+            return self.istft(S, signal.shape[-1], workers=workers).astype(np.float32, copy=False)
+
+# cached plans (least recently used first), caches of removed plans are cleared
+_plans = OrderedDict()
+_plansLock = threading.Lock()
+
+def getSpecSubPlan(fs, n_fft=8192, hop_length=2048, window='hann', dtype=np.float64, noiseCacheBytes=None):
+    '''
+    Cached plan per STFT setting and precision (up to PLAN_CACHE_SIZE plans).
+    noiseCacheBytes: if given, limit of the noise cache of the plan (see SpecSubPlan, default: disabled)
+    '''
+    key = (fs, int(n_fft), int(hop_length), window if not isinstance(window, (np.ndarray, list)) else tuple(window),
+           np.dtype(dtype).name)
+    with _plansLock:
+        plan = _plans.get(key, None)
+        if plan is None:
+            plan = SpecSubPlan(fs, n_fft, hop_length, window, dtype=dtype)
+            _plans[key] = plan
+            while len(_plans) > PLAN_CACHE_SIZE:
+                _plans.popitem(last=False)[1].clearCache()
+        else:
+            _plans.move_to_end(key)
+    if noiseCacheBytes is not None:
+        plan.setNoiseCacheBytes(noiseCacheBytes)
+    return plan
+
+def clearSpecSubPlans():
+    # remove all cached plans and release their caches
+    with _plansLock:
+        for plan in _plans.values():
+            plan.clearCache()
+        _plans.clear()
+
+def warmupKernels(fs=48000, dtypes=(np.float64, np.float32), background=False):
+    '''
+    Load (or compile) the numba kernels of applySpecSub(), applySpecSubSweep(), SpecSubStream and of leveling
+    (P.56) for the given dtypes on a short signal. Without warm-up, the first call of a process includes the numba import and
+    loading of the kernels from its on-disk cache (about 0.5...1.5 s, several seconds for compilation if the
+    cache is empty), independent of the signal length.
+
+    Usage:
+        warmupKernels(background=True)    # e.g. at start of a script, while sources are loaded
+        fs              - sampling frequency
+        dtypes          - precisions to warm up (see applySpecSub())
+        background      - run in a daemon thread (returned), calls of the kernels meanwhile wait for it
+    '''
+    def run():
+        # own plans (not added to the plan cache), kernel signatures as in single calls and sweeps
+        s = 0.05 * np.random.default_rng(0).standard_normal(fs // 2)
+        for dtype in dtypes:
+            d = SpecSubPlan(fs, 256, 64, dtype=dtype).apply(s, -26.0, 0.0, seed=0)
+        calculateP56ASLEx(d, fs, preFilter='FB')
+
+        # as SpecSubStream (transposed block STFTs: Fortran order)
+        S = np.zeros((4, 129), dtype=complex).T
+        _specSubKernel(S, S.astype(np.complex64, order='F'), 1.0, 0.5, 0.5, 0.99, 0.0, 2.0, np.zeros(129), np.zeros(129), S)
+
+    return warmup(run, background=background)
 
 def applySpecSub(signal, fs, speechLevel, snr, **kwargs):
+    # signal: 1-D, (channels x samples) or list of signals with equal length (independent noise per channel)
+    # seed: None (global np.random state), int or np.random.Generator for reproducible noise
+    # noiseStft: precomputed speech-shaped noise STFT at 0 dB, e.g. from getSpecSubPlan(...).noiseStft()
+    # noiseCacheBytes: enable/limit noise cache of plan for integer seeds (see SpecSubPlan, default: disabled)
+    # noiseShaping: 'stft' (default, white noise weighted by LTASS per bin) or 'time' (P.50 FB filter in time domain,
+    #               same level as 'stft', see SpecSubPlan.noiseCalibration)
+    # noiseSignal: precomputed speech-shaped noise at 0 dB (unit RMS, shape of signal), e.g. from
+    #              helper.noise.speechShapedNoise(), scaled to the level of 'stft' as noiseShaping='time'
+    # dtype: precision of STFTs and gains, np.float64 (default) or np.float32 (complex64 STFTs, see SpecSubPlan)
+    # fftWorkers: number of threads per FFT (see scipy.fft.rfft()), default: 1
+    # thread-safe (e.g. in a ThreadPoolExecutor) if seed is given (seed=None draws from the global np.random state)
+    # the first call of a process includes loading of the numba kernels (see warmupKernels())
+
     # parse arguments
-    overlap = kwargs.get('overlap', 0.75)
     n_fft = kwargs.get('n_fft', 8192)
     window = kwargs.get('window', 'hann')
+    hop_length = _getHopLength(n_fft, kwargs.get('hop_length', None), kwargs.get('overlap', 0.75))
+    if kwargs.get('hop_length', None) is None:
+        kwargs = dict(kwargs, overlap=kwargs.get('overlap', 0.75)) # smoothing as derived from overlap (see _blockRate())
 
-    pow_exp = kwargs.get('pow_exp', 2.0)
-    osf = kwargs.get('osf', 0.99) # 1.0: highest musical tones, less noise; 0.0: less distortions, more noise
-    tcNoise = kwargs.get('tcNoise', 0.100)
-    tcSpeech = kwargs.get('tcSpeech', 0.100)
-    floorSubtractFactor = kwargs.get('floorSubtractFactor', 0.0)
+    # STFT setup is reused for all calls with same settings
+    plan = getSpecSubPlan(fs, n_fft, hop_length, window, kwargs.get('dtype', np.float64), kwargs.get('noiseCacheBytes', None))
+    return plan.apply(signal, speechLevel, snr, **kwargs)
 
-    # check arguments
-    floorSubtractFactor = np.maximum(floorSubtractFactor, 0.0)
-    overlap = np.maximum(np.minimum(overlap, 0.99), 0.0)
-    osf = np.maximum(np.minimum(osf, 2.0), 0.0)
+def _meterResult(meter, d, fs, preFilter):
+    # result of meter fed within inverse STFT; calculateP56ASLEx() rescales signals out of its amplitude range
+    maxAbsValue = np.abs(d).max()
+    if 0.1 <= maxAbsValue <= 1.0:
+        return meter.result()
+    return calculateP56ASLEx(d, fs, preFilter=preFilter)
+
+def makeParameterGrid(n_fft=(8192,), hop_length=(2048,), snr=(0.0,), osf=(0.99,), tc=(0.100,), pow_exp=(2.0,)):
+    # full factorial grid of sweep conditions (list of dicts, keys: SWEEP_PARAMETERS)
+    grid = product(*[np.atleast_1d(values).tolist() for values in (n_fft, hop_length, snr, osf, tc, pow_exp)])
+    return [dict(zip(SWEEP_PARAMETERS, values)) for values in grid]
+
+def applySpecSubSweep(signal, fs, speechLevel, conditions, **kwargs):
+    '''
+    Generator version of applySpecSub() for many conditions (parameter sweep) of one signal.
+
+    STFTs of signal and noise and the LTASS shaping are only computed once per (n_fft, hop_length).
+    Each condition then only needs one pass of the fused gain kernel over these STFTs (noise level,
+    smoothing and gain are applied on the fly) and the inverse STFT.
+
+    Usage:
+        for params, degraded in applySpecSubSweep(s, fs, -26.0, makeParameterGrid(snr=[0, 10])):
+            ...
+        signal          - 1-D input signal
+        fs              - sampling frequency
+        speechLevel     - active speech level of signal (dB)
+        conditions      - iterable of dicts with keys SWEEP_PARAMETERS, e.g. from makeParameterGrid()
+                          (tc is used for tcSpeech and tcNoise, additional keys are ignored)
+        window          - STFT window (default: 'hann')
+        floorSubtractFactor - see applySpecSub() (default: 0.0)
+        seed            - see applySpecSub(), one noise realization is shared by all conditions (default: None)
+        noiseShaping    - see applySpecSub() (default: 'stft'), 'time': noise is generated once for all STFT settings
+        noiseSignal     - see applySpecSub(), shared by all conditions and STFT settings (default: None)
+        levelTo         - target ASL (dB): output is leveled, ASL is measured within the inverse STFT (default: None)
+        preFilter       - P.56 pre-filter for levelTo (default: 'FB')
+        dtype, fftWorkers - see applySpecSub()
+    Yields:
+        (params, degraded) - condition (dict as passed) and degraded signal (float32), same as applySpecSub()
+        (params, degraded, (asl, activity)) - if levelTo is given: leveled signal, ASL and activity before leveling,
+                          same as calculateP56ASLEx(degraded, fs, preFilter)
+    '''
+    window = kwargs.get('window', 'hann')
+    floorSubtractFactor = float(np.maximum(kwargs.get('floorSubtractFactor', 0.0), 0.0))
+    dtype = np.dtype(kwargs.get('dtype', np.float64))
+    real = dtype.type
+    workers = kwargs.get('fftWorkers', None)
+    seed = kwargs.get('seed', None)
+    noiseSignal = kwargs.get('noiseSignal', None)
+    levelTo = kwargs.get('levelTo', None)
+    preFilter = kwargs.get('preFilter', 'FB')
+    if (noiseSignal is None) and (kwargs.get('noiseShaping', 'stft') == 'time'):
+        noiseSignal = speechShapedNoise(signal.shape, fs, 0.0, seed)
+
+    # group conditions by STFT setting
+    groups = dict()
+    for cond in conditions:
+        groups.setdefault((int(cond['n_fft']), int(cond['hop_length'])), []).append(cond)
+
+    # white noise at 0 dB, shared by all conditions (integer seeds: drawn by plan, cached if enabled)
+    n = None if (noiseSignal is not None) or isinstance(seed, (int, np.integer)) else _whiteNoise(signal.shape, seed)
+
+    for (n_fft, hop_length), conds in groups.items():
+        plan = getSpecSubPlan(fs, n_fft, hop_length, window, dtype)
+
+        # transform input and noise (once per STFT setting), noise at 0 dB
+        with condition(conditionLabel(dict(n_fft=n_fft, hop_length=hop_length))):
+            with stage('stft'):
+                S = plan.stft(signal, workers=workers)
+            with stage('noise'):
+                if noiseSignal is not None:
+                    N = plan.stft(noiseSignal, workers=workers)
+                    N *= plan.noiseCalibration
+                elif n is None:
+                    N = plan.noiseStft(signal.shape, seed, workers=workers)
+                else:
+                    N = plan.stft(n, workers=workers)
+                    N *= np.reshape(plan.ltassWeights(0.0), (N.shape[0], 1))
+        P = np.empty_like(S)
+
+        for cond in conds:
+            # noise scaling: LTASS is only shifted by level
+            noiseGain = np.power(10, (speechLevel - cond['snr'])/20)
+            a = _smoothingFactor(cond['tc'], plan.fsBlock)
+            osf = float(np.maximum(np.minimum(cond['osf'], 2.0), 0.0))
+
+            with condition(conditionLabel(cond, SWEEP_PARAMETERS)):
+                with stage('gain'):
+                    _specSubKernel(S, N, real(noiseGain), real(a), real(a), real(osf), real(floorSubtractFactor),
+                                   real(cond['pow_exp']), np.zeros(S.shape[0], dtype=dtype), np.zeros(S.shape[0], dtype=dtype), P)
+                meter = ASLMeter(fs, preFilter=preFilter) if levelTo is not None else None
+                with stage('istft'):
+                    d = plan.istft(P, signal.shape[0], meter=meter, workers=workers).astype(np.float32, copy=False)
+
+                if meter is None:
+                    yield cond, d
+                    continue
+
+                with stage('leveling'):
+                    asl, act = _meterResult(meter, d, fs, preFilter)
+                    d *= np.power(10, (levelTo - asl) / 20)
+            yield cond, d, (asl, act)
+
+class SpecSubStream:
+    '''
+    Block-wise (streaming) version of applySpecSub() for arbitrarily long recordings.
+
+    Audio is consumed in chunks of any size, the recursive smoothing state, the input history of
+    one frame and the overlap-add tail are kept between calls. Memory is bounded by blockFrames
+    STFT frames. Concatenated output of process() and flush() is equal to applySpecSub() for the
+    same noise realization (i.e. the same state of np.random).
+
+    Usage:
+        stream = SpecSubStream(fs, speechLevel, snr, **kwargs)
+        for block in sf.blocks(wavFile, blocksize=65536):
+            y = stream.process(block)
+        y = stream.flush()
+        fs, speechLevel, snr, kwargs - see applySpecSub() (1-D signals only, noiseStft/noiseSignal are not supported,
+                          noiseShaping='time' only for fs=48 kHz)
+        blockFrames     - max. number of STFT frames processed at once (default: 64)
+    '''
+    def __init__(self, fs, speechLevel, snr, **kwargs):
+        n_fft = kwargs.get('n_fft', 8192)
+        self.pow_exp = float(kwargs.get('pow_exp', 2.0))
+        self.osf = float(np.maximum(np.minimum(kwargs.get('osf', 0.99), 2.0), 0.0))
+        self.floorSubtractFactor = float(np.maximum(kwargs.get('floorSubtractFactor', 0.0), 0.0))
+        self.blockFrames = max(int(kwargs.get('blockFrames', 64)), 1)
+        self.seed = kwargs.get('seed', None)
+        self.noiseShaping = kwargs.get('noiseShaping', 'stft')
+        self.fs = fs
+        self.noiseLevel = speechLevel - snr
+
+        hop_length = _getHopLength(n_fft, kwargs.get('hop_length', None), kwargs.get('overlap', 0.75))
+        plan = getSpecSubPlan(fs, n_fft, hop_length, kwargs.get('window', 'hann'))
+        self.n_fft = plan.n_fft
+        self.hop_length = plan.hop_length
+        fsBlock = _blockRate(fs, plan.n_fft, plan.hop_length,
+                             kwargs.get('overlap', 0.75) if kwargs.get('hop_length', None) is None else None)
+        self._aS = _smoothingFactor(kwargs.get('tcSpeech', 0.100), fsBlock)
+        self._aN = _smoothingFactor(kwargs.get('tcNoise', 0.100), fsBlock)
+
+        # window and LTASS of speech-shaped noise at target level from plan
+        self._window = plan.window
+        self._windowSq = plan.window**2
+        S_ltass = plan.ltassWeights(speechLevel - snr)
+        self._ltass = np.reshape(S_ltass, (S_ltass.shape[0], 1))
+        self._noiseCalibration = plan.noiseCalibration
+
+        self.reset()
+
+    def reset(self):
+        # input history incl. centre padding (n_fft//2 zeros), in padded coordinates
+        self._x = np.zeros(self.n_fft//2)
+        self._n = np.zeros(self.n_fft//2, dtype=np.float32)
+
+        # overlap-add tail and window sum-square, starting at start of next frame
+        self._ola = np.zeros(self.n_fft)
+        self._wss = np.zeros(self.n_fft)
+
+        # noise generator (chunk-wise draws give same realization as applySpecSub())
+        self._rng = None if self.seed is None else np.random.default_rng(self.seed)
+        if self.noiseShaping == 'time':
+            # speech-shaped noise at target level (as LTASS weights), generated in time domain with filter states
+            self._noiseGen = SpeechShapedNoise(self.fs, self.noiseLevel + 20*np.log10(self._noiseCalibration), self._rng)
+        else:
+            self._noiseGen = None
+
+        # states of smoothing (per frequency bin)
+        self._stateY = np.zeros(self._ltass.shape[0])
+        self._stateN = np.zeros(self._ltass.shape[0])
+
+        # complete output samples not yet returned (unpadded coordinates)
+        self._pending = np.zeros(0)
+        self._skip = self.n_fft//2
+
+        self._framesDone = 0
+        self._nbrIn = 0
+        self._nbrOut = 0
+
+    def _processFrames(self, x, n, nbrFrames):
+        n_fft, hop = self.n_fft, self.hop_length
+        frames = sliding_window_view(x, n_fft)[::hop][:nbrFrames]
+        noiseFrames = sliding_window_view(n, n_fft)[::hop][:nbrFrames]
+
+        # STFT of block (frequency x time, as librosa)
+        S = scipy.fft.rfft(self._window * frames, axis=-1).T
+        N = scipy.fft.rfft(self._window * noiseFrames, axis=-1).T.astype(np.complex64)
+        if self._noiseGen is None:
+            N *= self._ltass
+
+        # smoothing (with states across blocks) and gain, in-place
+        _specSubKernel(S, N, 1.0, self._aS, self._aN, self.osf, self.floorSubtractFactor, self.pow_exp,
+                       self._stateY, self._stateN, S)
 
-    # derive parameters from arguments
-    hop_length = int(n_fft * (1-overlap))
-    fsBlock = fs / ((1 - overlap) * n_fft)
+        # inverse transform and overlap-add
+        y = self._window * scipy.fft.irfft(S.T, n=n_fft, axis=-1)
+        olaLen = (nbrFrames-1)*hop + n_fft
+        if self._ola.shape[0] < olaLen:
+            self._ola = np.pad(self._ola, (0, olaLen - self._ola.shape[0]))
+            self._wss = np.pad(self._wss, (0, olaLen - self._wss.shape[0]))
+        for i in range(nbrFrames):
+            self._ola[i*hop:i*hop+n_fft] += y[i]
+            self._wss[i*hop:i*hop+n_fft] += self._windowSq
 
-    # transform input
-    freq = librosa.fft_frequencies(sr=fs, n_fft=n_fft)
-    stft_args = dict(n_fft=n_fft, win_length=n_fft, hop_length=hop_length, window=window, center=True)
-    S = librosa.stft(signal, **stft_args)
+        self._framesDone += nbrFrames
 
-    # generate white noise at 0 dB
-    n = np.random.randn(signal.shape[0]).astype(np.float32)
-    N = librosa.stft(n, **stft_args)
+    def _run(self):
+        # process all complete frames of the input history
+        n_fft, hop = self.n_fft, self.hop_length
+        while self._x.shape[0] >= n_fft:
+            nbrFrames = min((self._x.shape[0] - n_fft)//hop + 1, self.blockFrames)
+            self._processFrames(self._x, self._n, nbrFrames)
+            self._x = self._x[nbrFrames*hop:]
+            self._n = self._n[nbrFrames*hop:]
 
-    # generate speech-shaped noise at target level
-    targetNoiseLevel = speechLevel - snr
-    S_ltass = ltassP50FB(freq, targetLevelDbPa=targetNoiseLevel)
+            # samples before start of next frame are complete
+            self._complete(nbrFrames*hop)
 
-    S_ltass = np.power(10, S_ltass/20)
-    N *= np.repeat(np.reshape(S_ltass, (S_ltass.shape[0],1)), N.shape[1], axis=1)
+    def _complete(self, nbr):
+        # normalize complete samples of overlap-add buffer by window sum-square and move to output
+        y, wss = self._ola[:nbr], self._wss[:nbr]
+        nonzero = wss > np.finfo(wss.dtype).tiny
+        y[nonzero] /= wss[nonzero]
+        self._ola = self._ola[nbr:]
+        self._wss = self._wss[nbr:]
 
-    # combine!
-    Y = S + N
+        # trim centre padding at the start
+        skip = min(self._skip, y.shape[0])
+        self._skip -= skip
+        self._pending = np.concatenate((self._pending, y[skip:]))
 
-    # smooth
-    aS = np.exp(-1/(tcSpeech * fsBlock))
-    aN = np.exp(-1/(tcNoise * fsBlock))
-    absY = lfilter([1-aS], [1, -aS], np.abs(Y), axis=1)
-    absN = lfilter([1-aN], [1, -aN], np.abs(N), axis=1)
+    def _output(self, end):
+        # return pending output samples up to (unpadded) position end
+        nbr = max(min(end, self._nbrIn) - self._nbrOut, 0)
+        y = self._pending[:nbr]
+        self._pending = self._pending[nbr:]
+        self._nbrOut += y.shape[0]
+        return y.astype(np.float32)
 
-    # spectral subtraction, taking into account over-subtraction and minimum noise floor
-    S_est = np.maximum(absY-osf*absN, floorSubtractFactor*absY)
+    def process(self, chunk):
+        '''
+        Consume next chunk of the input signal and return the part of the output that is complete (float32).
+        '''
+        chunk = np.asarray(chunk, dtype=float)
+        if self._noiseGen is None:
+            n = _whiteNoise(chunk.shape, self._rng)
+        else:
+            n = self._noiseGen.generate(chunk.shape[0])
+        self._x = np.concatenate((self._x, chunk))
+        self._n = np.concatenate((self._n, n))
+        self._nbrIn += chunk.shape[0]
+        self._run()
 
-    # Wiener gain
-    G = np.power(S_est**pow_exp/(S_est**pow_exp + absN**pow_exp), 1/pow_exp)
+        # as librosa.istft(), output beyond hop_length*(frames-1) is zero: hold back until flush()
+        return self._output(self.hop_length*(self._framesDone-1))
 
-    # Processed signal/STFT
-    P = S * G
+    def flush(self):
+        '''
+        Finish processing (centre padding at the end) and return remaining output samples (float32).
+        '''
+        padding = np.zeros(self.n_fft//2)
+        self._x = np.concatenate((self._x, padding))
+        self._n = np.concatenate((self._n, padding.astype(np.float32)))
+        self._run()
+        self._complete(self._ola.shape[0])
 
-    # transform back to time domain
-    stft_args.pop('n_fft')
-    degraded = librosa.istft(P, **stft_args)
+        # valid length is hop_length*(frames-1), remainder is zero-padded to input length
+        y = self._output(self.hop_length*(self._framesDone-1))
+        y = np.pad(y, (0, self._nbrIn - self._nbrOut))
+        self._nbrOut = self._nbrIn
+        self.reset()
+        return y
 
-    # zero padding
-    degraded = np.pad(degraded, (0, signal.shape[0]-degraded.shape[0])).astype(np.float32)
+def applySpecSubBlocks(blocks, fs, speechLevel, snr, **kwargs):
+    '''
+    Generator: streaming applySpecSub() for an iterable of signal blocks (e.g. soundfile.blocks()).
+    Output blocks are delayed by the STFT and may differ in size from the input blocks.
+    '''
+    stream = SpecSubStream(fs, speechLevel, snr, **kwargs)
+    for block in blocks:
+        y = stream.process(block)
+        if y.shape[0] > 0:
+            yield y
 
-    return degraded
+    yield stream.flush()
 
 if __name__ == "__main__":
     pass
@@ -10,7 +10,7 @@ https://github.com/openitu/STL/blob/ITU_submission_2022/src/p50fbmnru/filtering_
 
 from typing import Tuple
 import numpy as np
-from scipy.signal import convolve
+from numpy.polynomial.polynomial import polyval
 
 BA = Tuple[np.ndarray, np.ndarray]
 FS = 48000
@@ -282,12 +282,26 @@ def getFIRCoeffsP50() -> BA:
 
     return np.array(b_fir), np.array(a_fir)
 
-def getCoeffsP50() -> BA:
+def _combineCoeffsP50() -> BA:
     b_iir, a_iir = getIIRCoeffsP50()
     b_fir, a_fir = getFIRCoeffsP50()
-    a = convolve(a_fir, a_iir)
-    b = convolve(b_fir, b_iir)
+    a = np.convolve(a_fir, a_iir)
+    b = np.convolve(b_fir, b_iir)
+    b.flags.writeable = False
+    a.flags.writeable = False
     return b, a
 
+# combined FIR/IIR coefficients, built once at import
+_COEFFS_P50 = _combineCoeffsP50()
+
+def getCoeffsP50() -> BA:
+    # combined coefficients of P.50 FB filter (read-only arrays)
+    return _COEFFS_P50
+
+def freqResponse(b, a, freq, fs=FS):
+    # complex frequency response at freq (Hz), same as scipy.signal.freqz(b, a, freq, fs=fs)[1] (without scipy.signal)
+    zm1 = np.exp(-1j * (2*np.pi*np.atleast_1d(freq)/fs))
+    return polyval(zm1, b, tensor=False) / polyval(zm1, a, tensor=False)
+
 if __name__ == "__main__":
     pass
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy numba compilation: numba is only imported (and kernels compiled or loaded from its on-disk cache)
+on first call, so importing modules with kernels stays cheap for workers and command line calls
+"""
+
+import os
+import functools
+import threading
+
+# compilation of lazy kernels (incl. replacement of globals) by one thread at a time
+_compileLock = threading.RLock()
+
+# running background warm-ups (see warmup())
+_warmups = set()
+_warmupsLock = threading.Lock()
+
+class _LazyDispatcher:
+    def __init__(self, func, options):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.options = options
+        self._dispatcher = None
+
+    @property
+    def dispatcher(self):
+        # compiled function, lazy kernels called by func are compiled first and replaced in its globals
+        # (numba resolves them at compile time)
+        if self._dispatcher is None:
+            with _compileLock:
+                if self._dispatcher is None:
+                    from numba import jit
+                    for name in self.func.__code__.co_names:
+                        value = self.func.__globals__.get(name, None)
+                        if isinstance(value, _LazyDispatcher) and (value is not self):
+                            self.func.__globals__[name] = value.dispatcher
+                    self._dispatcher = jit(**self.options)(self.func)
+        return self._dispatcher
+
+    def __call__(self, *args, **kwargs):
+        return self.dispatcher(*args, **kwargs)
+
+def warmup(func, *args, background=False, **kwargs):
+    '''
+    Call func(*args, **kwargs), e.g. lazy kernels on small inputs (numba import, compilation or load from its
+    on-disk cache), now or in a background (daemon) thread. Calls of the same kernels during a background
+    warm-up wait for it (numba compiles each signature once). Forks of the process (e.g. workers of a
+    ProcessPoolExecutor with start method 'fork') wait for running warm-ups: a child would inherit locks of
+    numba or of imports held by the warm-up thread and block forever.
+
+    Usage:
+        thread = warmup(kernel, np.zeros(16), background=True)  # e.g. while loading files
+        result = warmup(kernel, np.zeros(16))
+    Returns:
+        thread (background=True, see threading.Thread.join()) or result of func
+    '''
+    if not background:
+        return func(*args, **kwargs)
+
+    def run():
+        try:
+            func(*args, **kwargs)
+        finally:
+            with _warmupsLock:
+                _warmups.discard(thread)
+
+    thread = threading.Thread(target=run, name='warmup', daemon=True)
+    with _warmupsLock:
+        _warmups.add(thread)
+    thread.start()
+    return thread
+
+def waitForWarmup(timeout: float = None):
+    # wait for running background warm-ups (of other threads)
+    with _warmupsLock:
+        threads = [thread for thread in _warmups if thread is not threading.current_thread()]
+    for thread in threads:
+        thread.join(timeout)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=waitForWarmup)
+
+def lazyJit(**options):
+    '''
+    Decorator as numba.jit(**options), compiled on first call (or on access of .dispatcher, e.g. to warm up workers).
+
+    Usage:
+        @lazyJit(nopython=True, cache=True)
+        def kernel(x): ...
+    '''
+    def decorator(func):
+        return _LazyDispatcher(func, options)
+    return decorator
+
+
+if __name__ == "__main__":
+    pass
@@ -7,26 +7,43 @@ Created on Jan 05 2023 10:31
 Calculation of long-term average speech spectrum
 """
 
+from functools import lru_cache
 import numpy as np
-from scipy.interpolate import interp1d
-from scipy.signal import freqz
 from warnings import warn
 
-from .coeffs import getCoeffsP50, FS
+from .coeffs import getCoeffsP50, freqResponse, FS
 
-def ltassP50FB(freq, targetLevelDbPa=-4.7, **kwargs):
-    minDb = kwargs.get('minDb', -100.0)
+@lru_cache(maxsize=32)
+def _ltassP50FB(freqKey: bytes, minDb):
+    # LTASS (dB) and its level for one frequency grid, frequency response is only evaluated once per (grid, minDb)
+    freq = np.frombuffer(freqKey, dtype=float)
     b, a = getCoeffsP50()
-    f, S = freqz(b, a, freq, fs=FS)
+    S = freqResponse(b, a, freq, fs=FS)
     S = 20*np.log10(np.maximum(S, np.power(10, minDb/20)))
+    levelDbPa = 10 * np.log10(np.sum(np.power(10, S / 10) / freq.shape[0]))
+
+    S.flags.writeable = False
+    return S, levelDbPa
+
+def ltassP50FB(freq, targetLevelDbPa=-4.7, **kwargs):
+    minDb = kwargs.get('minDb', -100.0)
+    S, levelDbPa = _ltassP50FB(np.ascontiguousarray(freq, dtype=float).tobytes(), float(minDb))
 
     # scale to target level
-    levelDbPa = 10 * np.log10(np.sum(np.power(10, S / 10) / freq.shape[0]))
     diff = targetLevelDbPa - levelDbPa
     return S + diff
 
+def ltassP50FBLevels(freq, targetLevelsDbPa, **kwargs):
+    # ltassP50FB() for many target levels at once (levels x frequencies)
+    minDb = kwargs.get('minDb', -100.0)
+    S, levelDbPa = _ltassP50FB(np.ascontiguousarray(freq, dtype=float).tobytes(), float(minDb))
+
+    diff = np.asarray(targetLevelsDbPa, dtype=float) - levelDbPa
+    return S[np.newaxis, :] + np.reshape(diff, (-1, 1))
+
 def ltassP50(freq, freq_lower=None, freq_upper=None, fmin=100, fmax=8000, targetLevelDbPa=-4.7):
     warn('Function ltassP50() is deprecated - works only up to 8 kHz', DeprecationWarning, stacklevel=2)
+    from scipy.interpolate import interp1d
 
     freq = np.maximum(freq, 1.0) # avoid f=0
     if freq_lower is None:
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Fast objective quality proxies (no license needed) for pre-screening of degraded conditions:
+segmental SNR, log-spectral distance and band-limited spectral distortion (P.50-weighted),
+vectorized over many reference/degraded pairs. Degraded signals are level-aligned to the
+reference by their active speech levels (P.56), active parts are selected relative to the ASL.
+"""
+
+from functools import lru_cache
+from typing import List, Sequence, Union
+import numpy as np
+import pandas
+
+from .coeffs import getCoeffsP50, freqResponse, FS
+
+EPS = 1e-12
+
+def _stack(signals: Union[np.ndarray, Sequence[np.ndarray]]):
+    # signals (N x samples) with zero padding and valid lengths
+    if isinstance(signals, np.ndarray):
+        signals = np.atleast_2d(signals)
+        return signals.astype(float), np.full(signals.shape[0], signals.shape[-1])
+
+    lengths = np.array([len(s) for s in signals])
+    x = np.zeros((len(signals), lengths.max()))
+    for i, s in enumerate(signals):
+        x[i, :lengths[i]] = s
+    return x, lengths
+
+def _asl(x: np.ndarray, lengths, fs):
+    # active speech level (dB) per signal, NaN if no activity
+    from p56.asl import calculateP56ASL, ASLException
+    asl = np.full(x.shape[0], np.nan)
+    for i in range(x.shape[0]):
+        try:
+            asl[i] = calculateP56ASL(x[i, :lengths[i]], fs)[0]
+        except ASLException:
+            pass
+    return asl
+
+def _alignLevels(ref, deg, lengths, fs):
+    # scale degraded signals to ASL of references
+    aslRef = _asl(ref, lengths, fs)
+    aslDeg = _asl(deg, lengths, fs)
+    gain = np.power(10, np.nan_to_num(aslRef - aslDeg) / 20)
+    return deg * gain[:, np.newaxis], aslRef, aslDeg
+
+def _segmentalSNR(ref, deg, lengths, aslRef, fs, frameLength=0.02, minDb=-10.0, maxDb=35.0, margin=15.9):
+    # mean of frame SNRs (clipped to [minDb, maxDb]) over active frames (frame level > ASL - margin)
+    L = int(frameLength * fs)
+    nbrFrames = ref.shape[-1] // L
+    r = ref[:, :nbrFrames*L].reshape(ref.shape[0], nbrFrames, L)
+    e = (ref - deg)[:, :nbrFrames*L].reshape(ref.shape[0], nbrFrames, L)
+    powRef = np.mean(np.power(r, 2), axis=-1)
+    powErr = np.mean(np.power(e, 2), axis=-1)
+    snr = np.clip(10*np.log10((powRef + EPS) / (powErr + EPS)), minDb, maxDb)
+
+    valid = np.arange(nbrFrames)[np.newaxis, :] < (lengths // L)[:, np.newaxis]
+    active = valid & (10*np.log10(powRef + EPS) > (aslRef - margin)[:, np.newaxis])
+    return np.sum(snr * active, axis=-1) / np.maximum(np.sum(active, axis=-1), 1)
+
+@lru_cache(maxsize=16)
+def _bandWeights(fs, n_fft, fLow, fHigh):
+    # P.50 FB long-term speech spectrum (power, normalized) as weights within [fLow, fHigh]
+    freq = np.fft.rfftfreq(n_fft, 1/fs)
+    H = freqResponse(*getCoeffsP50(), freq, fs=FS)
+    w = np.power(np.abs(H), 2) * ((freq >= fLow) & (freq <= fHigh) & (freq < FS/2))
+    return w / np.sum(w)
+
+def _spectralMetrics(ref, deg, lengths, fs, n_fft=1024, hop_length=256, band=(50.0, 14000.0), dynamicRange=40.0):
+    # log-spectral distance (mean over active frames) and band-limited, P.50-weighted distortion of long-term spectra
+    from degradeSpecSub import getSpecSubPlan
+    plan = getSpecSubPlan(fs, n_fft, hop_length)
+    R = np.power(np.abs(plan.stft(ref)), 2)
+    D = np.power(np.abs(plan.stft(deg)), 2)
+
+    # active frames: within dynamicRange of loudest frame of reference
+    nbrFrames = R.shape[-1]
+    frameLevel = 10*np.log10(np.sum(R, axis=-2) + EPS)
+    valid = np.arange(nbrFrames)[np.newaxis, :] < np.array([plan.nbrFrames(n) for n in lengths])[:, np.newaxis]
+    maxLevel = np.max(np.where(valid, frameLevel, -np.inf), axis=-1, keepdims=True)
+    active = valid & (frameLevel > maxLevel - dynamicRange)
+    nbrActive = np.maximum(np.sum(active, axis=-1), 1)
+
+    diff = 10*np.log10((R + EPS) / (D + EPS))
+    lsdFrames = np.sqrt(np.mean(np.power(diff, 2), axis=-2))
+    lsd = np.sum(lsdFrames * active, axis=-1) / nbrActive
+
+    # long-term spectra of active frames
+    mask = active[:, np.newaxis, :]
+    LR = 10*np.log10(np.sum(R * mask, axis=-1) / nbrActive[:, np.newaxis] + EPS)
+    LD = 10*np.log10(np.sum(D * mask, axis=-1) / nbrActive[:, np.newaxis] + EPS)
+    w = _bandWeights(fs, n_fft, band[0], band[1])
+    bsd = np.sqrt(np.sum(w * np.power(LR - LD, 2), axis=-1))
+    return lsd, bsd
+
+def qualityMetrics(ref, deg, fs=FS, names: List = None, **kwargs) -> pandas.DataFrame:
+    '''
+    Objective quality proxies for many (reference, degraded) pairs at once.
+
+    Usage:
+        df = qualityMetrics([s1, s2], [d1, d2], fs, names=['German', 'English'])
+        ref, deg      - references and time-aligned degraded signals: lists of 1-D arrays (pairs of equal
+                        length) or arrays (N x samples)
+        fs            - sampling frequency
+        names         - index of result (default: 0...N-1)
+        batchSize     - number of pairs processed at once (bounded memory, default: 16)
+        levelAlign    - scale degraded to ASL of reference before comparison (default: True)
+        frameLength, minDb, maxDb - segmental SNR (default: 20 ms, -10 dB, 35 dB)
+        n_fft, hop_length, band   - spectral metrics (default: 1024, 256, (50, 14000) Hz)
+    Returns:
+        DataFrame with columns SegSNR (dB), LSD (dB), BSD (dB), ASLRef, ASLDeg (dB, before alignment)
+    '''
+    batchSize = max(int(kwargs.get('batchSize', 16)), 1)
+    levelAlign = kwargs.get('levelAlign', True)
+    snrArgs = {k: kwargs[k] for k in ['frameLength', 'minDb', 'maxDb'] if k in kwargs}
+    specArgs = {k: kwargs[k] for k in ['n_fft', 'hop_length', 'band'] if k in kwargs}
+
+    nbrItems = len(ref)
+    if len(deg) != nbrItems:
+        raise ValueError('Number of reference (%d) and degraded signals (%d) does not match' % (nbrItems, len(deg)))
+
+    results = []
+    for b0 in range(0, nbrItems, batchSize):
+        r, lengths = _stack(ref[b0:b0 + batchSize])
+        d, lengthsDeg = _stack(deg[b0:b0 + batchSize])
+        if np.any(lengths != lengthsDeg) or (r.shape != d.shape):
+            raise ValueError('Reference and degraded signals must have equal lengths')
+
+        if levelAlign:
+            d, aslRef, aslDeg = _alignLevels(r, d, lengths, fs)
+        else:
+            aslRef, aslDeg = _asl(r, lengths, fs), _asl(d, lengths, fs)
+
+        segSnr = _segmentalSNR(r, d, lengths, aslRef, fs, **snrArgs)
+        lsd, bsd = _spectralMetrics(r, d, lengths, fs, **specArgs)
+        results.append(np.column_stack((segSnr, lsd, bsd, aslRef, aslDeg)))
+
+    return pandas.DataFrame(np.vstack(results), columns=['SegSNR', 'LSD', 'BSD', 'ASLRef', 'ASLDeg'],
+                            index=names if names is not None else np.arange(nbrItems))
+
+
+if __name__ == "__main__":
+    pass
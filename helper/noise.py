@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Speech-shaped noise (ITU-T P.50 FB spectrum) generated in time domain with the filter of coeffs.py
+"""
+
+from math import gcd
+from functools import lru_cache
+import numpy as np
+
+from .coeffs import getCoeffsP50, getFIRCoeffsP50, getIIRCoeffsP50, freqResponse, FS
+
+# samples discarded at the start (settling of FIR and IIR part of the filter)
+WARMUP = 2048
+
+def _rng(seed=None):
+    # None: global np.random state, else seed (int) or np.random.Generator
+    return np.random if seed is None else np.random.default_rng(seed)
+
+@lru_cache(maxsize=16)
+def _filterGain(fs=FS, nbrPoints=2**16):
+    # RMS gain of P.50 FB filter for white noise within the band of fs (mean power of frequency response)
+    b, a = getCoeffsP50()
+    f = np.linspace(0, FS/2, nbrPoints, endpoint=False)
+    H = freqResponse(b, a, f, fs=FS)
+    return np.sqrt(np.sum(np.power(np.abs(H[f < fs/2]), 2)) / nbrPoints)
+
+def _resampleFactors(fs):
+    g = gcd(int(fs), FS)
+    return int(fs) // g, FS // g
+
+def speechShapedNoise(shape, fs=FS, level=0.0, seed=None, **kwargs):
+    '''
+    Speech-shaped noise by filtering white noise with the P.50 FB filter (FIR part by FFT convolution,
+    IIR part by lfilter). Generated at 48 kHz and resampled for other sampling frequencies.
+
+    Usage:
+        n = speechShapedNoise(s.shape, fs, level=-26.0, seed=1)
+        shape       - number of samples or shape (... x samples), independent noise per channel
+        fs          - sampling frequency
+        level       - RMS level (dB re 1.0) within band of fs, expected value (0 dB: same level as white noise
+                      of unit variance; applySpecSub() scales it to the level of its LTASS weights at 0 dB, see
+                      SpecSubPlan.noiseCalibration)
+        seed        - None (global np.random state), int or np.random.Generator
+        exactLevel  - scale each channel to level exactly (default: False)
+        dtype       - output data type (default: np.float32)
+    '''
+    from scipy.signal import lfilter, oaconvolve, resample_poly
+    exactLevel = kwargs.get('exactLevel', False)
+    dtype = kwargs.get('dtype', np.float32)
+
+    shape = tuple(np.atleast_1d(shape).tolist())
+    nbrSamples = shape[-1]
+    up, down = _resampleFactors(fs)
+    nbrSamplesFS = -(-nbrSamples * down // up) + (2*down if up != down else 0)
+
+    # white noise incl. warm-up of filter
+    w = _rng(seed).standard_normal(shape[:-1] + (WARMUP + nbrSamplesFS,))
+
+    # FIR part (causal, truncated convolution), then IIR part
+    b_fir, _ = getFIRCoeffsP50()
+    b_fir = np.reshape(b_fir, (1,) * (w.ndim - 1) + (-1,))
+    n = oaconvolve(w, b_fir, mode='full', axes=-1)[..., :w.shape[-1]]
+    b_iir, a_iir = getIIRCoeffsP50()
+    n = lfilter(b_iir, a_iir, n, axis=-1)[..., WARMUP:]
+
+    if up != down:
+        n = resample_poly(n, up, down, axis=-1)
+    n = n[..., :nbrSamples]
+
+    # calibration
+    if exactLevel:
+        n /= np.sqrt(np.mean(np.power(n, 2), axis=-1, keepdims=True))
+    else:
+        n /= _filterGain(fs)
+    n *= np.power(10, level/20)
+    return n.astype(dtype)
+
+class SpeechShapedNoise:
+    '''
+    Streaming version of speechShapedNoise() at 48 kHz (filter states kept between calls), e.g. for SpecSubStream.
+    Concatenated output of generate() is (up to rounding) equal to speechShapedNoise() with the same seed.
+
+    Usage:
+        gen = SpeechShapedNoise(level=-26.0, seed=1)
+        n = gen.generate(1024)
+        level, seed - see speechShapedNoise()
+    '''
+    def __init__(self, fs=FS, level=0.0, seed=None):
+        if fs != FS:
+            raise ValueError('SpeechShapedNoise only supports fs=%d Hz (got %s)' % (FS, fs))
+        self.fs = fs
+        self.level = level
+        self.seed = seed
+        self._gain = np.power(10, level/20) / _filterGain(fs)
+        self.reset()
+
+    def reset(self):
+        self._rng = _rng(self.seed)
+        self._bFir, _ = getFIRCoeffsP50()
+        self._bIir, self._aIir = getIIRCoeffsP50()
+        self._ziFir = np.zeros(self._bFir.shape[0] - 1)
+        self._ziIir = np.zeros(2)
+        self._filter(WARMUP)
+
+    def _filter(self, nbrSamples):
+        from scipy.signal import lfilter
+        w = self._rng.standard_normal(nbrSamples)
+        n, self._ziFir = lfilter(self._bFir, [1.0], w, zi=self._ziFir)
+        n, self._ziIir = lfilter(self._bIir, self._aIir, n, zi=self._ziIir)
+        return n
+
+    def generate(self, nbrSamples, dtype=np.float32):
+        return (self._gain * self._filter(nbrSamples)).astype(dtype)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Optional stage-level profiling (wall time, CPU time, allocated bytes) of the degradation pipeline.
+
+Stages are marked in the code with 'with stage(name):'. Without an enabled profiler, stage() returns
+a shared no-op context manager (one global lookup per stage, nothing is recorded).
+
+Usage:
+    with profiling(memory=True) as prof:
+        with condition('snr=5'):
+            d = applySpecSub(s, fs, -26.0, 5.0)
+    print(prof.summary())
+
+    # worker processes: return prof.records with the results, main process: prof.merge(records)
+
+The active profiler is per thread (worker threads enable their own profiler and return its records like
+worker processes). Memory tracing (tracemalloc) is process-wide: allocations of concurrent threads are
+included in the allocated bytes of a stage.
+"""
+
+import os
+import time
+import threading
+import numbers
+import tracemalloc
+from contextlib import contextmanager
+from typing import List, Tuple
+
+# columns of records (one record per executed stage)
+RECORD_COLUMNS = ['Stage', 'Condition', 'Process', 'Depth', 'WallTime', 'CPUTime', 'AllocatedBytes']
+
+# active profiler of each thread (attribute 'profiler', missing or None: disabled)
+_local = threading.local()
+
+class _NoStage:
+    # no-op context manager of stage()/condition() if profiling is disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NO_STAGE = _NoStage()
+
+class _Stage:
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        prof = self.profiler
+        if prof.memory:
+            # peak of enclosing stage so far, then peak of this stage only
+            current, peak = tracemalloc.get_traced_memory()
+            if len(prof._stack) > 0:
+                prof._stack[-1].peak = max(prof._stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.start, self.peak = current, current
+
+        prof._stack.append(self)
+        self.wall, self.cpu = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *args):
+        wall, cpu = time.perf_counter() - self.wall, time.process_time() - self.cpu
+        prof = self.profiler
+        prof._stack.pop()
+
+        allocated = 0
+        if prof.memory:
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(self.peak, peak)
+            allocated = peak - self.start
+            if len(prof._stack) > 0:
+                prof._stack[-1].peak = max(prof._stack[-1].peak, peak)
+
+        prof.records.append((self.name, prof.currentCondition, os.getpid(), len(prof._stack), wall, cpu, allocated))
+        return False
+
+class StageProfiler:
+    '''
+    Records wall time, CPU time and allocated bytes (peak of traced allocations above start, only if
+    memory=True, uses tracemalloc) per stage and condition. Nested stages are inclusive.
+    '''
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.records: List[Tuple] = []
+        self._stack = []
+        self._conditions = []
+
+    @property
+    def currentCondition(self):
+        return self._conditions[-1] if len(self._conditions) > 0 else None
+
+    def stage(self, name: str):
+        return _Stage(self, name)
+
+    @contextmanager
+    def condition(self, label):
+        self._conditions.append(str(label))
+        try:
+            yield self
+        finally:
+            self._conditions.pop()
+
+    def merge(self, records):
+        # add records of other profiler (e.g. from worker process)
+        if isinstance(records, StageProfiler):
+            records = records.records
+        self.records.extend([tuple(r) for r in records])
+        return self
+
+    def dataFrame(self) -> 'pandas.DataFrame':
+        import pandas # imported on demand (not needed while recording)
+        return pandas.DataFrame(self.records, columns=RECORD_COLUMNS)
+
+    def summary(self, byCondition=False) -> 'pandas.DataFrame':
+        '''
+        Summary table per stage (or per stage and condition): number of calls, total/mean wall time,
+        CPU time, max. allocated bytes and share of total wall time of top-level stages (nested stages
+        are included in the time of their enclosing stage).
+        '''
+        keys = ['Stage', 'Condition'] if byCondition else ['Stage']
+        df = self.dataFrame().fillna({'Condition': ''})
+        summary = df.groupby(keys).agg(Calls=('WallTime', 'size'), WallTime=('WallTime', 'sum'),
+                                       MeanWallTime=('WallTime', 'mean'), CPUTime=('CPUTime', 'sum'),
+                                       AllocatedBytes=('AllocatedBytes', 'max'))
+        summary['WallShare'] = summary['WallTime'] / max(df.loc[df['Depth'] == 0, 'WallTime'].sum(), 1e-12)
+        return summary.sort_values('WallTime', ascending=False)
+
+def conditionLabel(params: dict, keys=None) -> str:
+    # label of condition, e.g. 'n_fft=8192,hop_length=2048,snr=5'
+    keys = params.keys() if keys is None else keys
+    return ','.join(['%s=%s' % (k, ('%g' % params[k]) if isinstance(params[k], numbers.Number) else params[k]) for k in keys])
+
+def stage(name: str):
+    # context manager for one stage of processing (no-op if profiling is disabled)
+    prof = getattr(_local, 'profiler', None)
+    if prof is None:
+        return _NO_STAGE
+    return prof.stage(name)
+
+def condition(label):
+    # context manager: all stages within are assigned to condition <label> (no-op if profiling is disabled)
+    prof = getattr(_local, 'profiler', None)
+    if prof is None:
+        return _NO_STAGE
+    return prof.condition(label)
+
+def getProfiler() -> StageProfiler:
+    return getattr(_local, 'profiler', None)
+
+def enableProfiling(memory=False) -> StageProfiler:
+    # enable new profiler in this thread
+    _local.profiler = StageProfiler(memory)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _local.profiler
+
+def disableProfiling() -> StageProfiler:
+    # disable profiler in this thread, returns profiler with its records
+    prof, _local.profiler = getProfiler(), None
+    if (prof is not None) and prof.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return prof
+
+@contextmanager
+def profiling(memory=False, enabled=True):
+    # enable profiler within context (previous profiler is restored afterwards), yields None if not enabled
+    if not enabled:
+        yield None
+        return
+
+    previous = getProfiler()
+    wasTracing = tracemalloc.is_tracing()
+    prof = enableProfiling(memory)
+    try:
+        yield prof
+    finally:
+        _local.profiler = previous
+        if memory and not wasTracing:
+            tracemalloc.stop()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+STFT/ISTFT on scipy.fft, same framing and scaling as librosa.stft()/librosa.istft() with center=True
+(zero padding), without importing librosa
+"""
+
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+import numpy as np
+import scipy.fft
+from numpy.lib.stride_tricks import sliding_window_view
+
+# number of cached ISTFT envelopes per transform (different signal lengths)
+ENVELOPE_CACHE_SIZE = 4
+
+def getWindow(window, n_fft):
+    # periodic window as librosa.filters.get_window(window, n_fft, fftbins=True): name, tuple or array
+    if isinstance(window, str) and window in ('hann', 'hanning'):
+        return 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n_fft) / n_fft)
+    if callable(window):
+        return np.asarray(window(n_fft))
+    if isinstance(window, (np.ndarray, list)):
+        if len(window) != n_fft:
+            raise ValueError('Window size mismatch: %d != %d' % (len(window), n_fft))
+        return np.asarray(window, dtype=float)
+
+    from scipy.signal import get_window
+    return get_window(window, n_fft, fftbins=True)
+
+class STFT:
+    '''
+    Batched real FFTs on blocks of frames with cached ISTFT normalization envelopes (per number of frames).
+    Only block-sized work buffers (bounded by blockBytes) are kept between calls, per thread, so one instance
+    can be used by many threads at once (FFTs and kernels release the GIL). Signal-sized arrays (padded input,
+    STFT, overlap-add output) are allocated per call and released when the result is.
+
+    Usage:
+        tf = getSTFT(n_fft, hop_length)
+        X = tf.stft(x)              # (... x samples) to (... x frequency x frames)
+        y = tf.istft(X, length)     # (... x frequency x frames) to (... x length)
+        dtype       - precision of transforms and buffers: np.float64 (default) or np.float32 (complex64 STFTs)
+    '''
+    def __init__(self, n_fft=2048, hop_length=512, window='hann', blockBytes=2**22, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError('Unsupported dtype: %s (float32 or float64)' % self.dtype)
+        self.n_fft = int(n_fft)
+        self.hop_length = int(hop_length)
+        self.nbrBins = self.n_fft // 2 + 1
+        self.window = getWindow(window, self.n_fft).astype(self.dtype)
+
+        # number of frames per FFT block (bounded memory of temporary buffers)
+        self.blockFrames = max(int(blockBytes // (8 * self.n_fft)), 1)
+        self._envelopes = OrderedDict()
+        self._envelopeLock = threading.Lock()
+        self._local = threading.local()
+
+    def _buffer(self, name, shape, dtype):
+        # preallocated (reused) block-sized work buffer of calling thread
+        buffers = getattr(self._local, 'buffers', None)
+        if buffers is None:
+            buffers = self._local.buffers = dict()
+        buf = buffers.get(name, None)
+        if (buf is None) or (buf.shape != shape) or (buf.dtype != dtype):
+            buf = np.zeros(shape, dtype=dtype)
+            buffers[name] = buf
+        return buf
+
+    def nbrFrames(self, length):
+        return 1 + (length + 2*(self.n_fft//2) - self.n_fft) // self.hop_length
+
+    def complexType(self, dtype):
+        # type of STFT of a signal of type dtype (complex of input precision, at most precision of transform)
+        return np.result_type(dtype, np.complex64) if self.dtype == np.float64 else np.dtype(np.complex64)
+
+    def envelope(self, nbrFrames):
+        # reciprocal of window sum-square for overlap-add of nbrFrames frames (0 where not defined),
+        # cached for the last ENVELOPE_CACHE_SIZE numbers of frames (size of one real signal each)
+        with self._envelopeLock:
+            env = self._envelopes.get(nbrFrames, None)
+            if env is not None:
+                self._envelopes.move_to_end(nbrFrames)
+        if env is None:
+            wss = np.zeros((1, self.n_fft + self.hop_length*(nbrFrames-1)))
+            self._overlapAdd(wss, np.broadcast_to(self.window**2, (1, nbrFrames, self.n_fft)))
+            env = np.zeros_like(wss[0])
+            nonzero = wss[0] > np.finfo(wss.dtype).tiny
+            env[nonzero] = 1.0 / wss[0, nonzero]
+            env = env.astype(self.dtype, copy=False)
+            with self._envelopeLock:
+                self._envelopes[nbrFrames] = env
+                while len(self._envelopes) > ENVELOPE_CACHE_SIZE:
+                    self._envelopes.popitem(last=False)
+        return env
+
+    def _overlapAdd(self, y, frames, offset=0):
+        # add frames (channels x nbrFrames x n_fft) into y (channels x samples), starting at frame index offset
+        n_fft, hop = self.n_fft, self.hop_length
+        nbrFrames = frames.shape[-2]
+        if n_fft % hop == 0:
+            # vectorized: one add per hop-sized segment of the frame
+            y = y[:, offset*hop:(offset + nbrFrames - 1)*hop + n_fft].reshape(y.shape[0], -1, hop)
+            for r in range(n_fft // hop):
+                y[:, r:r+nbrFrames] += frames[..., r*hop:(r+1)*hop]
+        else:
+            for i in range(nbrFrames):
+                y[:, (offset+i)*hop:(offset+i)*hop+n_fft] += frames[:, i]
+
+    def stft(self, x, out=None, workers=None):
+        '''
+        STFT of signal x (... x samples) to (... x frequency x frames, see complexType()),
+        same as librosa.stft(center=True). Leading dimensions (channels) are transformed together,
+        out (if given) must be C-contiguous. workers: see scipy.fft.rfft() (default: 1 or scipy.fft.set_workers()).
+        '''
+        n_fft, hop = self.n_fft, self.hop_length
+        length = x.shape[-1]
+        nbrFrames = self.nbrFrames(length)
+        if out is None:
+            out = np.empty(x.shape[:-1] + (self.nbrBins, nbrFrames), dtype=self.complexType(x.dtype))
+
+        # channels x samples, centre padding (zeros)
+        x = np.reshape(x, (-1, length))
+        nbrChannels = x.shape[0]
+        xp = np.zeros((nbrChannels, length + 2*(n_fft//2)), dtype=x.dtype)
+        xp[:, n_fft//2:n_fft//2 + length] = x
+        frames = sliding_window_view(xp, n_fft, axis=-1)[:, ::hop]
+
+        blockFrames = max(self.blockFrames // nbrChannels, 1)
+        frameBuffer = self._buffer('stft_frames', (nbrChannels, blockFrames, n_fft), self.dtype)
+        outView = out.reshape(nbrChannels, self.nbrBins, nbrFrames)
+        for b0 in range(0, nbrFrames, blockFrames):
+            b1 = min(b0 + blockFrames, nbrFrames)
+            buf = np.multiply(frames[:, b0:b1], self.window, out=frameBuffer[:, :b1-b0])
+            outView[..., b0:b1] = scipy.fft.rfft(buf, axis=-1, overwrite_x=True, workers=workers).transpose(0, 2, 1)
+
+        return out
+
+    def istft(self, X, length, meter=None, workers=None):
+        '''
+        Inverse STFT (... x frequency x frames) to signal (... x length), same as librosa.istft(center=True)
+        with zero padding to length. workers: see stft().
+        meter (optional, single channel only): e.g. p56.asl.ASLMeter, its process() is called with the output
+        samples (float32, incl. zero padding) as soon as they are complete, i.e. within the overlap-add pass.
+        '''
+        n_fft, hop = self.n_fft, self.hop_length
+        nbrFrames = X.shape[-1]
+        leading = X.shape[:-2]
+        X = np.reshape(X, (-1,) + X.shape[-2:])
+        nbrChannels = X.shape[0]
+        if (meter is not None) and (nbrChannels != 1):
+            raise ValueError('Meter only supported for single channel (got %d channels)' % nbrChannels)
+        y = np.zeros((nbrChannels, n_fft + hop*(nbrFrames-1)), dtype=self.dtype)
+        env = self.envelope(nbrFrames)
+
+        # valid length is hop_length*(frames-1) after trimming of centre padding
+        validLen = min(max(hop*(nbrFrames-1), 0), length)
+        start, stop = n_fft//2, n_fft//2 + validLen
+        done = 0 # samples of y complete (incl. envelope)
+
+        blockFrames = max(self.blockFrames // nbrChannels, 1)
+        for b0 in range(0, nbrFrames, blockFrames):
+            b1 = min(b0 + blockFrames, nbrFrames)
+            frames = scipy.fft.irfft(X[..., b0:b1].transpose(0, 2, 1).astype(self.complexType(X.dtype), copy=False),
+                                     n=n_fft, axis=-1, overwrite_x=True, workers=workers)
+            frames *= self.window
+            self._overlapAdd(y, frames, offset=b0)
+
+            # samples before start of next frame are complete
+            end = b1*hop if b1 < nbrFrames else y.shape[-1]
+            y[:, done:end] *= env[done:end]
+            if (meter is not None) and (min(end, stop) > max(done, start)):
+                meter.process(y[0, max(done, start):min(end, stop)].astype(np.float32))
+            done = end
+
+        # trim centre padding, zero padding to length
+        out = np.zeros((nbrChannels, length), dtype=y.dtype)
+        out[:, :validLen] = y[:, start:stop]
+        if (meter is not None) and (length > validLen):
+            meter.process(np.zeros(length - validLen, dtype=np.float32))
+        return out.reshape(leading + (length,))
+
+@lru_cache(maxsize=16)
+def getSTFT(n_fft=2048, hop_length=512, window='hann', dtype='float64'):
+    # cached transform per setting
+    return STFT(n_fft, hop_length, window, dtype=dtype)
+
+def stft(x, n_fft=2048, hop_length=512, window='hann'):
+    # same as librosa.stft(x, n_fft=n_fft, hop_length=hop_length, window=window, center=True)
+    return getSTFT(n_fft, hop_length, window).stft(np.asarray(x))
+
+def istft(X, hop_length=512, window='hann', length=None):
+    # same as librosa.istft(X, hop_length=hop_length, window=window, center=True), zero padded to length
+    n_fft = 2 * (X.shape[-2] - 1)
+    if length is None:
+        length = hop_length * (X.shape[-1] - 1)
+    return getSTFT(n_fft, hop_length, window).istft(X, length)
+
+
+if __name__ == "__main__":
+    pass
@@ -5,17 +5,38 @@ Created on Jun 23 2021 13:04
 @author: Jan.Reimes
 """
 
+import os
+from pathlib import Path
+from typing import List, Union
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from numba import jit
-from scipy.signal import lfilter
 
-from p56.prefilter import P56Prefilter, PrefilterP56, getFilter, applyFilters
+from helper.jit import lazyJit
+from helper.profiling import stage
+from p56.prefilter import P56Prefilter, PrefilterP56, getFilter, getFilterSos, applyFilters, applyFiltersSos
 
 
 class ASLException(Exception):
     pass
 
-@jit(nopython=True)
+@lazyJit(nopython=True, nogil=True, cache=True)
+def _getActivity(q, c, a, hang, I):
+    # activity and hangover counters for all thresholds c (ascending), counters are updated in-place
+    thres_no = c.shape[0]
+    for k in range(q.shape[0]):
+        for j in range(thres_no):
+            if q[k] >= c[j]:
+                a[j] = a[j] + 1
+                hang[j] = 0
+            elif hang[j] < I:
+                a[j] = a[j] + 1
+                hang[j] = hang[j] + 1
+            else:
+                break
+
+    return a, hang
+
+@lazyJit(nopython=True, nogil=True, cache=True)
 def __bin_interp(upcount, lwcount, upthr, lwthr, Margin, tol):
     tol = np.abs(tol)
 
@@ -78,40 +99,14 @@ def calculateP56ASL(x, fs, nbits=16, M = 15.9, H = 0.2, T = 0.03):
     Python implementation from MATLAB: Rui Cheng
     '''
 
-    thres_no = nbits - 1  # number of thresholds, for 16 bit, it's 15
-    eps = 2.2204e-16
-
-    I = int(np.ceil(fs * H))  # hangover in samples
-    g = np.exp(-1 / (fs * T))  # smoothing factor in enevlop detection
-    c = np.array([pow(2, i) for i in range(-thres_no, thres_no - nbits + 1)])
-    # vector with thresholds from one quantizing level up to half the maximum code, at a step of 2, in the case of 16bit samples, from 2^-15 to 0.5
-    a = np.zeros(thres_no, dtype=int) # activity counter for each level threshold
-    hang = I + np.zeros(thres_no, dtype=int)  # % hangover counter for each level threshold
-
-    sq = np.sum(np.power(x, 2))  # long-term level square energy of x
-    x_len = len(x)  # length of x
-
-    # use a 2nd order IIR filter to detect the envelope q
-    x_abs = np.abs(x)
-    p = lfilter([1 - g], [1, -g], x_abs)
-    q = lfilter([1 - g], [1, -g], p)
-
-    @jit(nopython=True)
-    def __getActivity(q, c, a, hang, thres_no, x_len):
-        for k in range(x_len):
-            for j in range(thres_no):
-                if q[k] >= c[j]:
-                    a[j] = a[j] + 1
-                    hang[j] = 0
-                elif hang[j] < I:
-                    a[j] = a[j] + 1
-                    hang[j] = hang[j] + 1
-                else:
-                    break
-
-        return a, hang
+    with stage('asl'):
+        meter = ASLMeter(fs, nbits=nbits, M=M, H=H, T=T)
+        meter.process(x)
+        return meter.result()
 
-    a, hang = __getActivity(q, c, a, hang, thres_no, x_len)
+def _calculateASL(sq, a, c, x_len, M, eps=2.2204e-16):
+    # active speech level and activity from energy sq and activity counters a for thresholds c
+    thres_no = c.shape[0]
 
     # default result values
     activity = 0
@@ -152,6 +147,73 @@ def calculateP56ASL(x, fs, nbits=16, M = 15.9, H = 0.2, T = 0.03):
 
     return asl_dB, activity
 
+class ASLMeter:
+    '''
+    Incremental version of calculateP56ASL() (ITU-T P.56 method B) with constant memory.
+
+    Envelope filter states, activity and hangover counters and the energy sum are kept between
+    calls of process(), so audio can be fed in chunks (e.g. from soundfile.blocks()) and result()
+    reports the ASL of all samples so far at any time. Processing the whole signal at once gives
+    the same result as calculateP56ASL().
+
+    Usage:
+        meter = ASLMeter(fs)
+        for block in sf.blocks(wavFile, blocksize=65536):
+            meter.process(block)
+        asl, act = meter.result()
+        fs, nbits, M, H, T - see calculateP56ASL()
+        preFilter     - pre-filter of P.56 (default: 'NoFilter'), applied with filter states across chunks
+    '''
+    def __init__(self, fs, nbits=16, M = 15.9, H = 0.2, T = 0.03, preFilter: PrefilterP56='NoFilter'):
+        thres_no = nbits - 1  # number of thresholds, for 16 bit, it's 15
+
+        self.fs = fs
+        self.M = M
+        self.I = int(np.ceil(fs * H))  # hangover in samples
+        self.g = np.exp(-1 / (fs * T))  # smoothing factor in enevlop detection
+        self.c = np.array([pow(2, i) for i in range(-thres_no, thres_no - nbits + 1)])
+        # vector with thresholds from one quantizing level up to half the maximum code, at a step of 2, in the case of 16bit samples, from 2^-15 to 0.5
+
+        self.preFilter = P56Prefilter(preFilter)
+        self._sos = getFilterSos(self.preFilter, fs) if self.preFilter != P56Prefilter.NoFilter else None
+        self.reset()
+
+    def reset(self):
+        thres_no = self.c.shape[0]
+        self.a = np.zeros(thres_no, dtype=int) # activity counter for each level threshold
+        self.hang = self.I + np.zeros(thres_no, dtype=int)  # % hangover counter for each level threshold
+        self.sq = 0.0  # long-term level square energy
+        self.nbrSamples = 0
+
+        # filter states of pre-filter cascade and envelope detection
+        self._ziPreFilter = np.zeros((self._sos.shape[0], 2)) if self._sos is not None else None
+        self._ziEnvelope = [np.zeros(1), np.zeros(1)]
+
+    @property
+    def duration(self):
+        return self.nbrSamples / self.fs
+
+    def process(self, x):
+        from scipy.signal import lfilter
+        x = np.asarray(x, dtype=float)
+        if self._sos is not None:
+            x, self._ziPreFilter = applyFiltersSos(x, self._sos, zi=self._ziPreFilter)
+
+        self.sq += np.sum(np.power(x, 2))
+
+        # use a 2nd order IIR filter to detect the envelope q
+        g = self.g
+        p, self._ziEnvelope[0] = lfilter([1 - g], [1, -g], np.abs(x), zi=self._ziEnvelope[0])
+        q, self._ziEnvelope[1] = lfilter([1 - g], [1, -g], p, zi=self._ziEnvelope[1])
+
+        _getActivity(q, self.c, self.a, self.hang, self.I)
+        self.nbrSamples += x.shape[0]
+        return self
+
+    def result(self):
+        # ASL (dB) and activity of all samples processed so far
+        return _calculateASL(self.sq, self.a, self.c, self.nbrSamples, self.M)
+
 def calculateP56ASLEx(x, fs, preFilter: PrefilterP56='NoFilter', minAmplitude=0.1, maxAmplitude=1.0, **kwargs):
     # call calculateP56ASL() with additional pre-filter and range check of signal:
     x = np.array(x)
@@ -160,8 +222,8 @@ def calculateP56ASLEx(x, fs, preFilter: PrefilterP56='NoFilter', minAmplitude=0.
     # apply pre-filter, if applicable
     preFilter = P56Prefilter(preFilter)
     if preFilter != P56Prefilter.NoFilter:
-        coeffs = getFilter(preFilter, fs)
-        y = applyFilters(x, coeffs)
+        with stage('prefilter'):
+            y = applyFiltersSos(x, getFilterSos(preFilter, fs))
     else:
         y = x
 
@@ -177,5 +239,82 @@ def calculateP56ASLEx(x, fs, preFilter: PrefilterP56='NoFilter', minAmplitude=0.
     # compensate for scaling
     return asl+offset_dB, act
 
+def _readSignal(item: Union[Path, str, np.ndarray], fs=None):
+    # signal as (channels x samples) and sampling rate; files are read memory-mapped if possible
+    if isinstance(item, np.ndarray):
+        return np.atleast_2d(item), fs
+
+    item = Path(item)
+    if item.suffix.lower() == '.npy':
+        x = np.load(item, mmap_mode='r')
+        return np.atleast_2d(x), fs
+    elif item.suffix.lower() == '.wav':
+        from scipy.io import wavfile
+        try:
+            fs, x = wavfile.read(item, mmap=True)
+        except ValueError:
+            x = None # e.g. WAV format not supported by scipy
+
+        if x is not None:
+            # integer PCM to float, (samples x channels) to (channels x samples)
+            if x.dtype == np.uint8:
+                x = (x.astype(np.float32) - 128) / 128
+            elif np.issubdtype(x.dtype, np.integer):
+                x = x / float(np.iinfo(x.dtype).max + 1)
+            return np.atleast_2d(x.T), fs
+
+    import soundfile as sf
+    x, fs = sf.read(item, always_2d=True)
+    return x.T, fs
+
+def _calculateP56ASLItem(item, fs, preFilter, kwargs):
+    # ASL/activity for all channels of one item (one task of calculateP56ASLBatch())
+    x, fs = _readSignal(item, fs)
+    if fs is None:
+        raise ValueError('Sampling rate must be given for %s' % (type(item).__name__))
+
+    results = []
+    for ch in range(x.shape[0]):
+        try:
+            asl, act = calculateP56ASLEx(x[ch], fs, preFilter=preFilter, **kwargs)
+        except ASLException:
+            asl, act = np.nan, np.nan
+        results.append((ch + 1, asl, act))
+    return results
+
+def calculateP56ASLBatch(items: Union[List[Union[Path, str, np.ndarray]], np.ndarray], fs=None,
+                         preFilter: PrefilterP56='NoFilter', maxWorkers: int = None, **kwargs) -> 'pandas.DataFrame':
+    '''
+    calculateP56ASLEx() for many files/signals and all of their channels, using a process pool.
+    Usage:
+        df = calculateP56ASLBatch(sorted(outputPath.glob('*.flac')), preFilter='FB')
+        items         - list of files (.wav/.npy read memory-mapped in the workers, other formats via soundfile)
+                        and/or arrays (1-D or channels x samples), or one array with channels x samples
+        fs            - sampling frequency of arrays/.npy files (files with header use their own)
+        preFilter     - see calculateP56ASLEx(), filter design is cached per (type, fs) in each worker
+        maxWorkers    - number of worker processes (default: number of CPUs, 1: no pool)
+        kwargs        - further arguments of calculateP56ASLEx()/calculateP56ASL()
+    Returns:
+        DataFrame with index (Item, Channel) and columns ASL, Activity (NaN if no activity was detected)
+    '''
+    import pandas
+    if isinstance(items, np.ndarray):
+        items = list(np.atleast_2d(items))
+
+    labels = [str(item) if isinstance(item, (str, Path)) else i for i, item in enumerate(items)]
+    if maxWorkers is None:
+        maxWorkers = os.cpu_count()
+
+    if maxWorkers > 1 and len(items) > 1:
+        with ProcessPoolExecutor(max_workers=min(maxWorkers, len(items))) as executor:
+            results = list(executor.map(_calculateP56ASLItem, items, [fs] * len(items),
+                                        [preFilter] * len(items), [kwargs] * len(items)))
+    else:
+        results = [_calculateP56ASLItem(item, fs, preFilter, kwargs) for item in items]
+
+    rows = [(label, ch, asl, act) for label, res in zip(labels, results) for ch, asl, act in res]
+    df = pandas.DataFrame(rows, columns=['Item', 'Channel', 'ASL', 'Activity'])
+    return df.set_index(['Item', 'Channel'])
+
 if __name__ == "__main__":
     pass
@@ -7,7 +7,8 @@ Created on Jun 23 2021 18:06
 
 from typing import Union
 from enum import Enum
-from scipy import signal
+from functools import lru_cache
+import numpy as np
 
 class P56Prefilter(Enum):
     """
@@ -20,40 +21,77 @@ class P56Prefilter(Enum):
 
 PrefilterP56 = Union[P56Prefilter, str]
 
-def applyFilters(x, coeffs):
-    # apply b-a-coeffs sequentially (filter cascade)
+# pass-band/stop-band specification (wp, ws, gstop) and number of cascaded stages per pre-filter
+_FILTER_SPECS = {
+    P56Prefilter.NB: ([160.0, 7000.0], [16.0, 23999.0], 51, 1),
+    P56Prefilter.SWB: ([50.0, 14000.0], [16.0, 23999.0], 26, 2),
+    P56Prefilter.FB: ([20.0, 20000.0], [9.0, 23999.0], 17.5, 3),
+}
+
+def applyFilters(x, coeffs, axis=-1):
+    # apply b-a-coeffs sequentially (filter cascade) or second-order sections (see getFilterSos()) in one pass
+    from scipy import signal
+    if isinstance(coeffs, np.ndarray) and coeffs.ndim == 2 and coeffs.shape[1] == 6:
+        return signal.sosfilt(coeffs, x, axis=axis)
+
     y = x.copy()
     for ba in coeffs:
         b, a = ba
-        y = signal.lfilter(b, a, y)
+        y = signal.lfilter(b, a, y, axis=axis)
 
     return y
 
+def applyFiltersSos(x, sos, zi=None, axis=-1):
+    '''
+    Apply pre-filter cascade (second-order sections) in a single pass, also for multichannel signals
+    and with filter states for streaming.
+    Usage:
+        sos = getFilterSos('FB', fs)
+        y = applyFiltersSos(x, sos)
+        y, zi = applyFiltersSos(block, sos, zi=zi) - zi=True for initial (zero) states of all channels
+    '''
+    from scipy import signal
+    if zi is None:
+        return signal.sosfilt(sos, x, axis=axis)
+
+    if zi is True:
+        # zero states: (n_sections, ..., 2, ...) with the shape of x and 2 in place of axis
+        x = np.asarray(x)
+        shape = list(x.shape)
+        shape[axis] = 2
+        zi = np.zeros([sos.shape[0]] + shape)
+
+    return signal.sosfilt(sos, x, axis=axis, zi=zi)
+
+@lru_cache(maxsize=32)
+def _designFilter(fltType: P56Prefilter, fs, output: str):
+    # IIR filter design of one stage of the pre-filter, done only once per (type, fs, output)
+    from scipy import signal
+    wp, ws, gstop, _ = _FILTER_SPECS[fltType]
+    order, wn = signal.buttord(wp=wp, ws=ws, gpass=0.25, gstop=gstop, fs=fs)
+    return signal.butter(order, Wn=wn, btype='bandpass', output=output, analog=False, fs=fs)
+
 def getFilter(fltType: PrefilterP56, fs):
-    # IIR filter design of pre-filters of P.56
+    # IIR filter design of pre-filters of P.56 (list of b-a-coeffs of cascaded stages)
     fltType = P56Prefilter(fltType)
-    filters = []
-
-    if fltType == P56Prefilter.NB:
-        order, wn = signal.buttord(wp=[160.0, 7000.0], ws=[16.0, 23999.0], gpass=0.25, gstop=51, fs=fs)
-        b, a = signal.butter(order, Wn=wn, btype='bandpass', output='ba', analog=False, fs=fs)
-        filters.append((b, a))
-    elif fltType == P56Prefilter.SWB:
-        order, wn = signal.buttord(wp=[50.0, 14000.0], ws=[16.0, 23999.0], gpass=0.25, gstop=26, fs=fs)
-        b, a = signal.butter(order, Wn=wn, btype='bandpass', output='ba', analog=False, fs=fs)
-        filters.append((b, a))
-        filters.append((b, a))
-    elif fltType == P56Prefilter.FB:
-        order, wn = signal.buttord(wp=[20.0, 20000.0], ws=[9.0, 23999.0], gpass=0.25, gstop=17.5, fs=fs)
-        b, a = signal.butter(order, Wn=wn, btype='bandpass', output='ba', analog=False, fs=fs)
-        filters.append((b, a))
-        filters.append((b, a))
-        filters.append((b, a))
+    if fltType == P56Prefilter.NoFilter:
+        return [([1], [1])]
+
+    b, a = _designFilter(fltType, fs, 'ba')
+    return [(b.copy(), a.copy()) for _ in range(_FILTER_SPECS[fltType][3])]
+
+@lru_cache(maxsize=32)
+def _getFilterSos(fltType: P56Prefilter, fs):
+    if fltType == P56Prefilter.NoFilter:
+        sos = np.array([[1.0, 0.0, 0.0, 1.0, 0.0, 0.0]])
     else:
-        filters.append(([1], [1]))
+        sos = np.tile(_designFilter(fltType, fs, 'sos'), (_FILTER_SPECS[fltType][3], 1))
 
-    return filters
+    return sos
 
+def getFilterSos(fltType: PrefilterP56, fs):
+    # pre-filters of P.56 as second-order sections (all cascaded stages), design is cached per (type, fs)
+    return _getFilterSos(P56Prefilter(fltType), fs).copy()
 
 if __name__ == "__main__":
     pass
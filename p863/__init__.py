@@ -28,6 +28,9 @@ import tempfile, uuid
 binPath = Path(__file__).parent
 polqaExe = binPath / 'PolqaOemDemo64.exe'
 
+# results parsed from console output
+RESULT_TITLES = ['MOS-LQO', 'AVG  Delay', 'SNR Degraded', 'SNR Reference']
+
 class POLQAVersion(IntEnum):
     V1_1 = 1
     V2_4 = 2
@@ -43,8 +46,39 @@ def _createTmpCopy(wavFile, chNbr, timeRangeStart=0.0, timeRangeDuration=-1.0):
     sf.write(tmpFile, s[idxStart:idxEnd,chNbr-1], fs, format='WAV', subtype='PCM_16')
     return tmpFile
 
+def buildPOLQACommand(wavFileDeg, wavFileRef, version=POLQAVersion.V3_0, highAccuracyMode=True, executable=None):
+    # command line as list of arguments (no shell), executable: path or list (e.g. interpreter and script)
+    if executable is None:
+        executable = polqaExe
+    cmdLineArgs = [str(e) for e in executable] if isinstance(executable, (list, tuple)) else [str(executable)]
+
+    version = POLQAVersion(version)
+    cmdLineArgs += ['-LC', 'SWB']
+    if highAccuracyMode:
+        cmdLineArgs += ['-EnableHaMode']
+    cmdLineArgs += ['-Version', '%d' % (version.value)]
+    cmdLineArgs += ['-Test', str(wavFileDeg)]
+    cmdLineArgs += ['-Ref', str(wavFileRef)]
+    return cmdLineArgs
+
+def parsePOLQAOutput(stdout: bytes):
+    # parse results and warnings from console output of POLQA
+    results = pandas.Series(dtype=float)
+    warnings = []
+    for resTitle in RESULT_TITLES:
+        m = re.search(rb"%s: ([+-]?\d+(?:\.\d+)?)" % (resTitle.encode('ascii')), stdout)
+        if m:
+            results[resTitle] = float(m.group(1).strip())
+
+    for warn in re.findall(rb"POLQA WARNING ([^\r\n]*)", stdout):
+        warnings.append(warn.strip().decode('ascii'))
+
+    return results, warnings
+
 def runPOLQA(wavFileDeg, wavFileRef, version=POLQAVersion.V3_0, highAccuracyMode=True,
-             chNbrDeg=1, chNbrRef=1, timeRangeStart=0.0, timeRangeDuration=-1.0):
+             chNbrDeg=1, chNbrRef=1, timeRangeStart=0.0, timeRangeDuration=-1.0, **kwargs):
+    # executable (default: polqaExe) and timeout (s, default: None) as keyword arguments,
+    # see p863.runner.POLQARunner for many files/ranges
 
     # always copy to temp files
     tmpFiles = []
@@ -54,35 +88,20 @@ def runPOLQA(wavFileDeg, wavFileRef, version=POLQAVersion.V3_0, highAccuracyMode
     wavFileRef = _createTmpCopy(wavFileRef, chNbrRef, timeRangeStart, timeRangeDuration)
     tmpFiles.append(wavFileRef)
 
-    version = POLQAVersion(version)
-
-    cmdLineArgs = [str(polqaExe), '-LC SWB']
-    if highAccuracyMode:
-        cmdLineArgs += ['-EnableHaMode']
-    cmdLineArgs += ["-Version %d" % (version.value)]
-    cmdLineArgs += ['-Test "%s"' % wavFileDeg]
-    cmdLineArgs += ['-Ref "%s"' % wavFileRef]
-
-    res = subprocess.run(" ".join(cmdLineArgs), shell=True, capture_output=True)
-    results = pandas.Series(dtype=float)
-    warnings = []
+    cmdLineArgs = buildPOLQACommand(wavFileDeg, wavFileRef, version, highAccuracyMode, kwargs.get('executable', None))
+    try:
+        res = subprocess.run(cmdLineArgs, capture_output=True, timeout=kwargs.get('timeout', None))
+    finally:
+        # clean temp files
+        for tmpFile in tmpFiles:
+            if tmpFile.is_file():
+                tmpFile.unlink()
 
     # parse results and warnings
     if res.returncode == 0:
-        for resTitle in ['MOS-LQO', 'AVG  Delay', 'SNR Degraded', 'SNR Reference']:
-            m = re.search(b"%s: ([+-]?\d+(?:\.\d+)?)" % (resTitle.encode('ascii')), res.stdout)
-            if m:
-                results[resTitle] = float(m.group(1).strip())
-
-        for warn in re.findall(b"POLQA WARNING (.*)\r", res.stdout):
-            warnings.append(warn.strip().decode('ascii'))
+        return parsePOLQAOutput(res.stdout)
 
-    # clean temp files
-    for tmpFile in tmpFiles:
-        if tmpFile.is_file():
-            tmpFile.unlink()
-
-    return results, warnings
+    return pandas.Series(dtype=float), []
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel job runner for POLQA (P.863) on many files and time ranges.
+
+Each file is read once, all time ranges are sliced in memory and written as temporary WAV files
+to a RAM-backed directory (/dev/shm, if available). The external scorer is run without shell,
+with limited parallelism, per-job timeout and retries; results are returned per file as soon as
+all of its ranges are finished.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import pandas
+import soundfile as sf
+
+from p863 import POLQAVersion, buildPOLQACommand, parsePOLQAOutput
+from sweep.container import ConditionStore, ConditionItem
+
+# RAM-backed directory for temporary files (if available)
+RAM_DIR = Path('/dev/shm')
+
+class POLQAError(Exception):
+    pass
+
+class POLQAResult(NamedTuple):
+    item: Union[Path, Tuple[Path, Path], ConditionItem] # as passed to POLQARunner.run()
+    ranges: pandas.DataFrame # one row per successful time range (index: range number, starting with 1)
+    warnings: List[str]
+    errors: List[str]
+
+    @property
+    def mos(self):
+        # average MOS-LQO across ranges (NaN if no range was successful)
+        if 'MOS-LQO' not in self.ranges.columns:
+            return np.nan
+        return self.ranges['MOS-LQO'].mean()
+
+class POLQARunner:
+    '''
+    Usage:
+        runner = POLQARunner(maxWorkers=8, timeout=300.0, retries=2)
+        for res in runner.run(files, startTime=16.0, duration=8.0, nbrRanges=8, chNbrDeg=1, chNbrRef=2):
+            print(res.item, res.mos)
+        executable        - POLQA executable (default: p863.polqaExe) or list (e.g. interpreter and script)
+        maxWorkers        - max. number of scorer processes running in parallel (default: number of CPUs)
+        timeout           - timeout per scorer call (s), None: no timeout
+        retries           - number of retries per range after failure/timeout
+        tmpDir            - directory for temporary files (default: /dev/shm, if available, else system temp. dir.)
+        version, highAccuracyMode - see runPOLQA()
+    '''
+    def __init__(self, executable=None, maxWorkers: int = None, timeout: float = 300.0, retries: int = 2,
+                 tmpDir: Path = None, version=POLQAVersion.V3_0, highAccuracyMode=True):
+        self.executable = executable
+        self.maxWorkers = max(int(maxWorkers if maxWorkers is not None else os.cpu_count()), 1)
+        self.timeout = timeout
+        self.retries = max(int(retries), 0)
+        if tmpDir is None:
+            tmpDir = RAM_DIR if RAM_DIR.is_dir() else None
+        self.tmpDir = tmpDir
+        self.version = POLQAVersion(version)
+        self.highAccuracyMode = highAccuracyMode
+
+    @staticmethod
+    def _read(file: Path, chNbr: int):
+        # one channel of file (read once for all ranges)
+        s, fs = sf.read(file, always_2d=True)
+        return s[:, chNbr - 1], fs
+
+    def _prepare(self, item, tmpDir: Path, jobIdx: int, startTime=0.0, duration=-1.0, nbrRanges=1,
+                 chNbrDeg=1, chNbrRef=2) -> List[Tuple[int, Path, Path]]:
+        # read degraded/reference once, write all ranges as temp. WAV files
+        fileDeg, fileRef = item if isinstance(item, (tuple, list)) else (item, item)
+        if isinstance(item, ConditionItem):
+            with ConditionStore(item.file) as store:
+                deg, ref, fs = store.read(item.key), store.reference(), store.fs
+            ref, fsRef = ref[:len(deg)], fs
+        elif Path(fileDeg) == Path(fileRef):
+            s, fs = sf.read(fileDeg, always_2d=True)
+            deg, ref, fsRef = s[:, chNbrDeg - 1], s[:, chNbrRef - 1], fs
+        else:
+            deg, fs = self._read(fileDeg, chNbrDeg)
+            ref, fsRef = self._read(fileRef, chNbrRef)
+        if fs != fsRef:
+            raise POLQAError('Sampling rates of degraded and reference do not match (%d/%d Hz)' % (fs, fsRef))
+
+        jobs = []
+        for i in range(nbrRanges):
+            idxStart = int(fs * (startTime + i * duration)) if duration > 0 else int(fs * startTime)
+            idxEnd = idxStart + int(fs * duration) if duration > 0 else None
+            files = []
+            for name, x in [('deg', deg), ('ref', ref)]:
+                tmpFile = tmpDir / ('%d_%d_%s.wav' % (jobIdx, i + 1, name))
+                sf.write(tmpFile, x[idxStart:idxEnd], fs, format='WAV', subtype='PCM_16')
+                files.append(tmpFile)
+            jobs.append((i + 1, files[0], files[1]))
+        return jobs
+
+    def score(self, wavFileDeg: Path, wavFileRef: Path):
+        '''
+        Run scorer for one pair of (single-channel) WAV files with timeout and retries.
+        Returns:
+            results (Series), warnings (list), raises POLQAError after last failed attempt
+        '''
+        cmdLineArgs = buildPOLQACommand(wavFileDeg, wavFileRef, self.version, self.highAccuracyMode, self.executable)
+        errors = []
+        for _ in range(self.retries + 1):
+            try:
+                res = subprocess.run(cmdLineArgs, capture_output=True, timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                errors.append('timeout after %g s' % self.timeout)
+                continue
+
+            if res.returncode != 0:
+                errors.append('return code %d: %s' % (res.returncode, res.stderr.decode(errors='replace').strip()))
+                continue
+
+            results, warnings = parsePOLQAOutput(res.stdout)
+            if 'MOS-LQO' not in results.index:
+                errors.append('no MOS-LQO in output')
+                continue
+
+            return results, warnings
+
+        raise POLQAError('%s: %s' % (Path(wavFileDeg).name, '; '.join(errors)))
+
+    def run(self, items: Iterable[Union[Path, Tuple[Path, Path], ConditionItem]], **kwargs) -> Iterable[POLQAResult]:
+        '''
+        Generator: score all ranges of all items, yields POLQAResult per item (in order of completion).
+        items     - files with degraded and reference as channels, tuples (degraded file, reference file) or
+                    conditions of a ConditionStore (ConditionItem: store file and key, channels are ignored)
+        kwargs    - startTime, duration (s, <= 0: full file), nbrRanges (consecutive ranges), chNbrDeg, chNbrRef
+        Files are only prepared (read and sliced) while less than 2*maxWorkers ranges are pending.
+        '''
+        tmpRoot = tempfile.mkdtemp(prefix='polqa_', dir=self.tmpDir)
+        try:
+            with ThreadPoolExecutor(max_workers=self.maxWorkers) as executor:
+                items = iter(enumerate(items))
+                pending = dict() # future -> (jobIdx, range number, temp. files)
+                perItem = dict() # jobIdx -> [item, remaining ranges, results, warnings, errors]
+                exhausted = False
+                while True:
+                    # prepare next items (bounded number of pending ranges)
+                    while (not exhausted) and (len(pending) < 2 * self.maxWorkers):
+                        jobIdx, item = next(items, (None, None))
+                        if jobIdx is None:
+                            exhausted = True
+                            break
+
+                        try:
+                            jobs = self._prepare(item, Path(tmpRoot), jobIdx, **kwargs)
+                        except Exception as e:
+                            yield POLQAResult(item, pandas.DataFrame(), [], [str(e)])
+                            continue
+
+                        perItem[jobIdx] = [item, len(jobs), [], [], []]
+                        for rangeNbr, wavDeg, wavRef in jobs:
+                            future = executor.submit(self.score, wavDeg, wavRef)
+                            pending[future] = (jobIdx, rangeNbr, (wavDeg, wavRef))
+
+                    if len(pending) == 0:
+                        break
+
+                    # collect finished ranges
+                    done, _ = wait(list(pending.keys()), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        jobIdx, rangeNbr, tmpFiles = pending.pop(future)
+                        for tmpFile in tmpFiles:
+                            tmpFile.unlink(missing_ok=True)
+
+                        state = perItem[jobIdx]
+                        try:
+                            res, warnings = future.result()
+                            res.name = rangeNbr
+                            state[2].append(res)
+                            state[3].extend(warnings)
+                        except Exception as e:
+                            state[4].append('range %d: %s' % (rangeNbr, str(e)))
+
+                        state[1] -= 1
+                        if state[1] == 0:
+                            del perItem[jobIdx]
+                            ranges = pandas.DataFrame(state[2]).sort_index() if len(state[2]) > 0 else pandas.DataFrame()
+                            yield POLQAResult(state[0], ranges, state[3], state[4])
+        finally:
+            shutil.rmtree(tmpRoot, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for parameter sweeps of the degradation (caching, result storage, scheduling)
+"""
+
+if __name__ == "__main__":
+    pass
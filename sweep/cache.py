@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed on-disk cache for degraded signals and their metadata
+"""
+
+import os
+import json
+import hashlib
+import uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Tuple
+import numpy as np
+import soundfile as sf
+
+rootPath = Path(__file__).parent.parent
+
+# source files that define the result of a degradation (incl. leveling and compilation of kernels)
+CODE_FILES = ['degradeSpecSub.py', 'helper/coeffs.py', 'helper/jit.py', 'helper/ltass.py', 'helper/noise.py', 'helper/stft.py',
+              'p56/asl.py', 'p56/prefilter.py', 'sweep/pipeline.py']
+
+# source files imported by the degradation that do not change its result (instrumentation, caching)
+CODE_FILES_EXCLUDED = ['helper/profiling.py', 'sweep/cache.py']
+
+@lru_cache(maxsize=1)
+def codeVersion() -> str:
+    # hash of relevant source files (independent of line endings)
+    h = hashlib.sha256()
+    for codeFile in CODE_FILES:
+        h.update(codeFile.encode('utf-8'))
+        h.update((rootPath / codeFile).read_bytes().replace(b'\r\n', b'\n'))
+    return h.hexdigest()
+
+def hashAudio(signal: np.ndarray, fs: int) -> str:
+    # hash of sample data (incl. shape, type and sampling rate)
+    signal = np.ascontiguousarray(signal)
+    h = hashlib.sha256()
+    h.update(('%s|%s|%d|' % (signal.dtype.str, signal.shape, fs)).encode('utf-8'))
+    h.update(signal.tobytes())
+    return h.hexdigest()
+
+def _canonical(value):
+    # JSON-compatible representation of parameter values (numpy scalars, paths)
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    elif isinstance(value, np.generic):
+        return value.item()
+    elif isinstance(value, Path):
+        return str(value)
+    return value
+
+class DegradationCache:
+    '''
+    Cache of degraded signals, keyed by hash of input audio, full parameter set, noise seed and code version.
+
+    Each entry consists of <key>.flac (degraded signal, 16-bit as the output files: samples are identical to
+    the written files) and <key>.json (metadata, e.g. ASL/activity, and code version), both are written
+    atomically and the metadata last, so interrupted runs never leave entries that look complete.
+    Entries of other code versions (e.g. after changes of CODE_FILES) are never hit again, prune() removes them.
+
+    Usage:
+        cache = DegradationCache(cachePath)
+        cache.prune()     # no concurrent writers
+        key = cache.key(hashAudio(s, fs), params, seed=None)
+        if key in cache:
+            d, meta = cache.get(key)
+        else:
+            cache.put(key, d, fs, dict(asl=asl, activity=act))
+    '''
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(audioHash: str, params: dict, seed=None, version: Optional[str] = None) -> str:
+        if version is None:
+            version = codeVersion()
+        desc = json.dumps(dict(audio=audioHash, params=_canonical(params), seed=_canonical(seed), version=version),
+                          sort_keys=True)
+        return hashlib.sha256(desc.encode('utf-8')).hexdigest()
+
+    def _paths(self, key: str) -> Tuple[Path, Path]:
+        folder = self.root / key[:2]
+        return folder / ('%s.flac' % key), folder / ('%s.json' % key)
+
+    def __contains__(self, key: str) -> bool:
+        audioFile, metaFile = self._paths(key)
+        return metaFile.is_file() and audioFile.is_file()
+
+    def get(self, key: str) -> Optional[Tuple[np.ndarray, dict]]:
+        # degraded signal (float32, 16-bit resolution) and metadata
+        if key not in self:
+            return None
+
+        audioFile, metaFile = self._paths(key)
+        with open(metaFile, 'r') as f:
+            meta = json.load(f)
+        signal, _ = sf.read(audioFile, dtype='float32')
+        return signal, meta['metadata']
+
+    def put(self, key: str, signal: np.ndarray, fs: int, metadata: dict, version: Optional[str] = None):
+        audioFile, metaFile = self._paths(key)
+        audioFile.parent.mkdir(exist_ok=True)
+
+        # write to temporary files and rename (atomic), metadata last
+        tmpFile = audioFile.parent / ('%s.%s.tmp.flac' % (key, uuid.uuid4().hex))
+        sf.write(tmpFile, np.asarray(signal), fs, subtype='PCM_16', format='FLAC')
+        os.replace(tmpFile, audioFile)
+
+        tmpFile = metaFile.parent / ('%s.%s.tmp' % (key, uuid.uuid4().hex))
+        with open(tmpFile, 'w') as f:
+            json.dump(dict(version=version if version is not None else codeVersion(), metadata=_canonical(metadata)),
+                      f, sort_keys=True)
+        os.replace(tmpFile, metaFile)
+
+    def remove(self, key: str):
+        for path in self._paths(key):
+            if path.is_file():
+                path.unlink()
+
+    def prune(self, version: Optional[str] = None) -> int:
+        '''
+        Remove entries of other code versions (default: current), incomplete entries, temporary files and files
+        of older cache formats. Must not run concurrently with writers. Returns number of removed files.
+        '''
+        if version is None:
+            version = codeVersion()
+
+        removed = 0
+        for folder in [path for path in self.root.iterdir() if path.is_dir() and (len(path.name) == 2)]:
+            keep = set()
+            for metaFile in folder.glob('*.json'):
+                try:
+                    with open(metaFile, 'r') as f:
+                        valid = (json.load(f).get('version', None) == version)
+                except (ValueError, OSError):
+                    valid = False
+                if valid and (folder / ('%s.flac' % metaFile.stem)).is_file():
+                    keep.update([metaFile.name, '%s.flac' % metaFile.stem])
+
+            for path in folder.iterdir():
+                if path.is_file() and (path.name not in keep):
+                    path.unlink()
+                    removed += 1
+        return removed
+
+if __name__ == "__main__":
+    pass
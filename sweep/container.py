@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Single-file store of all degraded conditions of one source: the reference is stored once, each signal
+is split into compressed chunks (random access by condition and time range without decoding the whole
+signal), metadata (per condition and of the store) is kept in a JSON index. Files for other tools
+(e.g. POLQA: degraded and reference as channels) are exported on demand.
+
+Chunks of 16-bit stores are FLAC streams (libFLAC via soundfile), float chunks are zlib-compressed. Compared
+to stereo FLAC files per condition (as written by the sweep driver), the reference is stored once (about 60 %
+of the size), and the store is one file per source with its metadata. NPZ (zip) was not used: members are
+not appended or replaced in place, each member is decompressed as a whole on read, and zlib compresses audio
+worse than FLAC. HDF5/zarr would add a dependency for the same chunked layout.
+
+File layout: header (magic, version, offset/size of index), compressed chunks, compressed JSON index.
+An (empty) index is written on creation. Chunks are only appended, the index is written after the new chunks
+and the header is updated last, so an interrupted writer leaves the last flushed state readable and the store
+can be reopened with mode='a' (replaced entries, unflushed chunks and old indexes remain as unused bytes).
+"""
+
+import io
+import os
+import json
+import zlib
+import struct
+import threading
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+import numpy as np
+import soundfile as sf
+
+from .cache import _canonical
+
+MAGIC = b'SPSUBCND'
+VERSION = 2 # 2: FLAC chunks of PCM_16 stores
+_HEADER = struct.Struct('<8sIIQQ') # magic, version, reserved, index offset, index size
+
+# name of reference entry (not listed in keys())
+REFERENCE = '__reference__'
+
+# sample formats: PCM_16 (as 16-bit files, FLAC) or FLOAT (float32, byte-shuffled, zlib)
+SAMPLE_FORMATS = ['PCM_16', 'FLOAT']
+
+def _encode(x: np.ndarray, fs: int, sampleFormat: str, level: int) -> bytes:
+    # samples of one chunk to compressed bytes
+    if sampleFormat == 'PCM_16':
+        q = np.clip(np.round(x * 32768.0), -32768, 32767).astype(np.int16) # as 16-bit files, exact on decoding
+        with io.BytesIO() as buffer:
+            sf.write(buffer, q, fs, subtype='PCM_16', format='FLAC')
+            return buffer.getvalue()
+    return zlib.compress(np.ascontiguousarray(x, dtype='<f4').view(np.uint8).reshape(-1, 4).T.tobytes(), level)
+
+def _decode(data: bytes, sampleFormat: str) -> np.ndarray:
+    if sampleFormat == 'PCM_16':
+        q, _ = sf.read(io.BytesIO(data), dtype='int16')
+        return q.astype(np.float32) / 32768.0
+    data = zlib.decompress(data)
+    return np.frombuffer(data, dtype=np.uint8).reshape(4, -1).T.copy().view('<f4').reshape(-1).astype(np.float32)
+
+class ConditionItem(NamedTuple):
+    # one condition of a store, e.g. item of p863.runner.POLQARunner.run() (degraded and reference from store)
+    file: Path
+    key: str
+
+class ConditionStore:
+    '''
+    All degraded signals (conditions) of one source in one compressed file, reference stored once.
+
+    Usage:
+        with ConditionStore(storeFile, mode='a', fs=fs) as store:
+            store.setReference(s, dict(sourceFile=testFile.name))
+            store.updateAttrs(codeVersion=codeVersion())
+            store.put('snr=5,osf=1', d, dict(snr=5.0, osf=1.0, asl=asl))
+        with ConditionStore(storeFile) as store:
+            d = store.read('snr=5,osf=1', startTime=16.0, duration=8.0)
+            s = store.reference(16.0, 8.0)
+            store.export('snr=5,osf=1', outputFile)     # degraded and reference as channels (FLAC/WAV)
+        file          - store file (e.g. <source>.specsub)
+        mode          - 'r' (read), 'a' (read/append, created if missing), 'w' (create, existing file is replaced)
+        fs            - sampling frequency (required for new stores)
+        chunkSize     - samples per chunk of new store (default: fs, i.e. 1 s), granularity of random access
+        sampleFormat  - new store: 'PCM_16' (default, same resolution as 16-bit files) or 'FLOAT' (float32)
+        level         - zlib compression level (float chunks, index)
+    Writers must be single (e.g. main process of a sweep), reads and writes are thread-safe.
+    '''
+    def __init__(self, file: Path, mode: str = 'r', fs: int = None, chunkSize: int = None, sampleFormat: str = 'PCM_16',
+                 level: int = 6):
+        if mode not in ('r', 'a', 'w'):
+            raise ValueError('Unknown mode: %s' % mode)
+        if sampleFormat not in SAMPLE_FORMATS:
+            raise ValueError('Unknown sample format: %s (%s)' % (sampleFormat, ', '.join(SAMPLE_FORMATS)))
+        self.file = Path(file)
+        self.mode = mode
+        self.level = level
+        self._lock = threading.RLock()
+        self._dirty = False
+
+        if (mode == 'w') or ((mode == 'a') and not self.file.is_file()):
+            self._create(fs, chunkSize, sampleFormat)
+        else:
+            self._f = open(self.file, 'rb' if mode == 'r' else 'r+b')
+            self._index = self._readIndex()
+            if self._index is None:
+                # interrupted before first index was written (nothing to recover)
+                if (mode == 'r') or (fs is None):
+                    raise ValueError('Store without index: %s' % self.file)
+                self._f.close()
+                self._create(fs, chunkSize, sampleFormat)
+            if (fs is not None) and (int(fs) != self.fs):
+                raise ValueError('Sampling frequency of store is %d Hz (not %d Hz)' % (self.fs, fs))
+
+    def _create(self, fs, chunkSize, sampleFormat):
+        # new (empty) store, index is written immediately
+        if fs is None:
+            raise ValueError('Sampling frequency required for new store')
+        self._index = dict(fs=int(fs), chunkSize=int(chunkSize if chunkSize is not None else fs),
+                           sampleFormat=sampleFormat, attrs=dict(), entries=dict())
+        self._f = open(self.file, 'w+b')
+        self._f.write(_HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+        self._dirty = True
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _readIndex(self) -> Optional[dict]:
+        # index of last flush (None if never written)
+        self._f.seek(0)
+        header = self._f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError('Not a condition store: %s' % self.file)
+        magic, version, _, offset, size = _HEADER.unpack(header)
+        if (magic != MAGIC) or (version != VERSION):
+            raise ValueError('Not a condition store (or unsupported version): %s' % self.file)
+        if offset == 0:
+            return None
+        self._f.seek(offset)
+        return json.loads(zlib.decompress(self._f.read(size)).decode('utf-8'))
+
+    @property
+    def fs(self) -> int:
+        return self._index['fs']
+
+    @property
+    def chunkSize(self) -> int:
+        return self._index['chunkSize']
+
+    @property
+    def sampleFormat(self) -> str:
+        return self._index['sampleFormat']
+
+    @property
+    def attrs(self) -> dict:
+        # metadata of store (e.g. source file, code version), see updateAttrs()
+        return dict(self._index['attrs'])
+
+    def updateAttrs(self, **attrs):
+        # update metadata of store (JSON-serializable), saved on flush()/close()
+        if self.mode == 'r':
+            raise IOError('Store opened read-only: %s' % self.file)
+        with self._lock:
+            self._index['attrs'].update(_canonical(attrs))
+            self._dirty = True
+
+    def keys(self) -> List[str]:
+        return [key for key in self._index['entries'].keys() if key != REFERENCE]
+
+    def __contains__(self, key: str) -> bool:
+        return str(key) in self._index['entries']
+
+    def __len__(self):
+        return len(self.keys())
+
+    def _entry(self, key: str) -> dict:
+        entry = self._index['entries'].get(str(key), None)
+        if entry is None:
+            raise KeyError(key)
+        return entry
+
+    def length(self, key: str = REFERENCE) -> int:
+        return self._entry(key)['length']
+
+    def metadata(self, key: str = REFERENCE) -> dict:
+        return self._entry(key)['metadata']
+
+    def put(self, key: str, x: np.ndarray, metadata: dict = None):
+        '''
+        Store signal (1-D) of condition key with metadata (JSON-serializable), an existing entry is replaced.
+        Data is durable after flush()/close().
+        '''
+        if self.mode == 'r':
+            raise IOError('Store opened read-only: %s' % self.file)
+        x = np.asarray(x).reshape(-1)
+        chunks = [_encode(x[i:i + self.chunkSize], self.fs, self.sampleFormat, self.level)
+                  for i in range(0, len(x), self.chunkSize)]
+        with self._lock:
+            self._f.seek(0, os.SEEK_END)
+            offset = self._f.tell()
+            self._f.write(b''.join(chunks))
+            self._index['entries'][str(key)] = dict(length=len(x), offset=offset, chunks=[len(c) for c in chunks],
+                                                    metadata=_canonical(dict(metadata or dict())))
+            self._dirty = True
+
+    def setReference(self, s: np.ndarray, metadata: dict = None):
+        self.put(REFERENCE, s, metadata)
+
+    def read(self, key: str = REFERENCE, startTime: float = 0.0, duration: float = -1.0) -> np.ndarray:
+        '''
+        Signal (float32) of condition key (default: reference) from startTime (s) for duration (s, <= 0: to end),
+        only the chunks within the range are read and decompressed.
+        '''
+        entry = self._entry(key)
+        start = min(max(int(round(startTime * self.fs)), 0), entry['length'])
+        stop = entry['length'] if duration <= 0 else min(start + int(round(duration * self.fs)), entry['length'])
+        if stop <= start:
+            return np.zeros(0, dtype=np.float32)
+
+        c0, c1 = start // self.chunkSize, (stop - 1) // self.chunkSize + 1
+        offsets = entry['offset'] + np.concatenate(([0], np.cumsum(entry['chunks'])))
+        with self._lock:
+            self._f.seek(int(offsets[c0]))
+            data = self._f.read(int(offsets[c1] - offsets[c0]))
+        parts = [_decode(data[offsets[i] - offsets[c0]:offsets[i + 1] - offsets[c0]], self.sampleFormat)
+                 for i in range(c0, c1)]
+        x = np.concatenate(parts)
+        return x[start - c0*self.chunkSize:stop - c0*self.chunkSize]
+
+    def reference(self, startTime: float = 0.0, duration: float = -1.0) -> np.ndarray:
+        return self.read(REFERENCE, startTime, duration)
+
+    def dataFrame(self) -> 'pandas.DataFrame':
+        # metadata of all conditions (index: keys)
+        import pandas # imported on demand
+        return pandas.DataFrame.from_dict({key: self.metadata(key) for key in self.keys()}, orient='index')
+
+    def export(self, key: str, outputFile: Path, withReference: bool = True, startTime: float = 0.0,
+               duration: float = -1.0, subtype: str = 'PCM_16', format: str = None) -> Path:
+        '''
+        Write condition to audio file (format from suffix, e.g. FLAC or WAV), degraded and reference as
+        channels 1 and 2 (withReference=True, as files of sweep driver) or degraded only.
+        '''
+        x = self.read(key, startTime, duration)
+        if withReference:
+            x = np.vstack((x, self.reference(startTime, duration)[:len(x)])).T
+        sf.write(outputFile, x, self.fs, subtype=subtype, format=format)
+        return Path(outputFile)
+
+    def flush(self):
+        # write index (after data), then header
+        if (self.mode == 'r') or not self._dirty:
+            return
+        with self._lock:
+            data = zlib.compress(json.dumps(self._index).encode('utf-8'), self.level)
+            self._f.seek(0, os.SEEK_END)
+            offset = self._f.tell()
+            self._f.write(data)
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._f.seek(0)
+            self._f.write(_HEADER.pack(MAGIC, VERSION, 0, offset, len(data)))
+            self._f.flush()
+            self._dirty = False
+
+    def close(self):
+        if self._f.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self._f.close()
+
+
+if __name__ == "__main__":
+    pass
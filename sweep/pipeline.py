@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Single-pass generate-and-level pipeline for sweeps in worker processes or threads.
+
+Each source file is read and resampled once into shared memory (multiprocessing.shared_memory); tasks only
+carry a small handle and workers map the samples without copying. Degraded signals are leveled within the
+same pass: the ASL (P.56, FB pre-filter) is measured while the inverse STFT is produced.
+
+Worker tasks (processSweepTask()) are defined here, so workers started with 'spawn' only import this module
+(numba and resampy are imported on first use).
+
+With the thread backend, all tasks run in one process and share sources, STFT plans and noise caches
+(FFTs and numba kernels release the GIL), so memory does not grow with the number of workers.
+"""
+
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Tuple, Union
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import soundfile as sf
+
+from degradeSpecSub import applySpecSubSweep, SWEEP_PARAMETERS
+from helper.profiling import profiling, stage, condition, conditionLabel
+from sweep.cache import DegradationCache
+
+# shared memory segments attached in this process (name -> SharedMemory), kept open for reuse by later tasks
+_attached: Dict[str, shared_memory.SharedMemory] = dict()
+
+class SharedArray(NamedTuple):
+    # picklable handle of an array in shared memory
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+    def attach(self) -> np.ndarray:
+        # read-only view of shared samples (no copy), segment is attached once per process
+        shm = _attached.get(self.name, None)
+        if shm is None:
+            shm = shared_memory.SharedMemory(name=self.name)
+            _attached[self.name] = shm
+        x = np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=shm.buf)
+        x.flags.writeable = False
+        return x
+
+# executor classes of sweep backends
+BACKENDS = dict(process=ProcessPoolExecutor, thread=ThreadPoolExecutor)
+
+def makeExecutor(backend: str = 'process', maxWorkers: int = None):
+    '''
+    Executor of sweep tasks: 'process' (one process per worker, sources in shared memory) or 'thread'
+    (all workers in this process, sources, plans and caches are shared).
+    Tasks must use seeded noise (int or np.random.Generator per task) with the thread backend.
+    '''
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend: %s (%s)' % (backend, ', '.join(BACKENDS.keys())))
+    return BACKENDS[backend](max_workers=maxWorkers)
+
+class SourcePool:
+    '''
+    Source signals in shared memory, owned by the main process (segments are removed on close()).
+    With shared=False (e.g. thread backend), sources are kept as read-only arrays and passed as is.
+
+    Usage:
+        with SourcePool() as pool, ProcessPoolExecutor() as executor:
+            source = pool.load(testFile, fs)     # SharedArray handle (or array)
+            s = pool.array(source)               # view in main process
+            executor.submit(worker, source, ...) # worker: s = source.attach()
+    '''
+    def __init__(self, shared: bool = True):
+        self.shared = shared
+        self._segments: Dict[str, shared_memory.SharedMemory] = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def share(self, x: np.ndarray) -> Union[SharedArray, np.ndarray]:
+        # copy array into new shared memory segment (read-only array if not shared)
+        x = np.ascontiguousarray(x)
+        if not self.shared:
+            x = x.copy() if x.flags.writeable else x
+            x.flags.writeable = False
+            return x
+        shm = shared_memory.SharedMemory(create=True, size=max(x.nbytes, 1))
+        self._segments[shm.name] = shm
+        source = SharedArray(shm.name, x.shape, x.dtype.str)
+        np.ndarray(x.shape, dtype=x.dtype, buffer=shm.buf)[...] = x
+        return source
+
+    def load(self, file: Path, fs: int) -> Union[SharedArray, np.ndarray]:
+        # read (and resample) once
+        s, fs1 = sf.read(file)
+        if fs1 != fs:
+            from resampy import resample # imported on demand (imports numba)
+            s = resample(s, fs1, fs)
+        return self.share(s)
+
+    def array(self, source: Union[SharedArray, np.ndarray]) -> np.ndarray:
+        if not isinstance(source, SharedArray):
+            return source
+        shm = self._segments[source.name]
+        x = np.ndarray(source.shape, dtype=np.dtype(source.dtype), buffer=shm.buf)
+        x.flags.writeable = False
+        return x
+
+    def close(self):
+        for shm in self._segments.values():
+            shm.close()
+            shm.unlink()
+        self._segments.clear()
+
+def generateLeveled(source, fs: int, conditions: Iterable[dict], targetAsl: float = -26.0, **kwargs):
+    '''
+    Generator: degraded signals of all conditions of one source, leveled to targetAsl in the same pass.
+
+    Usage:
+        for cond, d, (asl, act) in generateLeveled(source, fs, conditions, -26.0, seed=0):
+            ...
+        source      - SharedArray (attached without copy) or array
+        kwargs      - see applySpecSubSweep() (e.g. seed, preFilter)
+    Yields:
+        (params, degraded, (asl, activity)) - see applySpecSubSweep() with levelTo=targetAsl
+    '''
+    s = source.attach() if isinstance(source, SharedArray) else np.asarray(source)
+    yield from applySpecSubSweep(s, fs, targetAsl, conditions, levelTo=targetAsl, **kwargs)
+
+def writeSequence(d: np.ndarray, s: np.ndarray, fs: int, outputFile: Path):
+    # degraded and reference as channels of one 16-bit file (as needed for POLQA)
+    sf.write(outputFile, np.vstack((d, s)).T, fs, subtype='PCM_16', format='FLAC')
+
+def processSweepTask(source: Union[SharedArray, np.ndarray], fs: int, conditions: List[dict], cachePath: Path,
+                     noiseSeed: int = 0, targetAsl: float = -26.0, profile: bool = False, writeFiles: bool = True) -> list:
+    '''
+    Worker task of a sweep: all conditions of one (n_fft, hop_length) setting share the STFTs of signal and
+    (seeded) noise, output is leveled within the inverse STFT (no second pass).
+        source      - SharedArray (process backend) or array (thread backend)
+        conditions  - dicts with keys SWEEP_PARAMETERS, 'cacheKey', 'params' (metadata of cache entry) and
+                      'outputFile' (if writeFiles)
+        writeFiles  - write output files (degraded and reference), False: only cache entries (e.g. collected
+                      in a ConditionStore by the main process)
+    Returns:
+        profiling records (if profile), for aggregation in main process
+    '''
+    cache = DegradationCache(cachePath)
+    s = source.attach() if isinstance(source, SharedArray) else source
+    with profiling(enabled=profile) as prof:
+        for cond, d, (asl, act) in generateLeveled(s, fs, conditions, targetAsl, seed=noiseSeed, preFilter='FB'):
+            with condition(conditionLabel(cond, SWEEP_PARAMETERS)):
+                # cache first: a condition is only complete if its cache entry exists
+                with stage('cache'):
+                    cache.put(cond['cacheKey'], d, fs, dict(cond['params'], asl=asl, activity=act))
+                if writeFiles:
+                    with stage('write'):
+                        writeSequence(d, s, fs, cond['outputFile'])
+
+    return prof.records if profile else None
+
+
+if __name__ == "__main__":
+    pass
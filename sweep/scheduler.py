@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Cost-aware scheduling of sweep tasks: tasks are dispatched longest-first (estimated cost from signal
+length, n_fft and hop) with a bounded number of tasks in flight, completions are returned as they finish
+(e.g. to stream results to the result store). Long tasks start early and do not form the tail of a sweep,
+and only maxInFlight tasks (arguments and results) are held by the executor at any time.
+"""
+
+import os
+import heapq
+from itertools import count
+from typing import Callable, Hashable, NamedTuple
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+import numpy as np
+
+def estimateCost(length: int, n_fft: int, hop_length: int, nbrConditions: int = 1) -> float:
+    # relative cost: FFT work of all frames (n_fft*log2(n_fft) per frame) of all conditions
+    nbrFrames = 1 + int(length) // int(hop_length)
+    return float(nbrConditions) * nbrFrames * n_fft * np.log2(n_fft)
+
+class SweepTask(NamedTuple):
+    key: Hashable # identifier of task (e.g. (file, n_fft, hop, chunk))
+    cost: float # estimated cost (relative), see estimateCost()
+    func: Callable
+    args: tuple
+    kwargs: dict
+
+class TaskScheduler:
+    '''
+    Longest-first dispatch of tasks to an executor with at most maxInFlight tasks submitted at once.
+
+    Usage:
+        scheduler = TaskScheduler(executor, maxInFlight=2*maxWorkers)
+        scheduler.add(key, estimateCost(len(s), nfft, hop, len(conditions)), worker, source, conditions)
+        for task, future in scheduler.run():    # as completed
+            if future.exception() is None:
+                store.upsertMany(...)
+        executor      - concurrent.futures executor (process or thread pool)
+        maxInFlight   - max. number of submitted, unfinished tasks (default: 2 x number of CPUs)
+    '''
+    def __init__(self, executor, maxInFlight: int = None):
+        self.executor = executor
+        self.maxInFlight = max(int(maxInFlight if maxInFlight is not None else 2 * os.cpu_count()), 1)
+        self._pending = [] # heap of (-cost, order, task)
+        self._order = count()
+
+    def __len__(self):
+        # number of tasks not yet submitted
+        return len(self._pending)
+
+    def add(self, key, cost: float, func: Callable, *args, **kwargs) -> SweepTask:
+        # add task (submitted by run(), equal costs keep order of adding)
+        task = SweepTask(key, float(cost), func, args, kwargs)
+        heapq.heappush(self._pending, (-task.cost, next(self._order), task))
+        return task
+
+    def run(self):
+        '''
+        Generator: submit tasks longest-first, yields (task, future) of finished tasks in order of completion.
+        Exceptions of tasks are not raised (see future.exception()).
+        '''
+        inFlight = dict() # future -> task
+        while (len(self._pending) > 0) or (len(inFlight) > 0):
+            while (len(self._pending) > 0) and (len(inFlight) < self.maxInFlight):
+                _, _, task = heapq.heappop(self._pending)
+                future: Future = self.executor.submit(task.func, *task.args, **task.kwargs)
+                inFlight[future] = task
+
+            done, _ = wait(list(inFlight.keys()), return_when=FIRST_COMPLETED)
+            for future in done:
+                yield inFlight.pop(future), future
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive search of anchor conditions (target MOS bins) without scoring the full parameter grid.
+
+For each target MOS, candidate settings (osf, tc, pow_exp, n_fft, hop_length) are tried in the given
+order; per setting, the SNR is found by bisection on the mean score across all sources (MOS is assumed
+to increase with SNR). The search for a target stops at the first setting whose score is within
+tolerance of the target and consistent across sources (e.g. languages). All scores are memoized, so
+evaluations are shared between targets.
+"""
+
+import tempfile
+from itertools import product
+from pathlib import Path
+from typing import Callable, Dict, NamedTuple, Sequence
+import numpy as np
+import pandas
+import soundfile as sf
+
+from degradeSpecSub import applySpecSub
+from helper.metrics import qualityMetrics
+from p56.asl import calculateP56ASLEx
+
+# default candidate values of non-SNR parameters (see sweep driver)
+DEFAULT_SETTINGS = dict(n_fft=[8192], hop_length=[2048, 128, 64], osf=[0.0, 0.1, 0.25, 0.5, 0.75, 0.90, 1.0, 1.5, 2.0],
+                        tc=[0.035, 0.125, 0.250], pow_exp=[1.0, 2.0])
+
+class AnchorCandidate(NamedTuple):
+    target: float # target MOS
+    params: dict # condition incl. snr
+    mos: float # mean score across sources
+    scores: Dict[str, float] # score per source
+    spread: float # max-min of scores across sources
+
+class AnchorSearch:
+    '''
+    Usage:
+        search = AnchorSearch(metric, sources=['German', 'English', 'Mandarin'], targets=[1.0, 2.0, 3.0, 4.0])
+        anchors = search.run()      # dict {target: AnchorCandidate or None}
+        history = search.history()  # all evaluated (source, condition) pairs
+        metric        - callback metric(source, params) -> score (e.g. MOS-LQO), params: dict with keys
+                        snr, osf, tc, pow_exp, n_fft, hop_length
+        sources       - source identifiers passed to metric (e.g. test files of different languages)
+        targets       - target scores (MOS bins)
+        settings      - dict of candidate values of non-SNR parameters (default: DEFAULT_SETTINGS), tried in
+                        order of the full factorial grid, or list of dicts (explicit order)
+        snrRange      - search interval of SNR (dB)
+        snrResolution - SNR grid of bisection (dB), search stops if interval is smaller
+        tolerance     - max. deviation of mean score from target
+        maxSpread     - max. spread (max-min) of scores across sources
+        executor      - optional concurrent.futures executor for evaluating all sources in parallel
+    '''
+    def __init__(self, metric: Callable[[str, dict], float], sources: Sequence, targets=(1.0, 2.0, 3.0, 4.0),
+                 settings=None, snrRange=(-30.0, 30.0), snrResolution=0.5, tolerance=0.25, maxSpread=0.5,
+                 executor=None):
+        self.metric = metric
+        self.sources = list(sources)
+        self.targets = list(targets)
+        if settings is None:
+            settings = DEFAULT_SETTINGS
+        if isinstance(settings, dict):
+            keys = list(settings.keys())
+            settings = [dict(zip(keys, values)) for values in product(*[np.atleast_1d(settings[k]).tolist() for k in keys])]
+        self.settings = list(settings)
+        self.snrRange = (float(snrRange[0]), float(snrRange[1]))
+        self.snrResolution = float(snrResolution)
+        self.tolerance = tolerance
+        self.maxSpread = maxSpread
+        self.executor = executor
+        self._scores = dict() # (source, condition key) -> score
+
+    @staticmethod
+    def _key(params: dict):
+        return tuple(sorted(params.items()))
+
+    @property
+    def nbrEvaluations(self):
+        return len(self._scores)
+
+    def _snr(self, snr):
+        # SNR on grid of bisection (memoization across targets)
+        return float(np.round(snr / self.snrResolution) * self.snrResolution)
+
+    def evaluate(self, params: dict) -> Dict[str, float]:
+        # scores of all sources for one condition (memoized)
+        key = self._key(params)
+        missing = [src for src in self.sources if (src, key) not in self._scores]
+        if len(missing) > 0:
+            if self.executor is not None:
+                scores = list(self.executor.map(self.metric, missing, [dict(params)] * len(missing)))
+            else:
+                scores = [self.metric(src, dict(params)) for src in missing]
+            for src, score in zip(missing, scores):
+                self._scores[(src, key)] = float(score)
+        return {src: self._scores[(src, key)] for src in self.sources}
+
+    def _candidate(self, target, params) -> AnchorCandidate:
+        scores = self.evaluate(params)
+        values = np.array(list(scores.values()))
+        return AnchorCandidate(target, dict(params), float(np.mean(values)), scores, float(np.max(values) - np.min(values)))
+
+    def _accept(self, cand: AnchorCandidate) -> bool:
+        return (abs(cand.mos - cand.target) <= self.tolerance) and (cand.spread <= self.maxSpread)
+
+    def searchSNR(self, target: float, setting: dict) -> AnchorCandidate:
+        '''
+        Bisection on SNR for one setting: candidate with mean score closest to target (None if target is not
+        bracketed by the scores at the limits of snrRange).
+        '''
+        lower, upper = self.snrRange
+        cLower = self._candidate(target, dict(setting, snr=self._snr(lower)))
+        cUpper = self._candidate(target, dict(setting, snr=self._snr(upper)))
+        best = min([cLower, cUpper], key=lambda c: abs(c.mos - target))
+        if not (cLower.mos - self.tolerance <= target <= cUpper.mos + self.tolerance):
+            return None
+
+        while (upper - lower > self.snrResolution) and not self._accept(best):
+            snr = self._snr((lower + upper) / 2)
+            if snr in (self._snr(lower), self._snr(upper)):
+                break
+            cand = self._candidate(target, dict(setting, snr=snr))
+            if abs(cand.mos - target) < abs(best.mos - target):
+                best = cand
+            if cand.mos < target:
+                lower = snr
+            else:
+                upper = snr
+        return best
+
+    def run(self) -> Dict[float, AnchorCandidate]:
+        '''
+        Search all targets, returns dict {target: accepted candidate or None}
+        '''
+        anchors = dict()
+        for target in self.targets:
+            anchors[target] = None
+            for setting in self.settings:
+                cand = self.searchSNR(target, setting)
+                if (cand is not None) and self._accept(cand):
+                    anchors[target] = cand
+                    break
+        return anchors
+
+    def history(self) -> pandas.DataFrame:
+        # all evaluations: one row per (source, condition)
+        rows = [dict(params, source=src, score=score) for (src, key), score in self._scores.items() for params in [dict(key)]]
+        return pandas.DataFrame(rows)
+
+class _DegradationMetric:
+    # degradation of a source signal (applySpecSub(), leveled to targetAsl) for metric callbacks
+    def __init__(self, signals: dict, targetAsl=-26.0, seed=0):
+        self.signals = signals
+        self.targetAsl = targetAsl
+        self.seed = seed
+
+    def degrade(self, source, params: dict):
+        s, fs = self.signals[source]
+        d = applySpecSub(s, fs, self.targetAsl, snr=params['snr'], osf=params['osf'], tcNoise=params['tc'],
+                         tcSpeech=params['tc'], pow_exp=params['pow_exp'], n_fft=params['n_fft'],
+                         hop_length=params['hop_length'], seed=self.seed)
+        asl, _ = calculateP56ASLEx(d, fs, preFilter='FB')
+        d *= np.power(10, (self.targetAsl - asl) / 20)
+        return d, s, fs
+
+class POLQAMetric(_DegradationMetric):
+    '''
+    Metric callback for AnchorSearch: degradation of a source signal (applySpecSub(), leveled to targetAsl),
+    scored with POLQA (p863.runner.POLQARunner, file with degraded and reference as channels).
+
+    Usage:
+        metric = POLQAMetric({'German': (s, fs), ...}, POLQARunner(), startTime=16.0, duration=8.0, nbrRanges=8)
+        search = AnchorSearch(metric, sources=list(metric.signals.keys()))
+    '''
+    def __init__(self, signals: dict, runner, outputPath: Path = None, targetAsl=-26.0, seed=0, **kwargs):
+        super().__init__(signals, targetAsl, seed)
+        self.runner = runner
+        self.outputPath = Path(outputPath) if outputPath is not None else Path(tempfile.mkdtemp(prefix='anchors_'))
+        self.kwargs = kwargs # see POLQARunner.run()
+
+    def __call__(self, source, params: dict) -> float:
+        d, s, fs = self.degrade(source, params)
+        outputFile = self.outputPath / ('%s_%s.flac' % (source, '_'.join(['%s=%g' % kv for kv in sorted(params.items())])))
+        sf.write(outputFile, np.vstack((d, s)).T, fs, subtype='PCM_16', format='FLAC')
+        try:
+            res = next(iter(self.runner.run([outputFile], chNbrDeg=1, chNbrRef=2, **self.kwargs)))
+        finally:
+            outputFile.unlink(missing_ok=True)
+        return res.mos
+
+class ProxyMetric(_DegradationMetric):
+    '''
+    Metric callback for AnchorSearch with a fast objective proxy (helper.metrics.qualityMetrics()) instead of
+    POLQA, e.g. for pre-screening/pruning of settings before scoring with POLQA. The score must increase with
+    SNR (e.g. 'SegSNR', or -LSD with sign=-1), targets are given on the scale of the proxy.
+
+    Usage:
+        metric = ProxyMetric({'German': (s, fs), ...}, column='SegSNR')
+        search = AnchorSearch(metric, sources=list(metric.signals.keys()), targets=[0.0, 5.0, 10.0], tolerance=1.0)
+    '''
+    def __init__(self, signals: dict, column='SegSNR', sign=1.0, targetAsl=-26.0, seed=0, **kwargs):
+        super().__init__(signals, targetAsl, seed)
+        self.column = column
+        self.sign = sign
+        self.kwargs = kwargs # see qualityMetrics()
+
+    def __call__(self, source, params: dict) -> float:
+        d, s, fs = self.degrade(source, params)
+        return self.sign * qualityMetrics([s], [d], fs, **self.kwargs)[self.column].iloc[0]
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent result store (SQLite) with atomic per-row upserts, safe for concurrent writers
+"""
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional
+import numpy as np
+import pandas
+
+def _quote(name: str) -> str:
+    # quoted SQL identifier (column names like 'MOS-LQO')
+    return '"%s"' % str(name).replace('"', '""')
+
+def _value(value):
+    # SQLite-compatible value (numpy scalars, paths, NA)
+    if isinstance(value, np.generic):
+        value = value.item()
+    elif isinstance(value, Path):
+        value = str(value)
+    if (value is None) or (isinstance(value, float) and np.isnan(value)) or (value is pandas.NA):
+        return None
+    return value
+
+class ResultStore:
+    '''
+    Table of results (one row per key, e.g. output file) in an SQLite database (WAL mode).
+
+    Each upsert is one transaction, so rows are never partially written and concurrent processes/threads
+    can write safely (each uses its own connection, writers wait up to <timeout> seconds for the lock).
+    Columns are added on first use, indexes are created for the parameter columns.
+
+    Usage:
+        store = ResultStore(dbFile, keyColumn='Filename', indexColumns=['NFFT', 'Hop', 'SNR'])
+        store.upsert(str(outputFile), {'SNR': 5.0, 'MOS-LQO': 3.2})
+        df = store.dataFrame()
+        store.exportExcel(resultsP863File)
+    '''
+    def __init__(self, dbFile: Path, keyColumn: str = 'Filename', columns: List[str] = None,
+                 indexColumns: List[str] = None, table: str = 'results', timeout: float = 60.0):
+        self.dbFile = Path(dbFile)
+        self.keyColumn = keyColumn
+        self.table = table
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self._connection() as con:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('CREATE TABLE IF NOT EXISTS %s (%s TEXT PRIMARY KEY)' % (_quote(table), _quote(keyColumn)))
+        self._addColumns(list(columns or []) + list(indexColumns or []))
+        for col in indexColumns or []:
+            with self._connection() as con:
+                con.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (_quote('idx_%s_%s' % (table, col)),
+                                                                        _quote(table), _quote(col)))
+
+    def __getstate__(self):
+        # connections are not passed to other processes
+        state = self.__dict__.copy()
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread and process
+        con = getattr(self._local, 'connection', None)
+        if (con is None) or (self._local.pid != os.getpid()):
+            con = sqlite3.connect(self.dbFile, timeout=self.timeout)
+            con.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection, self._local.pid = con, os.getpid()
+        return con
+
+    @property
+    def columns(self) -> List[str]:
+        cursor = self._connection().execute('PRAGMA table_info(%s)' % _quote(self.table))
+        return [row[1] for row in cursor.fetchall()]
+
+    def _addColumns(self, columns: Iterable[str]):
+        missing = [c for c in dict.fromkeys(columns) if c not in self.columns]
+        for col in missing:
+            try:
+                with self._connection() as con:
+                    con.execute('ALTER TABLE %s ADD COLUMN %s' % (_quote(self.table), _quote(col)))
+            except sqlite3.OperationalError:
+                # added concurrently by other writer
+                if col not in self.columns:
+                    raise
+
+    def upsert(self, key, values: dict):
+        # insert row or update given columns of existing row (one transaction)
+        self.upsertMany({key: values})
+
+    def upsertMany(self, rows):
+        '''
+        Insert/update many rows in one transaction.
+        rows - dict {key: {column: value}} or DataFrame (index: keys)
+        '''
+        if isinstance(rows, pandas.DataFrame):
+            rows = {key: row.to_dict() for key, row in rows.iterrows()}
+        if len(rows) == 0:
+            return
+
+        self._addColumns([c for values in rows.values() for c in values.keys()])
+
+        # group rows with same columns (one statement each)
+        groups = dict()
+        for key, values in rows.items():
+            groups.setdefault(tuple(values.keys()), []).append([_value(key)] + [_value(v) for v in values.values()])
+
+        with self._connection() as con:
+            for cols, data in groups.items():
+                cols = [self.keyColumn] + list(cols)
+                updates = ['%s=excluded.%s' % (_quote(c), _quote(c)) for c in cols[1:]]
+                conflict = ('DO UPDATE SET %s' % ', '.join(updates)) if len(updates) > 0 else 'DO NOTHING'
+                sql = 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT(%s) %s' % (
+                    _quote(self.table), ', '.join(map(_quote, cols)), ', '.join(['?'] * len(cols)),
+                    _quote(self.keyColumn), conflict)
+                con.executemany(sql, data)
+
+    def get(self, key) -> Optional[dict]:
+        cursor = self._connection().execute('SELECT * FROM %s WHERE %s = ?' % (_quote(self.table), _quote(self.keyColumn)),
+                                            (_value(key),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cursor.description], row))
+
+    def __contains__(self, key) -> bool:
+        cursor = self._connection().execute('SELECT 1 FROM %s WHERE %s = ?' % (_quote(self.table), _quote(self.keyColumn)),
+                                            (_value(key),))
+        return cursor.fetchone() is not None
+
+    def __len__(self) -> int:
+        return self._connection().execute('SELECT COUNT(*) FROM %s' % _quote(self.table)).fetchone()[0]
+
+    def remove(self, keys: Iterable):
+        with self._connection() as con:
+            con.executemany('DELETE FROM %s WHERE %s = ?' % (_quote(self.table), _quote(self.keyColumn)),
+                            [(_value(k),) for k in keys])
+
+    def dataFrame(self, where: str = None, params=()) -> pandas.DataFrame:
+        # all rows (or rows matching SQL condition <where>), index: key column
+        sql = 'SELECT * FROM %s' % _quote(self.table)
+        if where is not None:
+            sql += ' WHERE %s' % where
+        return pandas.read_sql_query(sql, self._connection(), params=params).set_index(self.keyColumn)
+
+    def importExcel(self, xlsxFile: Path, index_col=0):
+        # one-time migration of existing results (e.g. Results-P863.xlsx)
+        df = pandas.read_excel(xlsxFile, index_col=index_col)
+        df.index.name = self.keyColumn
+        self.upsertMany(df)
+
+    def exportExcel(self, xlsxFile: Path, columns: List[str] = None):
+        # write all rows to Excel (temp. file first, then replaced)
+        xlsxFile = Path(xlsxFile)
+        df = self.dataFrame()
+        if columns is not None:
+            df = df.reindex(columns=columns)
+        tmpFile = xlsxFile.with_name('.%s.tmp%s' % (xlsxFile.stem, xlsxFile.suffix))
+        df.to_excel(tmpFile)
+        os.replace(tmpFile, xlsxFile)
+
+    def close(self):
+        con = getattr(self._local, 'connection', None)
+        if con is not None:
+            con.close()
+            self._local.connection = None
+
+
+if __name__ == "__main__":
+    pass
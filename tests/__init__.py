@@ -8,6 +8,9 @@ Created on Apr 14 2021 13:07
 from pathlib import Path
 import numpy as np
 
+from sweep.store import ResultStore
+from sweep.container import ConditionItem
+
 
 thisPath = Path(__file__).parent
 resultsP863File = thisPath / Path('Results-P863.xlsx')
@@ -16,6 +19,28 @@ resultColumns = ['SourceFile', 'NFFT', 'Hop', 'SNR', 'OSF', 'TimeConst', 'PowExp
 resultIndices = ['Filename']
 resultIdxRange = np.arange(len(resultIndices)).tolist()
 
+# result store (sqlite), Excel file is exported from it
+resultsDbFile = thisPath / Path('Results-P863.sqlite')
+parameterColumns = ['NFFT', 'Hop', 'SNR', 'OSF', 'TimeConst', 'PowExp']
+
+def conditionStoreFile(outputPath: Path, sourceStem: str) -> Path:
+    # ConditionStore of all conditions of one source (sweep with output='container')
+    return Path(outputPath) / ('processed_%s.specsub' % sourceStem)
+
+def polqaItem(key: str, sourceStem: str):
+    # item of POLQARunner for row of result store: output file or condition (stem of output file) in store
+    if Path(key).is_file() or not conditionStoreFile(Path(key).parent, sourceStem).is_file():
+        return key
+    return ConditionItem(conditionStoreFile(Path(key).parent, sourceStem), Path(key).stem)
+
+def getResultStore() -> ResultStore:
+    # results of generation and P.863 calculation (existing Excel results are imported once)
+    isNew = not resultsDbFile.is_file()
+    store = ResultStore(resultsDbFile, keyColumn=resultIndices[0], columns=resultColumns, indexColumns=parameterColumns)
+    if isNew and resultsP863File.is_file():
+        store.importExcel(resultsP863File, index_col=resultIdxRange)
+    return store
+
 
 if __name__ == "__main__":
     pass
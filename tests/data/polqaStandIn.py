@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for the POLQA executable (tests of p863.runner without license): same command line and
+output format, MOS-LQO is derived from the SNR between reference and degraded signal.
+
+Usage:
+    python polqaStandIn.py [--sleep S] [--fail] [--fail-once DIR] -LC SWB -Version 3 -Test deg.wav -Ref ref.wav
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+import soundfile as sf
+
+def main(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sleep', type=float, default=0.0)
+    parser.add_argument('--fail', action='store_true')
+    parser.add_argument('--fail-once', type=Path, default=None)
+    parser.add_argument('-Test', type=Path, required=True)
+    parser.add_argument('-Ref', type=Path, required=True)
+    args, _ = parser.parse_known_args(args)
+
+    time.sleep(args.sleep)
+    if args.fail:
+        print('POLQA ERROR: simulated failure', file=sys.stderr)
+        return 1
+
+    if args.fail_once is not None:
+        # first call per test file fails
+        marker = args.fail_once / (args.Test.name + '.failed')
+        if not marker.is_file():
+            marker.touch()
+            print('POLQA ERROR: simulated failure', file=sys.stderr)
+            return 2
+
+    deg, _ = sf.read(args.Test)
+    ref, _ = sf.read(args.Ref)
+    snr = 10 * np.log10(np.sum(ref**2) / max(np.sum((deg - ref)**2), 1e-20))
+    mos = 1.0 + 3.75 / (1.0 + np.exp(-(snr - 10.0) / 5.0))
+
+    print('MOS-LQO: %.4f\r' % mos)
+    print('AVG  Delay: 0.0000\r')
+    print('SNR Degraded: %.2f\r' % snr)
+    print('SNR Reference: 60.00\r')
+    if snr < 0:
+        print('POLQA WARNING Low SNR of degraded signal\r')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
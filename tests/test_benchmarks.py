@@ -0,0 +1,48 @@
+import unittest
+import json
+import tempfile
+from pathlib import Path
+import numpy as np
+
+from benchmarks.benchmark import runBenchmarks, compareResults, writeResults, speechLikeSignal, SWEEP_SETTINGS, COLD_START_STAGES
+from p56.asl import calculateP56ASL
+from helper import FS
+
+class BenchmarkTestCase(unittest.TestCase):
+    def test_benchmark_signal(self):
+        s = speechLikeSignal(5.0, seed=1)
+        self.assertEqual(s.shape[0], 5*FS)
+        np.testing.assert_array_equal(s, speechLikeSignal(5.0, seed=1))
+
+        # speech-like: level around -26 dBov, with pauses
+        asl, act = calculateP56ASL(s, FS)
+        self.assertAlmostEqual(asl, -26.0, delta=0.1)
+        self.assertTrue(0.3 < act < 0.95)
+
+    def test_benchmark_run(self):
+        results = runBenchmarks(duration=1.0, repeat=1)
+        names = [r['name'] for r in results['results']]
+        self.assertEqual(names.count('applySpecSub'), len(SWEEP_SETTINGS))
+        self.assertEqual(names.count('coldStart'), len(COLD_START_STAGES))
+        for name in ['calculateP56ASL', 'calculateP56ASLEx', 'ltassP50FB', 'sweep']:
+            self.assertIn(name, names)
+
+        for r in results['results']:
+            self.assertGreater(r['throughput'], 0.0)
+            self.assertGreater(r['peakMemoryBytes'], 0)
+
+        # machine-readable output and regression check
+        with tempfile.TemporaryDirectory() as tmpDir:
+            jsonFile = Path(tmpDir) / 'benchmark.json'
+            writeResults(results, jsonFile)
+            with open(jsonFile) as f:
+                baseline = json.load(f)
+
+        self.assertEqual(len(compareResults(baseline, results)), 0)
+        baseline['results'][0]['throughput'] *= 2
+        regressions = compareResults(baseline, results)
+        self.assertEqual(len(regressions), 1)
+        self.assertAlmostEqual(regressions[0]['ratio'], 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,18 +1,33 @@
 import unittest
 import os
+import pickle
+import tempfile
+import gc
+import tracemalloc
+import sys
+import subprocess
 from typing import List
+from contextlib import ExitStack
 from pathlib import Path
-from resampy import resample
 import numpy as np
-import soundfile as sf
 import pandas
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-from tests import thisPath, resultsP863File, resultColumns, resultIndices, resultIdxRange
+from tests import thisPath, resultsP863File, resultColumns, getResultStore, conditionStoreFile
 from tests.data import downloadETSITestFile, TestFilesETSI
-from degradeSpecSub import applySpecSub
+from scipy.signal import lfilter
+import degradeSpecSub
+import p56.asl
+from degradeSpecSub import applySpecSub, applySpecSubSweep, makeParameterGrid, SpecSubStream, getSpecSubPlan, SWEEP_PARAMETERS, \
+    warmupKernels
 from p56.asl import calculateP56ASLEx
 from helper import FS
+from helper.noise import speechShapedNoise
+from sweep.cache import DegradationCache, hashAudio
+from sweep.pipeline import SourcePool, SharedArray, makeExecutor, writeSequence, processSweepTask
+from sweep.scheduler import TaskScheduler, estimateCost
+from sweep.container import ConditionStore, REFERENCE
+from helper.profiling import StageProfiler, profiling, stage, condition, conditionLabel
 
 class SpecSubDegradeTestCase(unittest.TestCase):
     @classmethod
@@ -23,97 +38,162 @@ class SpecSubDegradeTestCase(unittest.TestCase):
         cls.outputPath.mkdir(exist_ok=True)
         cls.testFile = None
 
+    @staticmethod
+    def _level_sequence(d: np.ndarray, fs: int, targetAsl: float = -26.0):
+        # rescale to -26 dBov
+        with stage('leveling'):
+            asl, act = calculateP56ASLEx(d, fs, preFilter='FB')
+            d *= np.power(10, (targetAsl - asl) / 20)
+        return asl, act
+
     @staticmethod
     def _process_sequence(s: np.ndarray, fs: int, outputFile: Path,
                           snr: float, osf: float, tc: float, pow_exp: float,
                           targetAsl: float = -26.0) -> pandas.DataFrame:
 
         d = applySpecSub(s, fs, targetAsl, snr=snr, osf=osf, tcNoise=tc, tcSpeech=tc, pow_exp=pow_exp)
+        SpecSubDegradeTestCase._level_sequence(d, fs, targetAsl)
+        writeSequence(d, s, fs, outputFile)
 
-        # rescale to -26 dBov
-        asl, _ = calculateP56ASLEx(d, fs, preFilter='FB')
-        d *= np.power(10, (targetAsl - asl) / 20)
-
-        # store degraded and reference in one file
-        signal = np.vstack((d, s)).T
-
-        # use 16-bit (neeed for POLQA testing)
-        sf.write(outputFile, signal, fs, subtype='PCM_16', format='FLAC')
-
+    @staticmethod
+    def _condition_params(cond: dict, targetAsl: float = -26.0) -> dict:
+        # full parameter set of one condition (incl. fixed arguments of engine and leveling)
+        return dict(cond, targetAsl=targetAsl, window='hann', floorSubtractFactor=0.0, preFilter='FB')
 
     @staticmethod
-    def _process_sequences(testFiles: List[Path], outputPath: Path, fs: int=FS, maxWorkers: int = os.cpu_count()-1) -> pandas.DataFrame:
-        # storage for generated files
-        df = pandas.DataFrame(columns=resultColumns + resultIndices).set_index(resultIndices)
-        if resultsP863File.is_file():
-            dfOrig = pandas.read_excel(resultsP863File, index_col=resultIdxRange)
-        else:
-            dfOrig = None
+    def _process_sequences(testFiles: List[Path], outputPath: Path, fs: int=FS, maxWorkers: int = os.cpu_count()-1,
+                           cachePath: Path = None, noiseSeed: int = 0, profile: bool = False, backend: str = 'process',
+                           conditionsPerTask: int = 18, maxInFlight: int = None, output: str = 'files'):
+        # cache of generated signals (skips finished conditions reliably, e.g. after interruption)
+        if cachePath is None:
+            cachePath = outputPath / 'cache'
+        cache = DegradationCache(cachePath)
+        print('Removed %d stale cache files' % cache.prune())
+        profiler = StageProfiler()
 
+        # load kernels while sources are loaded (thread backend: used by all workers, forked workers wait for it
+        # and inherit the loaded kernels)
+        warmupKernels(fs, background=True)
 
+        # output='files': one FLAC file per condition (degraded and reference), output='container': all conditions
+        # of a source in one ConditionStore (reference stored once, key: stem of output file, export on demand)
+        if output not in ('files', 'container'):
+            raise ValueError('Unknown output: %s' % output)
+        containers = dict() # source file -> ConditionStore
 
-        # generate all samples via multiprocessing
-        with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
-            # start tasks
-            results = dict()
+        # generate all samples via multiprocessing (sources in shared memory, tasks only pass handles) or
+        # threads (backend='thread': one process, sources and plans shared by all tasks)
+        # tasks are dispatched longest-first (hop=64 costs ~32x hop=2048), at most maxInFlight at once
+        # containers are closed (flushed) last, also on errors
+        with ExitStack() as containerStack, SourcePool(shared=(backend == 'process')) as pool, \
+                makeExecutor(backend, maxWorkers) as executor:
+            scheduler = TaskScheduler(executor, maxInFlight if maxInFlight is not None else 2 * maxWorkers)
+            pending = dict() # task key -> conditions
+            finishedRows = dict() # rows of conditions finished before (output file -> row)
             for testFile in testFiles:
-                # load & resample signal
-                s, fs1 = sf.read(testFile)
-                if fs1 != fs:
-                    s = resample(s, fs1, fs)
+                # load & resample signal (once)
+                source = pool.load(testFile, fs)
+                s = pool.array(source)
+                audioHash = hashAudio(s, fs)
+                if output == 'container':
+                    container = containerStack.enter_context(
+                        ConditionStore(conditionStoreFile(outputPath, testFile.stem), mode='a', fs=fs))
+                    if REFERENCE not in container:
+                        container.setReference(s, dict(sourceFile=testFile.name, audioHash=audioHash))
+                        container.flush()
+                    containers[testFile] = container
 
                 # iterate over internal pseudo-noise-reduction parameters:
                 for nfft, hop in [(8192, 2048), (8192, 128), (8192, 64)]:
-                    #for snr in [10, 5, 2.5, 0, -2.5, -5, -10, -20, -30]:  # SNR between speech and speech-shaped noise
-                    for snr in [10, 5, 0, -5, -10, -20, -30]:  # SNR between speech and speech-shaped noise
-                        #for osf in [0.0, 0.1, 0.25, 0.4, 0.5, 0.6, 0.75, 0.90, 1.0, 1.5, 2.0]:  # over-subtraction factor
-                        for osf in [0.0, 0.1, 0.25, 0.5, 0.75, 0.90, 1.0, 1.5, 2.0]:  # over-subtraction factor
-                            #for tc in [0.005, 0.035, 0.125, 0.250]:  # time constant for smoothing
-                            for tc in [0.035, 0.125, 0.250]:  # time constant for smoothing
-                                #for pow_exp in [0.5, 1.0, np.sqrt(2), 2.0]:  # power exponent for Wiener gain
-                                for pow_exp in [1.0, 2.0]:  # power exponent for Wiener gain
-
-                                    # run with given settings
-                                    outputFile = outputPath / Path('processed_%s_FFT=%d_hop=%d_snr=%d_osf=%.2f_tc=%d_pe=%.2f.flac' % (
-                                        testFile.stem, nfft, hop, snr, osf, tc * 1000, pow_exp))
-
-                                    if not outputFile.is_file():
-                                        results[outputFile] = executor.submit(SpecSubDegradeTestCase._process_sequence,
-                                                                              s, fs, outputFile, snr, osf, tc, pow_exp)
-
-                                    # store information for P.863 calculation in other unit test
-                                    key = str(outputFile)
-                                    if key not in df.index:
-                                        mos = -1.0
-                                        if (dfOrig is not None) and (key in dfOrig.index):
-                                            mos = dfOrig.loc[key, 'MOS-LQO']
-
-                                        df.loc[key, :] = [testFile.stem, nfft, hop, snr, osf, tc, pow_exp, mos]
-
-            # wait for tasks
-            nbrItems = df.shape[0]
-            print(f"Waiting for {len(results)}/{nbrItems} items to complete...")
-            for i, (key, futureResult) in enumerate(results.items()):
+                    conditions = makeParameterGrid(
+                        n_fft=nfft, hop_length=hop,
+                        #snr=[10, 5, 2.5, 0, -2.5, -5, -10, -20, -30],  # SNR between speech and speech-shaped noise
+                        snr=[10, 5, 0, -5, -10, -20, -30],  # SNR between speech and speech-shaped noise
+                        #osf=[0.0, 0.1, 0.25, 0.4, 0.5, 0.6, 0.75, 0.90, 1.0, 1.5, 2.0],  # over-subtraction factor
+                        osf=[0.0, 0.1, 0.25, 0.5, 0.75, 0.90, 1.0, 1.5, 2.0],  # over-subtraction factor
+                        #tc=[0.005, 0.035, 0.125, 0.250],  # time constant for smoothing
+                        tc=[0.035, 0.125, 0.250],  # time constant for smoothing
+                        #pow_exp=[0.5, 1.0, np.sqrt(2), 2.0],  # power exponent for Wiener gain
+                        pow_exp=[1.0, 2.0],  # power exponent for Wiener gain
+                    )
+
+                    missingConditions = []
+                    for cond in conditions:
+                        snr, osf, tc, pow_exp = cond['snr'], cond['osf'], cond['tc'], cond['pow_exp']
+
+                        # run with given settings
+                        outputFile = outputPath / Path('processed_%s_FFT=%d_hop=%d_snr=%g_osf=%.2f_tc=%g_pe=%.2f.flac' % (
+                            testFile.stem, nfft, hop, snr, osf, tc * 1000, pow_exp))
+
+                        # information for P.863 calculation in other unit test (stored after completion)
+                        row = dict(zip(resultColumns[:-1], [testFile.stem, nfft, hop, snr, osf, tc, pow_exp]))
+
+                        params = SpecSubDegradeTestCase._condition_params(cond)
+                        cacheKey = cache.key(audioHash, params, seed=noiseSeed)
+                        if cacheKey not in cache:
+                            # (re-)generated: score of previous file (if any) is reset, so it is scored again
+                            missingConditions.append(dict(cond, outputFile=outputFile, cacheKey=cacheKey, params=params,
+                                                          row=dict(row, **{resultColumns[-1]: None})))
+                            continue
+                        elif output == 'container':
+                            if outputFile.stem not in container:
+                                # finished before: only add to container
+                                d, meta = cache.get(cacheKey)
+                                container.put(outputFile.stem, d, dict(row, **meta))
+                        elif not outputFile.is_file():
+                            # finished before: only (re-)write output file
+                            d, _ = cache.get(cacheKey)
+                            writeSequence(d, s, fs, outputFile)
+                        finishedRows[str(outputFile)] = row
+
+                    # tasks of up to conditionsPerTask conditions of one (file, nfft, hop): STFTs are shared by
+                    # the conditions of a task, noise is the same in all tasks (seeded)
+                    for c0 in range(0, len(missingConditions), conditionsPerTask):
+                        chunk = missingConditions[c0:c0 + conditionsPerTask]
+                        scheduler.add((testFile, nfft, hop, c0), estimateCost(len(s), nfft, hop, len(chunk)),
+                                      processSweepTask, source, fs, chunk, cachePath, noiseSeed,
+                                      profile=profile, writeFiles=(output == 'files'))
+                        pending[(testFile, nfft, hop, c0)] = chunk
+
+            if (len(finishedRows) == 0) and (len(scheduler) == 0):
+                print('Nothing to process')
+                return
+
+            # storage for generated files (existing rows keep their MOS-LQO), created after successful setup
+            store = getResultStore()
+            store.upsertMany(finishedRows)
+
+            # run tasks, rows of finished tasks are stored as they complete
+            print(f"Waiting for {len(scheduler)} tasks to complete...")
+            for task, futureResult in scheduler.run():
+                chunk = pending.pop(task.key)
                 e = futureResult.exception()
                 if e is None:
-                    dfProc = futureResult.result()
-
-                    # store in output
-                    if dfProc is not None:
-                        df = df.combine_first(dfProc)
-                        df.to_excel(resultsP863File)
+                    if output == 'container':
+                        # collect from cache (single writer per container)
+                        container = containers[task.key[0]]
+                        for cond in chunk:
+                            d, meta = cache.get(cond['cacheKey'])
+                            container.put(cond['outputFile'].stem, d, dict(cond['row'], **meta))
+                        container.flush()
+                    store.upsertMany({str(cond['outputFile']): cond['row'] for cond in chunk})
+                    # aggregate profiling records of workers
+                    records = futureResult.result()
+                    if records is not None:
+                        profiler.merge(records)
                 else:
                     print(str(e))
 
-        # final check: remove all rows where the file does not exist
-        remove = []
-        for key, row in df.iterrows():
-            if not Path(key).is_file():
-                remove.append(key)
+            stored = set()
+            for container in containers.values():
+                stored.update(container.keys())
 
-        df = df.drop(labels=remove)
+        # final check: remove all rows where the file (or condition in container) does not exist
+        store.remove([key for key in store.dataFrame().index if not (Path(key).is_file() or Path(key).stem in stored)])
+        store.exportExcel(resultsP863File, columns=resultColumns)
 
-        df.to_excel(resultsP863File)
+        if profile:
+            print(profiler.summary())
 
     def test_specsub(self):
 
@@ -127,5 +207,355 @@ class SpecSubDegradeTestCase(unittest.TestCase):
 
         self._process_sequences(testFiles, outputPath=self.outputPath)
 
+    def test_specsub_sweep(self):
+        # sweep with shared STFTs must reproduce single calls (same noise realization)
+        fs = FS
+        s = 0.05 * np.random.randn(2 * fs)
+        conditions = makeParameterGrid(n_fft=1024, hop_length=[256, 128], snr=[5, -5], osf=[0.5, 1.0],
+                                       tc=[0.035, 0.125], pow_exp=[1.0, 2.0])
+
+        np.random.seed(42)
+        results = list(applySpecSubSweep(s, fs, -26.0, conditions))
+        self.assertEqual(len(results), len(conditions))
+
+        for cond, d in results:
+            with self.subTest(**cond):
+                np.random.seed(42)
+                d1 = applySpecSub(s, fs, -26.0, cond['snr'], n_fft=cond['n_fft'], hop_length=cond['hop_length'],
+                                  osf=cond['osf'], tcNoise=cond['tc'], tcSpeech=cond['tc'], pow_exp=cond['pow_exp'])
+                self.assertEqual(d.shape, s.shape)
+                np.testing.assert_allclose(d, d1, atol=1e-6)
+
+    def test_specsub_plan(self):
+        # STFT/ISTFT of plan must match librosa (center=True)
+        import librosa # imported on demand (slow import, not needed by other tests)
+        s = np.random.randn(FS + 321)
+        for n_fft, hop in [(1024, 256), (1024, 300), (8192, 64)]:
+            with self.subTest(n_fft=n_fft, hop=hop):
+                plan = getSpecSubPlan(FS, n_fft, hop)
+                stft_args = dict(n_fft=n_fft, hop_length=hop, window='hann', center=True)
+                S = librosa.stft(s, **stft_args)
+                np.testing.assert_allclose(plan.stft(s), S, atol=1e-9)
+
+                y = librosa.istft(S, **stft_args)
+                y = np.pad(y, (0, s.shape[0] - y.shape[0]))
+                np.testing.assert_allclose(plan.istft(S, s.shape[0]), y, atol=1e-9)
+
+    def test_specsub_seed(self):
+        # seeded noise is reproducible, also with precomputed noise STFT, sweep and stream
+        s = 0.05 * np.random.randn(FS)
+        kwargs = dict(n_fft=1024, hop_length=256)
+        d = applySpecSub(s, FS, -26.0, 5.0, seed=1, **kwargs)
+        np.testing.assert_array_equal(d, applySpecSub(s, FS, -26.0, 5.0, seed=np.random.default_rng(1), **kwargs))
+        self.assertGreater(np.abs(d - applySpecSub(s, FS, -26.0, 5.0, seed=2, **kwargs)).max(), 1e-3)
+
+        N = getSpecSubPlan(FS, **kwargs).noiseStft(s.shape, seed=1)
+        np.testing.assert_array_equal(d, applySpecSub(s, FS, -26.0, 5.0, noiseStft=N, **kwargs))
+
+        for cond, d1 in applySpecSubSweep(s, FS, -26.0, makeParameterGrid(snr=[5.0, 0.0], **kwargs), seed=1):
+            np.testing.assert_allclose(d1, applySpecSub(s, FS, -26.0, cond['snr'], seed=1, **kwargs), atol=1e-6)
+
+        stream = SpecSubStream(FS, -26.0, 5.0, seed=1, **kwargs)
+        d1 = np.concatenate([stream.process(s[:1000]), stream.process(s[1000:]), stream.flush()])
+        np.testing.assert_allclose(d1, d, atol=1e-6)
+
+    def test_specsub_multichannel(self):
+        # channels x samples: same as sequential calls per channel (noise realization continues per channel)
+        s = 0.05 * np.random.randn(3, FS)
+        for signal in [s, list(s)]:
+            np.random.seed(42)
+            d = applySpecSub(signal, FS, -26.0, 5.0, n_fft=1024, hop_length=256)
+            self.assertEqual(d.shape, s.shape)
+
+            np.random.seed(42)
+            for ch in range(s.shape[0]):
+                d1 = applySpecSub(s[ch], FS, -26.0, 5.0, n_fft=1024, hop_length=256)
+                np.testing.assert_allclose(d[ch], d1, atol=1e-6)
+
+    def test_specsub_stream(self):
+        # streaming with arbitrary chunk sizes must reproduce batch processing (same noise realization)
+        fs = FS
+        s = 0.05 * np.random.randn(2 * fs + 123)
+        chunkSizes = np.random.randint(1, 20000, size=s.shape[0])
+
+        for kwargs in [dict(n_fft=1024, hop_length=256), dict(n_fft=2048, hop_length=64, osf=1.5, pow_exp=1.0)]:
+            with self.subTest(**kwargs):
+                np.random.seed(42)
+                d = applySpecSub(s, fs, -26.0, 5.0, **kwargs)
+
+                np.random.seed(42)
+                stream = SpecSubStream(fs, -26.0, 5.0, **kwargs)
+                output, i = [], 0
+                for chunkSize in chunkSizes:
+                    output.append(stream.process(s[i:i+chunkSize]))
+                    i += chunkSize
+                    if i >= s.shape[0]:
+                        break
+                output.append(stream.flush())
+
+                np.testing.assert_allclose(np.concatenate(output), d, atol=1e-6)
+
+    def test_specsub_noise_shaping(self):
+        # time-domain speech-shaped noise: same result via seed, precomputed noise, sweep and stream
+        s = 0.05 * np.random.randn(2 * FS)
+        kwargs = dict(n_fft=1024, hop_length=256)
+        d = applySpecSub(s, FS, -26.0, 5.0, seed=3, noiseShaping='time', **kwargs)
+        np.testing.assert_array_equal(d, applySpecSub(s, FS, -26.0, 5.0, noiseSignal=speechShapedNoise(s.shape, FS, seed=3), **kwargs))
+        self.assertFalse(np.allclose(d, applySpecSub(s, FS, -26.0, 5.0, seed=3, **kwargs)))
+
+        conditions = makeParameterGrid(n_fft=[1024, 2048], hop_length=256, snr=[5.0, 0.0])
+        for cond, d1 in applySpecSubSweep(s, FS, -26.0, conditions, seed=3, noiseShaping='time'):
+            d2 = applySpecSub(s, FS, -26.0, cond['snr'], n_fft=cond['n_fft'], hop_length=256, seed=3, noiseShaping='time')
+            np.testing.assert_allclose(d1, d2, atol=1e-6)
+
+        stream = SpecSubStream(FS, -26.0, 5.0, seed=3, noiseShaping='time', **kwargs)
+        output = [stream.process(s[i:i+5000]) for i in range(0, s.shape[0], 5000)] + [stream.flush()]
+        np.testing.assert_allclose(np.concatenate(output), d, atol=1e-6)
+
+    def test_specsub_dtype(self):
+        # float32 end to end: complex64 STFTs, deviation from float64 within documented bound (-80 dB re RMS)
+        s = 0.05 * np.random.randn(2 * FS)
+        for n_fft, hop in [(1024, 256), (2048, 64)]:
+            with self.subTest(n_fft=n_fft, hop=hop):
+                plan = getSpecSubPlan(FS, n_fft, hop, dtype=np.float32)
+                self.assertEqual(plan.stft(s).dtype, np.complex64)
+                self.assertEqual(plan.window.dtype, np.float32)
+
+                kwargs = dict(n_fft=n_fft, hop_length=hop, osf=1.0, seed=1)
+                d = applySpecSub(s, FS, -26.0, 0.0, **kwargs).astype(float)
+                d32 = applySpecSub(s, FS, -26.0, 0.0, dtype=np.float32, **kwargs)
+                self.assertEqual(d32.dtype, np.float32)
+                self.assertLess(20*np.log10(np.abs(d - d32).max() / np.sqrt(np.mean(d**2))), -80.0)
+
+                conditions = makeParameterGrid(n_fft=n_fft, hop_length=hop, snr=[0.0], osf=1.0)
+                _, d1 = next(applySpecSubSweep(s, FS, -26.0, conditions, seed=1, dtype=np.float32))
+                np.testing.assert_allclose(d1, d32, atol=1e-6)
+
+        with self.assertRaises(ValueError):
+            getSpecSubPlan(FS, 1024, 256, dtype=np.float16)
+
+    def test_specsub_pipeline(self):
+        # shared source, leveling within inverse STFT: same cache entries as separate leveling pass
+        s = speechShapedNoise(2 * FS, FS, level=-26.0, seed=5, dtype=float)
+        s[FS//2:FS] = 0.0
+        conditions = makeParameterGrid(n_fft=1024, hop_length=256, snr=[10, -10], osf=[0.0, 1.0])
+        with tempfile.TemporaryDirectory() as tmpDir, SourcePool() as pool:
+            cache = DegradationCache(Path(tmpDir))
+            conds = [dict(cond, outputFile=Path(tmpDir) / ('%d.flac' % i), cacheKey='key%d' % i, params=cond)
+                     for i, cond in enumerate(conditions)]
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                executor.submit(processSweepTask, pool.share(s), FS, conds, Path(tmpDir), 1).result()
+
+            for cond, (_, d) in zip(conds, applySpecSubSweep(s, FS, -26.0, conditions, seed=1)):
+                asl, act = SpecSubDegradeTestCase._level_sequence(d, FS)
+                d1, meta = cache.get(cond['cacheKey'])
+                np.testing.assert_allclose(d1, d, atol=1/32768)
+                self.assertAlmostEqual(meta['asl'], asl, places=9)
+                self.assertAlmostEqual(meta['activity'], act, places=9)
+                self.assertTrue(cond['outputFile'].is_file())
+
+    @staticmethod
+    def _reference_gain(S, N, aS, aN, osf, floorSubtractFactor, pow_exp):
+        # smoothing, spectral subtraction and Wiener gain as in first version of applySpecSub (lfilter, np.power)
+        Y = S + N
+        absY = lfilter([1-aS], [1, -aS], np.abs(Y), axis=1)
+        absN = lfilter([1-aN], [1, -aN], np.abs(N), axis=1)
+        S_est = np.maximum(absY-osf*absN, floorSubtractFactor*absY)
+        G = np.power(S_est**pow_exp/(S_est**pow_exp + absN**pow_exp), 1/pow_exp)
+        return S * G
+
+    def test_specsub_gain(self):
+        # fused kernel (incl. states between calls) reproduces reference implementation
+        rng = np.random.default_rng(3)
+        nbrBins, nbrFrames = 129, 200
+        S = (rng.standard_normal((nbrBins, nbrFrames)) + 1j*rng.standard_normal((nbrBins, nbrFrames))) * \
+            np.logspace(0, -3, nbrBins)[:, None]
+        N = rng.standard_normal((nbrBins, nbrFrames)) + 1j*rng.standard_normal((nbrBins, nbrFrames))
+        noiseGain = 0.01
+
+        for n_fft, overlap in [(1024, 0.75), (1024, 0.5), (8192, 0.875), (2048, 0.9)]:
+            fsBlock = FS / ((1 - overlap) * n_fft) # as derived in first version (non-integer hop for 2048, 0.9)
+            hop_length = degradeSpecSub._getHopLength(n_fft, None, overlap)
+            self.assertEqual(degradeSpecSub._blockRate(FS, n_fft, hop_length, overlap), fsBlock)
+            self.assertEqual(degradeSpecSub._blockRate(FS, n_fft, hop_length), FS / hop_length)
+            for pow_exp in [0.5, 1.0, np.sqrt(2), 2.0]:
+                for osf, floorSubtractFactor in [(0.99, 0.0), (2.0, 0.0), (1.0, 0.1), (0.5, 0.5)]:
+                    with self.subTest(n_fft=n_fft, overlap=overlap, pow_exp=pow_exp, osf=osf, floorSubtractFactor=floorSubtractFactor):
+                        aS = degradeSpecSub._smoothingFactor(0.035, fsBlock)
+                        aN = degradeSpecSub._smoothingFactor(0.125, fsBlock)
+                        P = self._reference_gain(S, noiseGain*N, aS, aN, osf, floorSubtractFactor, pow_exp)
+
+                        out = np.empty_like(S)
+                        stateY, stateN = np.zeros(nbrBins), np.zeros(nbrBins)
+                        for t0, t1 in [(0, 73), (73, nbrFrames)]:
+                            degradeSpecSub._specSubKernel(S[:, t0:t1], N[:, t0:t1], noiseGain, aS, aN, osf,
+                                                          floorSubtractFactor, pow_exp, stateY, stateN, out[:, t0:t1])
+                        np.testing.assert_allclose(out, P, rtol=1e-9, atol=1e-12)
+
+    # fork of a worker process during background warm-up (new interpreter: numba not yet loaded)
+    _WARMUP_FORK_SCRIPT = '''
+import sys, time, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from degradeSpecSub import warmupKernels, applySpecSub
+thread = warmupKernels(48000, background=True)
+time.sleep(float(sys.argv[1]))
+s = 0.05 * np.random.default_rng(0).standard_normal(48000)
+with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('fork')) as executor:
+    executor.submit(applySpecSub, s, 48000, -26.0, 5.0, n_fft=1024, hop_length=256, seed=0).result(timeout=60)
+print('done')
+'''
+
+    @unittest.skipIf(not hasattr(os, 'fork'), 'fork not available')
+    def test_specsub_warmup_fork(self):
+        # workers forked during warm-up must not inherit locks of numba or imports held by the warm-up thread
+        for delay in [0.0, 0.1, 0.25]:
+            with self.subTest(delay=delay):
+                res = subprocess.run([sys.executable, '-c', self._WARMUP_FORK_SCRIPT, str(delay)], cwd=thisPath.parent,
+                                     capture_output=True, text=True, timeout=120)
+                self.assertEqual(res.returncode, 0, res.stderr)
+                self.assertEqual(res.stdout.strip(), 'done')
+
+    def test_specsub_warmup(self):
+        # all kernel signatures of single calls, sweeps (incl. leveling) and streams are loaded by warm-up
+        plans = list(degradeSpecSub._plans.keys())
+        warmupKernels(FS, background=True).join()
+        dispatchers = [degradeSpecSub._specSubKernel.dispatcher] + \
+                      [getattr(p56.asl, name).dispatcher for name in ('_getActivity', '__bin_interp')]
+        signatures = [len(dispatcher.signatures) for dispatcher in dispatchers]
+        self.assertEqual(list(degradeSpecSub._plans.keys()), plans)
+
+        s = 0.05 * np.random.default_rng(1).standard_normal(FS // 2)
+        for dtype in [np.float64, np.float32]:
+            for seed in [0, None, np.random.default_rng(2)]:
+                for noiseShaping in ['stft', 'time']:
+                    kwargs = dict(seed=seed, dtype=dtype, noiseShaping=noiseShaping)
+                    applySpecSub(np.vstack((s, s)), FS, -26.0, 0.0, n_fft=512, hop_length=128, **kwargs)
+                    list(applySpecSubSweep(s, FS, -26.0, makeParameterGrid(n_fft=512, hop_length=128), levelTo=-26.0, **kwargs))
+        for noiseShaping in ['stft', 'time']:
+            SpecSubStream(FS, -26.0, 0.0, n_fft=512, hop_length=128, seed=0, noiseShaping=noiseShaping).process(s)
+
+        self.assertEqual([len(dispatcher.signatures) for dispatcher in dispatchers], signatures)
+
+    def test_specsub_memory(self):
+        # no signal-sized memory (STFT, padded input, overlap-add buffer) is kept by the plan after a call
+        s = speechShapedNoise(2 * FS, FS, level=-26.0, seed=5, dtype=float)
+        kwargs = dict(n_fft=1024, hop_length=64, seed=np.random.default_rng(0))
+        applySpecSub(s[:FS], FS, -26.0, 5.0, **kwargs)
+        stftBytes = 16 * (1024//2 + 1) * getSpecSubPlan(FS, 1024, 64).nbrFrames(s.shape[0])
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            d = applySpecSub(s, FS, -26.0, 5.0, **kwargs)
+            del d
+            gc.collect()
+            retained, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertGreater(peak, stftBytes)
+        self.assertLess(retained, 0.1 * stftBytes)
+
+    def test_specsub_noise_level(self):
+        # time-domain noise has the level of the LTASS-weighted STFT noise (effective SNR independent of noiseShaping)
+        shape = (4 * FS,)
+        for n_fft, hop in [(256, 64), (1024, 256), (8192, 2048)]:
+            with self.subTest(n_fft=n_fft):
+                plan = getSpecSubPlan(FS, n_fft, hop)
+                levels = [10*np.log10(np.mean(np.power(np.abs(plan.noiseStft(shape, seed=4, noiseShaping=shaping)), 2)))
+                          for shaping in ['stft', 'time']]
+                self.assertAlmostEqual(levels[0], levels[1], delta=0.5)
+
+                # precomputed time-domain noise at 0 dB is calibrated the same way
+                N = plan.stft(speechShapedNoise(shape, FS, seed=4)) * plan.noiseCalibration
+                self.assertAlmostEqual(10*np.log10(np.mean(np.power(np.abs(N), 2))), levels[0], delta=0.5)
+
+    def test_specsub_noise_cache(self):
+        # noise cache is opt-in, bounded by bytes, released when plan is removed from plan cache
+        shape = (FS // 2,)
+        plan = getSpecSubPlan(FS, 512, 128, window='hann', dtype=np.float32)
+        N = plan.noiseStft(shape, seed=1)
+        self.assertTrue(N.flags.writeable)
+        self.assertEqual(plan.noiseCacheSize, 0)
+
+        plan = getSpecSubPlan(FS, 512, 128, window='hann', dtype=np.float32, noiseCacheBytes=int(2.5 * N.nbytes))
+        for seed in [1, 2, 3]:
+            self.assertFalse(plan.noiseStft(shape, seed=seed).flags.writeable)
+        self.assertEqual(plan.noiseCacheSize, 2 * N.nbytes)
+        self.assertIs(plan.noiseStft(shape, seed=3), plan.noiseStft(shape, seed=3))
+        np.testing.assert_array_equal(plan.noiseStft(shape, seed=1), N)
+        plan.setNoiseCacheBytes(N.nbytes)
+        self.assertEqual(plan.noiseCacheSize, N.nbytes)
+
+        for hop in range(1, degradeSpecSub.PLAN_CACHE_SIZE + 1):
+            getSpecSubPlan(FS, 512, hop, window='hann', dtype=np.float32)
+        self.assertIsNot(getSpecSubPlan(FS, 512, 128, window='hann', dtype=np.float32), plan)
+        self.assertEqual(plan.noiseCacheSize, 0)
+        plan.setNoiseCacheBytes(0)
+
+    def test_specsub_threads(self):
+        # thread backend: concurrent tasks on shared plans/noise caches reproduce serial results (seeded noise)
+        s = speechShapedNoise(2 * FS, FS, level=-26.0, seed=5, dtype=float)
+        conditions = makeParameterGrid(n_fft=1024, hop_length=256, snr=[10, 0, -10], osf=[0.0, 1.0])
+        serial = [d for _, d in applySpecSubSweep(s, FS, -26.0, conditions, seed=2)]
+
+        def task(cond):
+            return applySpecSub(s, FS, -26.0, cond['snr'], osf=cond['osf'], n_fft=1024, hop_length=256, seed=2,
+                                fftWorkers=2)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for d, d1 in zip(executor.map(task, conditions * 4), serial * 4):
+                np.testing.assert_allclose(d, d1, atol=1e-6)
+
+        with self.assertRaises(ValueError):
+            makeExecutor('cluster')
+
+        with tempfile.TemporaryDirectory() as tmpDir, SourcePool(shared=False) as pool:
+            source = pool.share(s)
+            self.assertNotIsInstance(source, SharedArray)
+            self.assertIs(pool.array(source), source)
+            conds = [dict(cond, outputFile=Path(tmpDir) / ('%d.flac' % i), cacheKey='key%d' % i, params=cond)
+                     for i, cond in enumerate(conditions)]
+            with makeExecutor('thread', 3) as executor:
+                futures = [executor.submit(processSweepTask, source, FS, [cond], Path(tmpDir), 2,
+                                           profile=True) for cond in conds]
+                records = [f.result() for f in futures]
+
+            cache = DegradationCache(Path(tmpDir))
+            for cond, d, r in zip(conds, serial, records):
+                SpecSubDegradeTestCase._level_sequence(d, FS)
+                np.testing.assert_allclose(cache.get(cond['cacheKey'])[0], d, atol=1/32768)
+                # profiler per thread: no stages of conditions of other tasks
+                labels = {rec[1] for rec in r}
+                self.assertIn(conditionLabel(cond, SWEEP_PARAMETERS), labels)
+                self.assertEqual(len([c for c in conds if conditionLabel(c, SWEEP_PARAMETERS) in labels]), 1)
+
+    def test_specsub_profiling(self):
+        # stages per condition incl. leveling, records of "workers" can be merged; nothing recorded if disabled
+        s = 0.05 * np.random.randn(FS)
+        conditions = makeParameterGrid(n_fft=1024, hop_length=256, snr=[5, -5])
+        with profiling(memory=True) as prof:
+            for cond, d in applySpecSubSweep(s, FS, -26.0, conditions, seed=0):
+                with condition(conditionLabel(cond, SWEEP_PARAMETERS)):
+                    SpecSubDegradeTestCase._level_sequence(d, FS)
+
+        df = prof.dataFrame()
+        for st in ['stft', 'noise', 'gain', 'istft', 'leveling', 'prefilter', 'asl']:
+            self.assertIn(st, df['Stage'].values)
+        self.assertEqual(df['Condition'].nunique(), 1 + len(conditions))
+        self.assertEqual((df['Stage'] == 'gain').sum(), len(conditions))
+        self.assertTrue((df['AllocatedBytes'] > 0).any())
+        self.assertEqual(df.loc[df['Stage'] == 'prefilter', 'Depth'].max(), 1)
+
+        profiler = StageProfiler().merge(pickle.loads(pickle.dumps(prof.records))).merge(prof)
+        summary = profiler.summary()
+        self.assertEqual(summary.loc['gain', 'Calls'], 2 * len(conditions))
+        self.assertAlmostEqual(summary.loc[['stft', 'noise', 'gain', 'istft', 'leveling'], 'WallShare'].sum(), 1.0)
+
+        applySpecSub(s, FS, -26.0, 5.0, n_fft=1024, hop_length=256)
+        self.assertEqual(len(prof.records), len(df))
+        with profiling(enabled=False) as prof:
+            self.assertIsNone(prof)
+
 if __name__ == '__main__':
     unittest.main()
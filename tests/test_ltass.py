@@ -0,0 +1,34 @@
+import unittest
+import numpy as np
+from scipy.signal import freqz
+
+from helper import FS
+from helper.coeffs import getCoeffsP50
+from helper.ltass import ltassP50FB, ltassP50FBLevels
+
+class LtassTestCase(unittest.TestCase):
+    def test_ltass_cached(self):
+        # cached evaluation must match direct evaluation of P.50 FB filter, only level offset differs per call
+        freq = np.fft.rfftfreq(8192, 1 / FS)
+        b, a = getCoeffsP50()
+        _, H = freqz(b, a, freq, fs=FS)
+        S = 20*np.log10(np.maximum(H, np.power(10, -100.0/20)))
+        S += -4.7 - 10 * np.log10(np.sum(np.power(10, S / 10) / freq.shape[0]))
+
+        np.testing.assert_allclose(ltassP50FB(freq), S, atol=1e-10)
+        np.testing.assert_allclose(ltassP50FB(freq, -20.0), ltassP50FB(freq) - 15.3, atol=1e-10)
+
+        # other grid, read-only coefficients
+        self.assertEqual(ltassP50FB(np.fft.rfftfreq(1024, 1 / FS)).shape, (513,))
+        self.assertFalse(b.flags.writeable)
+
+    def test_ltass_levels(self):
+        freq = np.fft.rfftfreq(1024, 1 / FS)
+        levels = [-4.7, -26.0, -40.0]
+        L = ltassP50FBLevels(freq, levels, minDb=-80.0)
+        self.assertEqual(L.shape, (3, freq.shape[0]))
+        for i, level in enumerate(levels):
+            np.testing.assert_array_equal(L[i], ltassP50FB(freq, level, minDb=-80.0))
+
+if __name__ == '__main__':
+    unittest.main()
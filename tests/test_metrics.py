@@ -0,0 +1,58 @@
+import unittest
+import numpy as np
+
+from helper import FS
+from helper.metrics import qualityMetrics
+from benchmarks.benchmark import speechLikeSignal
+from degradeSpecSub import applySpecSub
+from sweep.search import AnchorSearch, ProxyMetric
+
+class QualityMetricsTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.signals = [speechLikeSignal(6.0, seed=k, level=-26.0) for k in range(3)]
+
+    def test_metrics_identity(self):
+        # identical (and only scaled) degraded signals: no distortion
+        s = self.signals[0]
+        df = qualityMetrics([s, s], [s, 0.1*s], FS)
+        np.testing.assert_allclose(df['SegSNR'], 35.0)
+        np.testing.assert_allclose(df[['LSD', 'BSD']], 0.0, atol=0.05)
+        np.testing.assert_allclose(df['ASLDeg'] - df['ASLRef'], [0.0, -20.0], atol=0.05)
+
+    def test_metrics_monotonic(self):
+        # more noise: lower segmental SNR, higher spectral distances
+        s = self.signals[1]
+        deg = [applySpecSub(s, FS, -26.0, snr=snr, osf=0.0, n_fft=1024, hop_length=256, seed=1) for snr in [-5.0, 5.0, 20.0]]
+        df = qualityMetrics([s] * 3, deg, FS)
+        self.assertTrue(np.all(np.diff(df['SegSNR']) > 0))
+        self.assertTrue(np.all(np.diff(df['LSD']) < 0))
+        self.assertTrue(np.all(np.diff(df['BSD']) < 0))
+
+    def test_metrics_batch(self):
+        # different lengths, batches and names: same as one pair at a time
+        refs = [self.signals[0], self.signals[1][:4*FS], self.signals[2][:5*FS + 17]]
+        rng = np.random.default_rng(2)
+        degs = [r + 0.01 * rng.standard_normal(r.shape) for r in refs]
+        df = qualityMetrics(refs, degs, FS, names=['a', 'b', 'c'], batchSize=2)
+        self.assertEqual(list(df.index), ['a', 'b', 'c'])
+        for k, name in enumerate(df.index):
+            single = qualityMetrics([refs[k]], [degs[k]], FS)
+            np.testing.assert_allclose(df.loc[name].values, single.iloc[0].values, rtol=1e-6)
+
+        with self.assertRaises(ValueError):
+            qualityMetrics(refs, degs[:2], FS)
+
+    def test_metrics_proxy_search(self):
+        # proxy metric as callback of anchor search (pre-screening)
+        metric = ProxyMetric({'a': (self.signals[0], FS), 'b': (self.signals[1], FS)}, column='SegSNR')
+        search = AnchorSearch(metric, sources=['a', 'b'], targets=[10.0], tolerance=1.0, maxSpread=3.0,
+                              settings=dict(n_fft=[1024], hop_length=[256], osf=[1.0], tc=[0.125], pow_exp=[2.0]),
+                              snrRange=(-20.0, 30.0), snrResolution=0.5)
+        anchors = search.run()
+        self.assertIsNotNone(anchors[10.0])
+        self.assertLessEqual(abs(anchors[10.0].mos - 10.0), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+import numpy as np
+from scipy.signal import welch, freqz
+
+from helper import FS
+from helper.coeffs import getCoeffsP50
+from helper.noise import speechShapedNoise, SpeechShapedNoise
+
+class SpeechShapedNoiseTestCase(unittest.TestCase):
+    def test_noise_level(self):
+        # calibrated level (expected and exact), independent channels, other sampling rates
+        n = speechShapedNoise((2, 20*FS), FS, level=-20.0, seed=1)
+        self.assertEqual(n.dtype, np.float32)
+        levels = 10*np.log10(np.mean(np.power(n.astype(float), 2), axis=-1))
+        np.testing.assert_allclose(levels, -20.0, atol=0.2)
+        self.assertLess(np.abs(np.corrcoef(n)[0, 1]), 0.05)
+
+        for fs in [8000, 16000, 44100]:
+            with self.subTest(fs=fs):
+                n = speechShapedNoise(10*fs + 1, fs, level=-30.0, seed=2, exactLevel=True, dtype=float)
+                self.assertEqual(n.shape, (10*fs + 1,))
+                self.assertAlmostEqual(10*np.log10(np.mean(np.power(n, 2))), -30.0, places=6)
+
+    def test_noise_spectrum(self):
+        # spectrum follows P.50 FB filter (constant offset)
+        n = speechShapedNoise(20*FS, FS, seed=3)
+        freq, P = welch(n, FS, nperseg=8192)
+        _, H = freqz(*getCoeffsP50(), freq, fs=FS)
+        idx = (freq > 100) & (freq < 20000)
+        diff = 10*np.log10(P[idx]) - 20*np.log10(np.abs(H[idx]))
+        self.assertLess(np.std(diff), 0.5)
+
+    def test_noise_stream(self):
+        # chunk-wise generation equals one-shot generation with same seed
+        n = speechShapedNoise(5*FS, FS, level=-10.0, seed=4)
+        gen = SpeechShapedNoise(FS, level=-10.0, seed=4)
+        m = np.concatenate([gen.generate(k) for k in [1, 999, 100000, 5*FS - 101000]])
+        np.testing.assert_allclose(m, n, atol=1e-6)
+
+        with self.assertRaises(ValueError):
+            SpeechShapedNoise(16000)
+
+if __name__ == '__main__':
+    unittest.main()
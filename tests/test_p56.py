@@ -1,11 +1,15 @@
 import unittest
+import tempfile
+from pathlib import Path
 import librosa
+import soundfile as sf
 import numpy as np
 from scipy import signal
 import matplotlib.pyplot as plt
 
 from tests.data import downloadETSITestFile, TestFilesETSI
-from p56.asl import calculateP56ASL, calculateP56ASLEx, getFilter, applyFilters
+from p56.asl import calculateP56ASL, calculateP56ASLEx, getFilter, applyFilters, ASLMeter, calculateP56ASLBatch
+from p56.prefilter import getFilterSos, applyFiltersSos
 
 FS = 48000
 x = np.random.randn(20*FS)
@@ -32,6 +36,51 @@ class P56TestCase(unittest.TestCase):
                     asl, act = calculateP56ASLEx(s*scale, fs)
                     self.assertAlmostEqual(asl, -26.0+offset, delta=0.11)
 
+    def test_p56_asl_synthetic(self):
+        # noise with 20% pause: level of active part, activity incl. hangover
+        s = 0.05 * np.random.randn(5*FS)
+        s[FS:2*FS] = 0.0
+        asl, act = calculateP56ASL(s, FS)
+        self.assertAlmostEqual(asl, 20*np.log10(0.05), delta=0.3)
+        self.assertAlmostEqual(act, 0.8 + 0.2/5, delta=0.02)
+
+    def test_p56_asl_meter(self):
+        # chunk-wise measurement must reproduce measurement of whole signal (also with pre-filter)
+        s = 0.05 * np.random.randn(5*FS)
+        s[FS:2*FS] = 0.0
+        for preFilter in ['NoFilter', 'FB']:
+            with self.subTest(preFilter=preFilter):
+                meter = ASLMeter(FS, preFilter=preFilter)
+                for i in range(0, s.shape[0], 7777):
+                    meter.process(s[i:i+7777])
+
+                self.assertEqual(meter.duration, 5.0)
+                asl, act = calculateP56ASLEx(s, FS, preFilter=preFilter, minAmplitude=0.0)
+                aslMeter, actMeter = meter.result()
+                self.assertAlmostEqual(aslMeter, asl, places=6)
+                self.assertAlmostEqual(actMeter, act, places=6)
+
+    def test_p56_asl_batch(self):
+        # batch over files/arrays (with process pool) must match single measurements of each channel
+        s = np.random.randn(2, 5*FS) * np.array([[0.05], [0.01]])
+        with tempfile.TemporaryDirectory() as tmpDir:
+            wavFile, npyFile = Path(tmpDir) / 'test.wav', Path(tmpDir) / 'test.npy'
+            sf.write(wavFile, s.T, FS, subtype='FLOAT')
+            np.save(npyFile, s[1])
+
+            df = calculateP56ASLBatch([wavFile, npyFile, s[0]], fs=FS, preFilter='FB', maxWorkers=2)
+            self.assertEqual(len(df), 4)
+            for (item, ch), sig in [((str(wavFile), 1), s[0]), ((str(wavFile), 2), s[1]), ((str(npyFile), 1), s[1]), ((2, 1), s[0])]:
+                asl, act = calculateP56ASLEx(sig.astype(np.float32), FS, preFilter='FB')
+                self.assertAlmostEqual(df.loc[(item, ch), 'ASL'], asl, places=3)
+                self.assertAlmostEqual(df.loc[(item, ch), 'Activity'], act, places=3)
+
+        # channels of one array, without pool; silence yields NaN
+        s[1] = 0.0
+        df = calculateP56ASLBatch(s, fs=FS, maxWorkers=1)
+        self.assertAlmostEqual(df.loc[(0, 1), 'ASL'], calculateP56ASL(s[0], FS)[0], places=6)
+        self.assertTrue(np.isnan(df.loc[(1, 1), 'ASL']))
+
     def _getTransferFunction(self, x, y, fs, N = 32768):
         wargs = dict(nperseg=N, noverlap=N*3/4, nfft=N, scaling='spectrum')
         freq, X = signal.welch(x, fs, **wargs)
@@ -104,5 +153,19 @@ class P56TestCase(unittest.TestCase):
         if self.showPlots:
             self._plotTransferFunction(freq, H, 'FB')
 
+    def test_p56_prefilter_sos(self):
+        # single-pass SOS cascade must match b-a-cascade, also for multichannel signals and in blocks with states
+        X = np.vstack([x, 0.5 * x[::-1]])
+        for fltType in ['NB', 'SWB', 'FB']:
+            with self.subTest(fltType=fltType):
+                sos = getFilterSos(fltType, fs=FS)
+                Y = applyFiltersSos(X, sos)
+                self.assertLess(np.abs(Y[0] - applyFilters(x, getFilter(fltType, fs=FS))).max(), 1e-2)
+
+                y1, zi = applyFiltersSos(X[:, :10000], sos, zi=True)
+                y2, _ = applyFiltersSos(X[:, 10000:], sos, zi=zi)
+                np.testing.assert_allclose(np.hstack([y1, y2]), Y, atol=1e-10)
+                np.testing.assert_allclose(Y[1], applyFiltersSos(X[1], sos), atol=1e-10)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,93 +1,56 @@
 import unittest
+import os
 from pathlib import Path
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas
-from concurrent.futures import ProcessPoolExecutor
 
-from tests import resultsP863File, resultIdxRange
-from p863 import runPOLQA
+from tests import resultsP863File, resultsDbFile, resultColumns, getResultStore, polqaItem
+from p863.runner import POLQARunner
 
 class P863CalcTestCase(unittest.TestCase):
-    @staticmethod
-    def _calculate_polqa(wavDeg: Path, wavRef: Path,
-                         startTime: float, duration: float, nbrRanges: int,
-                         chNbrRef=2, chNbrDeg=1,) -> "DataFrame":
-
-        # calculation/average of multiple ranges
-        dfPerFile = None
-        try:
-            for i in range(nbrRanges):
-                res, _ = runPOLQA(wavDeg, wavRef, chNbrRef=chNbrRef, chNbrDeg=chNbrDeg,
-                                  timeRangeStart=startTime + i * duration,
-                                  timeRangeDuration=duration)
-                res.name = i + 1
-                if res.shape[0] > 0:
-                    res = pandas.DataFrame(res).T
-                    if dfPerFile is None:
-                        dfPerFile = res
-                    else:
-                        dfPerFile = dfPerFile.combine_first(res)
-        except:
-            dfPerFile = None
-        finally:
-            return dfPerFile
-
-    def test_calcP863(self, maxWorkers: int = 4):
-        if not resultsP863File.is_file():
-            self.assertFalse(True, 'Cannot find %s - please run test for generation of files first' % (resultsP863File.name))
+    def test_calcP863(self, maxWorkers: int = os.cpu_count(), timeout: float = 600.0, retries: int = 2):
+        if not (resultsDbFile.is_file() or resultsP863File.is_file()):
+            self.assertFalse(True, 'Cannot find %s - please run test for generation of files first' % (resultsDbFile.name))
 
         # analysis parameters for the ETSI test files (TODO: test files from other sources)
         duration = 8.0
         startTime = 16.0
         nbrRanges = 8
 
-        # init storage and new column
-        df = pandas.read_excel(resultsP863File, index_col=resultIdxRange)
-        if not ('MOS-LQO' in df.columns):
-            df['MOS-LQO'] = pandas.NA
-
-        # calculate POLQA scores
-        with ProcessPoolExecutor(max_workers=maxWorkers) as executor:
-
-            # collect tasks and shuffle
-            tasks = pandas.DataFrame(columns=['wavDeg', 'wavRef', 'startTime', 'duration', 'nbrRanges'])
-            for i, (key, row) in enumerate(df.iterrows()):
-                if pandas.isna(df.loc[key, 'MOS-LQO']) or (df.loc[key, 'MOS-LQO'] < 1.0):
-                    tasks.loc[key] = (key, key, startTime, duration, nbrRanges)
-
-            # shuffle
-            tasks = tasks.sample(frac=1.0)
-
-            # start tasks
-            results = dict()
-            for key, row in tasks.iterrows():
-                results[key] = executor.submit(self._calculate_polqa, **row)
-
-            # wait for tasks
-            print(f"Waiting for {len(results)}/{df.shape[0]} items to complete...")
-            for i, (key, futureResult) in enumerate(results.items()):
-                print("[%d/%d] %s" % (i + 1, len(results), Path(key).name))
-                e = futureResult.exception()
-                if e is None:
-                    dfPerFile = futureResult.result()
-
-                    # store in output
-                    if not dfPerFile is None:
-                        df.loc[key, 'MOS-LQO'] = dfPerFile['MOS-LQO'].mean()
-                        df.to_excel(resultsP863File)
-                else:
-                    df.loc[key, 'MOS-LQO'] = -1.0
-                    print(str(e))
+        # init storage
+        store = getResultStore()
+        df = store.dataFrame()
+        self.assertGreater(df.shape[0], 0, 'No generated files in %s - please run test for generation of files first' % (resultsDbFile.name))
+
+        # collect tasks and shuffle
+        keys = [key for key in df.index if pandas.isna(df.loc[key, 'MOS-LQO']) or (df.loc[key, 'MOS-LQO'] < 1.0)]
+        keys = pandas.Series(keys, dtype=object).sample(frac=1.0).tolist()
+
+        # output files or conditions of ConditionStores (sweep with output='container')
+        items = {polqaItem(key, df.loc[key, 'SourceFile']): key for key in keys}
+
+        # calculate POLQA scores (each file is read once, all ranges in parallel), store results incrementally (per row)
+        runner = POLQARunner(maxWorkers=maxWorkers, timeout=timeout, retries=retries)
+        print(f"Waiting for {len(keys)}/{df.shape[0]} items to complete...")
+        for i, res in enumerate(runner.run(list(items.keys()), startTime=startTime, duration=duration, nbrRanges=nbrRanges,
+                                           chNbrDeg=1, chNbrRef=2)):
+            key = items[res.item]
+            print("[%d/%d] %s" % (i + 1, len(keys), Path(key).name))
+            store.upsert(key, {'MOS-LQO': res.mos if res.ranges.shape[0] > 0 else -1.0})
+            for e in res.errors:
+                print(e)
+
+        store.exportExcel(resultsP863File, columns=resultColumns)
 
     def test_analyse_P863_results(self):
         # try to automatically select the four best noise reduction parameters that generate:
         # - equidistant MOS-LQO for anchoring (~1.0 / ~2.0 / ~3.0 / ~4.0 - 5.0/max is given by direct reference)
         # - most consistent results across language/source files
 
-        if resultsP863File.is_file():
+        if resultsDbFile.is_file() or resultsP863File.is_file():
             # load
-            df = pandas.read_excel(resultsP863File, index_col=resultIdxRange)
+            df = getResultStore().dataFrame()
             df = df.dropna()
             df = df[df['MOS-LQO'] >= 1.0]
 
@@ -0,0 +1,107 @@
+import unittest
+import sys
+import tempfile
+from pathlib import Path
+import numpy as np
+import soundfile as sf
+
+from tests.data import dataPath
+from p863 import parsePOLQAOutput, runPOLQA
+from p863.runner import POLQARunner, POLQAError
+from sweep.container import ConditionStore, ConditionItem
+from helper import FS
+
+standIn = [sys.executable, str(dataPath / 'polqaStandIn.py')]
+
+class POLQARunnerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpDir.name)
+
+        # stereo files (degraded, reference) with different SNR
+        self.files = []
+        ref = 0.1 * np.random.randn(4*FS)
+        for snr in [30, 10, -5]:
+            deg = ref + np.power(10, -snr/20) * 0.1 * np.random.randn(ref.shape[0])
+            wavFile = self.path / ('test_snr=%d.flac' % snr)
+            sf.write(wavFile, np.vstack((deg, ref)).T, FS, subtype='PCM_16')
+            self.files.append(wavFile)
+
+    def tearDown(self) -> None:
+        self.tmpDir.cleanup()
+
+    def test_polqa_parse(self):
+        stdout = b'POLQA v3\r\nMOS-LQO: 3.1234\r\nAVG  Delay: -1.5\r\nSNR Degraded: 20.00\r\nPOLQA WARNING Low level\r\n'
+        res, warnings = parsePOLQAOutput(stdout)
+        self.assertAlmostEqual(res['MOS-LQO'], 3.1234)
+        self.assertAlmostEqual(res['AVG  Delay'], -1.5)
+        self.assertNotIn('SNR Reference', res.index)
+        self.assertEqual(warnings, ['Low level'])
+
+    def test_polqa_run_single(self):
+        res, _ = runPOLQA(self.files[0], self.files[0], chNbrDeg=1, chNbrRef=2, timeRangeStart=1.0,
+                          timeRangeDuration=2.0, executable=standIn)
+        self.assertGreater(res['MOS-LQO'], 4.0)
+
+    def test_polqa_runner(self):
+        runner = POLQARunner(executable=standIn, maxWorkers=3, timeout=30.0, retries=0, tmpDir=self.path)
+        results = {res.item: res for res in runner.run(self.files, startTime=0.5, duration=1.0, nbrRanges=3)}
+        self.assertEqual(set(results.keys()), set(self.files))
+
+        mos = [results[f].mos for f in self.files]
+        self.assertTrue(mos[0] > mos[1] > mos[2])
+        for res in results.values():
+            self.assertEqual(res.ranges.index.tolist(), [1, 2, 3])
+            self.assertEqual(res.errors, [])
+        self.assertGreater(len(results[self.files[2]].warnings), 0)
+
+        # separate degraded/reference files, missing file
+        sf.write(self.path / 'deg.wav', sf.read(self.files[1])[0][:, 0], FS)
+        sf.write(self.path / 'ref.wav', sf.read(self.files[1])[0][:, 1], FS)
+        items = [(self.path / 'deg.wav', self.path / 'ref.wav'), self.path / 'missing.wav']
+        results = {str(res.item): res for res in runner.run(items, chNbrDeg=1, chNbrRef=1)}
+        self.assertAlmostEqual(results[str(items[0])].mos, mos[1], delta=0.2)
+        self.assertEqual(len(results[str(items[1])].errors), 1)
+
+        # temporary files are removed
+        self.assertEqual(list(self.path.glob('polqa_*')), [])
+
+    def test_polqa_runner_container(self):
+        # conditions of a ConditionStore (reference stored once) score as the stereo files
+        storeFile = self.path / 'test.specsub'
+        with ConditionStore(storeFile, mode='w', fs=FS) as store:
+            for i, f in enumerate(self.files):
+                x, _ = sf.read(f, dtype='float32')
+                if i == 0:
+                    store.setReference(x[:, 1])
+                store.put(f.stem, x[:, 0])
+
+        runner = POLQARunner(executable=standIn, maxWorkers=3, timeout=30.0, retries=0, tmpDir=self.path)
+        kwargs = dict(startTime=0.5, duration=1.0, nbrRanges=3, chNbrDeg=1, chNbrRef=2)
+        mos = {res.item: res.mos for res in runner.run(self.files, **kwargs)}
+        items = [ConditionItem(storeFile, f.stem) for f in self.files] + [ConditionItem(storeFile, 'missing')]
+        results = {res.item: res for res in runner.run(items, **kwargs)}
+        for f, item in zip(self.files, items):
+            self.assertEqual(results[item].errors, [])
+            self.assertAlmostEqual(results[item].mos, mos[f], places=6)
+        self.assertEqual(len(results[items[-1]].errors), 1)
+
+    def test_polqa_runner_retries(self):
+        # first attempt of each range fails: succeeds with retry, fails without
+        for retries, nbrErrors in [(1, 0), (0, 2)]:
+            with self.subTest(retries=retries):
+                stateDir = self.path / ('state%d' % retries)
+                stateDir.mkdir()
+                runner = POLQARunner(executable=standIn + ['--fail-once', str(stateDir)], maxWorkers=2, retries=retries)
+                res = list(runner.run(self.files[:1], duration=1.0, nbrRanges=2, chNbrDeg=1, chNbrRef=2))[0]
+                self.assertEqual(len(res.errors), nbrErrors)
+                self.assertEqual(res.ranges.shape[0], 2 - nbrErrors)
+
+    def test_polqa_runner_timeout(self):
+        runner = POLQARunner(executable=standIn + ['--sleep', '5'], timeout=0.5, retries=1)
+        with self.assertRaises(POLQAError) as e:
+            runner.score(self.files[0], self.files[0])
+        self.assertIn('timeout', str(e.exception))
+
+if __name__ == '__main__':
+    unittest.main()
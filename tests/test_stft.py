@@ -0,0 +1,59 @@
+import unittest
+import sys
+import subprocess
+import numpy as np
+import librosa
+
+from tests import thisPath
+from helper.stft import getWindow, stft, istft
+from helper.jit import lazyJit
+
+@lazyJit(nopython=True, cache=False)
+def _square(x):
+    return x * x
+
+@lazyJit(nopython=True, cache=False)
+def _sumSquares(x):
+    s = 0.0
+    for v in x:
+        s += _square(v)
+    return s
+
+class STFTTestCase(unittest.TestCase):
+    def test_stft_librosa(self):
+        # same framing/scaling as librosa (center=True), also for multichannel signals
+        x = np.random.randn(2, 10000)
+        for n_fft, hop in [(512, 128), (1024, 300), (2048, 64)]:
+            with self.subTest(n_fft=n_fft, hop=hop):
+                X = stft(x, n_fft, hop)
+                np.testing.assert_allclose(X, librosa.stft(x, n_fft=n_fft, hop_length=hop, center=True), atol=1e-9)
+                y = istft(X, hop, length=x.shape[-1])
+                y1 = librosa.istft(X, hop_length=hop, center=True)
+                np.testing.assert_allclose(y[..., :y1.shape[-1]], y1, atol=1e-9)
+                np.testing.assert_allclose(y[..., :y1.shape[-1]], x[..., :y1.shape[-1]], atol=1e-9)
+                np.testing.assert_array_equal(y[..., y1.shape[-1]:], 0.0)
+
+    def test_stft_window(self):
+        for window in ['hann', 'hamming', ('kaiser', 8.0), np.ones(256)]:
+            with self.subTest(window=str(window)):
+                np.testing.assert_allclose(getWindow(window, 256), librosa.filters.get_window(window, 256, fftbins=True), atol=1e-15)
+        with self.assertRaises(ValueError):
+            getWindow(np.ones(255), 256)
+
+    def test_stft_lazy_jit(self):
+        # kernels (incl. nested kernels) are compiled on first call
+        x = np.arange(5.0)
+        self.assertEqual(_sumSquares(x), 30.0)
+        self.assertEqual(_square(3.0), 9.0)
+
+    def test_stft_light_import(self):
+        # core modules do not import heavy dependencies on import
+        code = ('import sys, degradeSpecSub, p56.asl, helper.noise, helper.ltass, helper.profiling; '
+                'print(",".join(m for m in ["librosa", "numba", "scipy.signal", "pandas", "soundfile"] if m in sys.modules))')
+        res = subprocess.run([sys.executable, '-c', code], cwd=thisPath.parent, capture_output=True, text=True)
+        self.assertEqual(res.returncode, 0, res.stderr)
+        self.assertEqual(res.stdout.strip(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
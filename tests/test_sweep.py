@@ -0,0 +1,417 @@
+import unittest
+import sys
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+import pickle
+import ast
+from multiprocessing import shared_memory
+import numpy as np
+import pandas
+import soundfile as sf
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from sweep.cache import DegradationCache, hashAudio, codeVersion, rootPath, CODE_FILES, CODE_FILES_EXCLUDED
+from sweep.store import ResultStore
+from sweep.search import AnchorSearch, POLQAMetric
+from sweep.pipeline import SourcePool, SharedArray
+from sweep.scheduler import TaskScheduler, estimateCost
+from sweep.container import ConditionStore, REFERENCE
+from p863.runner import POLQARunner
+from tests.data import dataPath
+from helper import FS
+
+class SweepCacheTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.cachePath = Path(self.tmpDir.name)
+
+    def tearDown(self) -> None:
+        self.tmpDir.cleanup()
+
+    def test_cache_key(self):
+        s = np.random.randn(FS)
+        params = dict(n_fft=8192, hop_length=64, snr=-5, osf=0.5, tc=0.035, pow_exp=2.0)
+        key = DegradationCache.key(hashAudio(s, FS), params)
+
+        # deterministic, independent of numpy scalar types
+        params2 = {k: np.float64(v) if isinstance(v, float) else v for k, v in params.items()}
+        self.assertEqual(key, DegradationCache.key(hashAudio(s.copy(), FS), params2))
+
+        # any change of audio, parameters, seed or code version invalidates key
+        s2 = s.copy()
+        s2[100] += 1e-6
+        self.assertNotEqual(key, DegradationCache.key(hashAudio(s2, FS), params))
+        self.assertNotEqual(key, DegradationCache.key(hashAudio(s, 16000), params))
+        self.assertNotEqual(key, DegradationCache.key(hashAudio(s, FS), dict(params, snr=-5.5)))
+        self.assertNotEqual(key, DegradationCache.key(hashAudio(s, FS), params, seed=1))
+        self.assertNotEqual(key, DegradationCache.key(hashAudio(s, FS), params, version=codeVersion() + 'x'))
+
+    def test_cache_code_files(self):
+        # all repo modules imported (directly or indirectly) by engine and leveling are part of the code version
+        def localImports(codeFile: str):
+            modules = []
+            for node in ast.walk(ast.parse((rootPath / codeFile).read_text(encoding='utf-8'))):
+                if isinstance(node, ast.Import):
+                    modules.extend([alias.name for alias in node.names])
+                elif isinstance(node, ast.ImportFrom):
+                    package = '.'.join(Path(codeFile).parent.parts[:len(Path(codeFile).parent.parts) - node.level + 1])
+                    modules.append('.'.join([p for p in (package if node.level > 0 else '', node.module or '') if p]))
+            files = [Path(*m.split('.')).with_suffix('.py').as_posix() for m in modules]
+            return [f for f in files if (rootPath / f).is_file()]
+
+        pending, imported = ['degradeSpecSub.py', 'sweep/pipeline.py'], set()
+        while len(pending) > 0:
+            codeFile = pending.pop()
+            if codeFile not in imported:
+                imported.add(codeFile)
+                pending.extend(localImports(codeFile))
+
+        self.assertIn('helper/jit.py', imported)
+        self.assertEqual(sorted(imported - set(CODE_FILES) - set(CODE_FILES_EXCLUDED)), [])
+
+    def test_cache_put_get(self):
+        cache = DegradationCache(self.cachePath)
+        d = 0.1 * np.random.randn(FS).astype(np.float32)
+        key = cache.key(hashAudio(d, FS), dict(snr=0))
+
+        self.assertNotIn(key, cache)
+        self.assertIsNone(cache.get(key))
+
+        cache.put(key, d, FS, dict(asl=np.float64(-26.0), activity=0.8))
+        self.assertIn(key, cache)
+        d1, meta = cache.get(key)
+        self.assertEqual(d1.dtype, np.float32)
+        np.testing.assert_allclose(d1, d, atol=1/32768)
+        self.assertEqual(meta, dict(asl=-26.0, activity=0.8))
+
+        # same samples as 16-bit output files
+        outputFile = self.cachePath / 'output.flac'
+        sf.write(outputFile, d, FS, subtype='PCM_16', format='FLAC')
+        np.testing.assert_array_equal(sf.read(outputFile, dtype='float32')[0], d1)
+
+        # no temporary files left
+        self.assertEqual(len(list(self.cachePath.rglob('*.tmp*'))), 0)
+
+        cache.remove(key)
+        self.assertNotIn(key, cache)
+
+    def test_cache_prune(self):
+        # entries of other code versions, incomplete entries and files of old format are removed
+        cache = DegradationCache(self.cachePath)
+        d = 0.1 * np.random.randn(FS // 10)
+        keys = ['%02d%s' % (i, 'a' * 62) for i in range(3)]
+        cache.put(keys[0], d, FS, dict(snr=0))
+        cache.put(keys[1], d, FS, dict(snr=5), version='old')
+        cache.put(keys[2], d, FS, dict(snr=10))
+        cache._paths(keys[2])[1].unlink()
+        np.save(self.cachePath / keys[0][:2] / ('%s.npy' % ('f' * 64)), d)
+        (self.cachePath / keys[0][:2] / ('%s.tmp' % keys[0])).write_text('')
+
+        self.assertEqual(cache.prune(), 5)
+        self.assertIn(keys[0], cache)
+        self.assertNotIn(keys[1], cache)
+        self.assertEqual(sorted(p.name for p in self.cachePath.rglob('*') if p.is_file()),
+                         sorted(p.name for p in cache._paths(keys[0])))
+        self.assertEqual(cache.prune(), 0)
+
+def _storeWorker(store: ResultStore, i0: int, n: int):
+    # concurrent writer (separate process)
+    for i in range(i0, i0 + n):
+        store.upsert('file%d' % i, {'SNR': float(i), 'MOS-LQO': i / 100})
+    return n
+
+class ResultStoreTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpDir.name)
+        self.store = ResultStore(self.path / 'results.sqlite', keyColumn='Filename', columns=['SourceFile'],
+                                 indexColumns=['NFFT', 'SNR'])
+
+    def tearDown(self) -> None:
+        self.store.close()
+        self.tmpDir.cleanup()
+
+    def test_store_upsert(self):
+        store = self.store
+        store.upsertMany({'a': dict(SourceFile='German', NFFT=8192, SNR=np.float64(5.0)),
+                          'b': dict(SourceFile='English', NFFT=8192, SNR=-5)})
+        self.assertEqual(len(store), 2)
+        self.assertIn('a', store)
+        self.assertNotIn('c', store)
+
+        # update of single column keeps other columns, new column is added
+        store.upsert('a', {'MOS-LQO': 3.5})
+        self.assertEqual(store.get('a'), {'Filename': 'a', 'SourceFile': 'German', 'NFFT': 8192, 'SNR': 5.0, 'MOS-LQO': 3.5})
+        self.assertIsNone(store.get('b')['MOS-LQO'])
+
+        df = store.dataFrame('"SNR" < ?', (0,))
+        self.assertEqual(df.index.tolist(), ['b'])
+
+        # regenerated file: score is reset (rescored), other columns are kept
+        store.upsert('a', dict(SourceFile='German', **{'MOS-LQO': None}))
+        self.assertIsNone(store.get('a')['MOS-LQO'])
+        self.assertTrue(pandas.isna(store.dataFrame().loc['a', 'MOS-LQO']))
+
+        store.remove(['b'])
+        self.assertEqual(len(store), 1)
+
+    def test_store_concurrent(self):
+        # concurrent writers (processes) do not lose rows
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(_storeWorker, self.store, i * 100, 100) for i in range(4)]
+            self.assertEqual(sum(f.result() for f in futures), 400)
+
+        df = self.store.dataFrame()
+        self.assertEqual(df.shape[0], 400)
+        self.assertAlmostEqual(df.loc['file123', 'MOS-LQO'], 1.23)
+
+    def test_store_excel(self):
+        self.store.upsertMany({'file%d' % i: dict(SourceFile='German', SNR=i, **{'MOS-LQO': np.nan}) for i in range(10)})
+        xlsxFile = self.path / 'results.xlsx'
+        self.store.exportExcel(xlsxFile, columns=['SourceFile', 'SNR', 'MOS-LQO'])
+        self.assertEqual(list(self.path.glob('.*tmp*')), [])
+
+        store = ResultStore(self.path / 'imported.sqlite')
+        store.importExcel(xlsxFile)
+        pandas.testing.assert_frame_equal(store.dataFrame()[['SourceFile', 'SNR']], self.store.dataFrame()[['SourceFile', 'SNR']],
+                                          check_dtype=False)
+        store.close()
+
+def _sharedWorker(source: SharedArray):
+    # sum and writeability of shared source in worker process
+    s = source.attach()
+    return float(np.sum(s)), s.flags.writeable
+
+class SourcePoolTestCase(unittest.TestCase):
+    def test_pipeline_imports(self):
+        # workers of spawned processes import the module of their task only: numba, resampy and librosa on demand
+        code = 'import sys, sweep.pipeline; print(sorted({"numba", "resampy", "librosa"} & set(sys.modules)))'
+        res = subprocess.run([sys.executable, '-c', code], cwd=Path(__file__).parent.parent, capture_output=True, text=True)
+        self.assertEqual(res.returncode, 0, res.stderr)
+        self.assertEqual(res.stdout.strip(), '[]')
+
+    def test_pool_shared(self):
+        # workers read sources from shared memory, segments are removed on close
+        with tempfile.TemporaryDirectory() as tmpDir:
+            wavFile = Path(tmpDir) / 'source.wav'
+            sf.write(wavFile, 0.1 * np.random.randn(16000), 16000, subtype='FLOAT')
+
+            with SourcePool() as pool:
+                sources = [pool.share(np.arange(10.0)), pool.load(wavFile, FS)]
+                self.assertEqual(sources[1].shape, (3 * 16000,))
+                s = pool.array(sources[1])
+                with ProcessPoolExecutor(max_workers=2) as executor:
+                    results = list(executor.map(_sharedWorker, sources))
+                self.assertEqual(results[0], (45.0, False))
+                self.assertAlmostEqual(results[1][0], float(np.sum(s)), places=6)
+                self.assertGreater(len(pickle.dumps(sources[1])), 0)
+                self.assertLess(len(pickle.dumps(sources[1])), 200)
+
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(name=sources[0].name)
+
+class _Task:
+    # records order of execution and max. number of concurrent tasks
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.order, self.running, self.maxRunning = [], 0, 0
+
+    def __call__(self, key, fail=False):
+        with self.lock:
+            self.order.append(key)
+            self.running += 1
+            self.maxRunning = max(self.maxRunning, self.running)
+        time.sleep(0.01)
+        with self.lock:
+            self.running -= 1
+        if fail:
+            raise RuntimeError(key)
+        return key
+
+class TaskSchedulerTestCase(unittest.TestCase):
+    def test_cost(self):
+        # hop=64 about 32x as expensive as hop=2048, linear in number of conditions
+        c = estimateCost(48000*8, 8192, 64) / estimateCost(48000*8, 8192, 2048)
+        self.assertAlmostEqual(c, 32.0, delta=1.0)
+        self.assertEqual(estimateCost(1000, 512, 128, 3), 3 * estimateCost(1000, 512, 128))
+
+    def test_longest_first(self):
+        task = _Task()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            scheduler = TaskScheduler(executor, maxInFlight=1)
+            for key, cost in [('a', 1.0), ('b', 32.0), ('c', 2.0), ('d', 32.0)]:
+                scheduler.add(key, cost, task, key)
+            self.assertEqual(len(scheduler), 4)
+            done = [t.key for t, f in scheduler.run()]
+        self.assertEqual(task.order, ['b', 'd', 'c', 'a'])
+        self.assertEqual(done, task.order)
+        self.assertEqual(len(scheduler), 0)
+
+    def test_bounded(self):
+        # at most maxInFlight tasks submitted, failures are returned with their future
+        task = _Task()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            scheduler = TaskScheduler(executor, maxInFlight=3)
+            for i in range(20):
+                scheduler.add(i, i % 4, task, i, fail=(i == 5))
+            results = {t.key: f for t, f in scheduler.run()}
+        self.assertEqual(sorted(results.keys()), list(range(20)))
+        self.assertLessEqual(task.maxRunning, 3)
+        self.assertIsInstance(results[5].exception(), RuntimeError)
+        self.assertEqual(results[6].result(), 6)
+
+class ConditionStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.file = Path(self.tmpDir.name) / 'source.specsub'
+        rng = np.random.default_rng(0)
+        self.s = (0.1 * rng.standard_normal(5 * FS)).astype(np.float32)
+        self.d = {'snr=%d' % snr: self.s + np.float32(10**(-snr/20) * 0.1) * rng.standard_normal(len(self.s), dtype=np.float32)
+                  for snr in [20, 10, 0]}
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def test_store_roundtrip(self):
+        # 16-bit resolution, random access by condition and time range, metadata
+        with ConditionStore(self.file, mode='w', fs=FS, chunkSize=FS // 2) as store:
+            store.setReference(self.s, dict(sourceFile='source.wav'))
+            store.updateAttrs(seed=np.int64(1))
+            for key, d in self.d.items():
+                store.put(key, d, dict(snr=np.float64(key[4:])))
+
+        with ConditionStore(self.file) as store:
+            self.assertEqual((store.fs, len(store), store.attrs), (FS, 3, dict(seed=1)))
+            self.assertEqual(store.keys(), list(self.d.keys()))
+            self.assertNotIn(REFERENCE, store.keys())
+            self.assertEqual(store.metadata(), dict(sourceFile='source.wav'))
+            self.assertEqual(store.dataFrame().loc['snr=10', 'snr'], 10.0)
+            for key, d in self.d.items():
+                np.testing.assert_allclose(store.read(key), d, atol=1/32768)
+            np.testing.assert_allclose(store.reference(), self.s, atol=1/32768)
+            full = store.read('snr=0')
+            np.testing.assert_array_equal(store.read('snr=0', 1.3, 2.1), full[int(1.3*FS):int(1.3*FS) + int(round(2.1*FS))])
+            np.testing.assert_array_equal(store.read('snr=0', 4.5), full[int(4.5*FS):])
+            self.assertEqual(len(store.read('snr=0', 6.0)), 0)
+            with self.assertRaises(KeyError):
+                store.read('snr=5')
+            with self.assertRaises(IOError):
+                store.put('snr=5', self.s)
+
+        # reference once: smaller than stereo 16-bit FLAC files of all conditions
+        flacBytes = 0
+        with ConditionStore(self.file) as store:
+            for key in store.keys():
+                outputFile = store.export(key, Path(self.tmpDir.name) / ('%s.flac' % key))
+                x, fs = sf.read(outputFile)
+                self.assertEqual((x.shape, fs), ((len(self.s), 2), FS))
+                np.testing.assert_allclose(x[:, 1], store.reference(), atol=1/32768)
+                flacBytes += outputFile.stat().st_size
+            wavFile = store.export('snr=20', Path(self.tmpDir.name) / 'snr=20.wav', withReference=False, startTime=1.0, duration=1.0)
+            np.testing.assert_allclose(sf.read(wavFile)[0], store.read('snr=20', 1.0, 1.0), atol=1/32768)
+        self.assertLess(self.file.stat().st_size, flacBytes)
+
+    def test_store_crash(self):
+        # writer interrupted before any flush: store reopens (empty or last flushed state) and can be appended
+        store = ConditionStore(self.file, mode='a', fs=FS)
+        store.setReference(self.s)
+        store.put('snr=20', self.d['snr=20'])
+        store._f.close() # crash: no flush/close
+
+        with ConditionStore(self.file, mode='a', fs=FS) as store:
+            self.assertEqual((len(store), REFERENCE in store), (0, False))
+            store.setReference(self.s)
+            store.put('snr=10', self.d['snr=10'])
+            store.flush()
+            store.put('snr=0', self.d['snr=0'])
+            store._f.close()
+
+        with ConditionStore(self.file, mode='a') as store:
+            self.assertEqual(store.keys(), ['snr=10'])
+            np.testing.assert_allclose(store.read('snr=10'), self.d['snr=10'], atol=1/32768)
+            store.put('snr=0', self.d['snr=0'])
+        with ConditionStore(self.file) as store:
+            self.assertEqual(store.keys(), ['snr=10', 'snr=0'])
+            np.testing.assert_allclose(store.reference(), self.s, atol=1/32768)
+
+        # interrupted before first index (header only): recreated in mode 'a'
+        with open(self.file, 'r+b') as f:
+            f.seek(8 + 4 + 4)
+            f.write(bytes(16))
+        with self.assertRaises(ValueError):
+            ConditionStore(self.file)
+        with ConditionStore(self.file, mode='a', fs=FS) as store:
+            self.assertEqual(len(store), 0)
+
+    def test_store_append(self):
+        # float samples are exact, entries can be added/replaced later, unflushed writes are not visible
+        with ConditionStore(self.file, mode='a', fs=FS, sampleFormat='FLOAT') as store:
+            store.setReference(self.s)
+            store.put('snr=20', self.d['snr=20'])
+        with ConditionStore(self.file, mode='a', fs=FS) as store:
+            self.assertEqual(store.sampleFormat, 'FLOAT')
+            store.put('snr=10', self.d['snr=10'])
+            store.put('snr=20', self.d['snr=0'])
+
+            with ConditionStore(self.file) as reader:
+                self.assertEqual(reader.keys(), ['snr=20'])
+            store.flush()
+            with ConditionStore(self.file) as reader:
+                np.testing.assert_array_equal(reader.read('snr=10'), self.d['snr=10'])
+                np.testing.assert_array_equal(reader.read('snr=20'), self.d['snr=0'])
+                np.testing.assert_array_equal(reader.reference(), self.s)
+
+        with self.assertRaises(ValueError):
+            ConditionStore(self.file, mode='a', fs=16000)
+        with self.assertRaises(ValueError):
+            ConditionStore(Path(self.tmpDir.name) / 'new.specsub', mode='w')
+
+# synthetic metric: MOS increases with SNR, offset per language (smaller for long time constants)
+_languageOffsets = {'German': 0.0, 'English': 1.0, 'Mandarin': -1.0}
+
+def _syntheticMOS(source, params):
+    midpoint = 5.0 - 10.0 * params['osf'] + 3.0 * params['pow_exp']
+    offset = _languageOffsets[source] * (1.0 if params['tc'] < 0.1 else 0.2)
+    return 1.0 + 3.5 / (1.0 + np.exp(-(params['snr'] - midpoint + offset) / 4.0))
+
+class AnchorSearchTestCase(unittest.TestCase):
+    def test_search_anchors(self):
+        search = AnchorSearch(_syntheticMOS, list(_languageOffsets.keys()), targets=[1.5, 2.0, 3.0, 4.0], maxSpread=0.3)
+        anchors = search.run()
+        for target, cand in anchors.items():
+            self.assertIsNotNone(cand)
+            self.assertLessEqual(abs(cand.mos - target), search.tolerance)
+            self.assertLessEqual(cand.spread, 0.3)
+            self.assertAlmostEqual(cand.mos, np.mean([_syntheticMOS(src, cand.params) for src in _languageOffsets]))
+
+        # inconsistent settings (short time constant) are skipped for mid-range targets
+        self.assertGreater(anchors[3.0].params['tc'], 0.1)
+
+        # order of magnitude less evaluations than full grid (7 SNRs per setting)
+        gridSize = 7 * len(search.settings) * len(_languageOffsets)
+        self.assertLess(search.nbrEvaluations * 10, gridSize)
+        self.assertEqual(search.history().shape[0], search.nbrEvaluations)
+
+    def test_search_unreachable(self):
+        search = AnchorSearch(_syntheticMOS, ['German'], targets=[4.9], settings=dict(n_fft=[1024], hop_length=[256], osf=[0.5],
+                                                                                 tc=[0.125], pow_exp=[2.0]))
+        self.assertIsNone(search.run()[4.9])
+        self.assertEqual(search.nbrEvaluations, 2)
+
+    def test_search_polqa_metric(self):
+        # degradation and scoring with stand-in of POLQA
+        s = 0.05 * np.random.randn(2 * FS)
+        with tempfile.TemporaryDirectory() as tmpDir:
+            runner = POLQARunner(executable=[sys.executable, str(dataPath / 'polqaStandIn.py')], retries=0)
+            metric = POLQAMetric({'noise': (s, FS)}, runner, outputPath=Path(tmpDir))
+            params = dict(snr=30.0, osf=0.5, tc=0.125, pow_exp=2.0, n_fft=1024, hop_length=256)
+            mosHigh = metric('noise', params)
+            mosLow = metric('noise', dict(params, snr=-20.0))
+            self.assertTrue(1.0 <= mosLow < mosHigh <= 5.0)
+            self.assertEqual(list(Path(tmpDir).iterdir()), [])
+
+if __name__ == '__main__':
+    unittest.main()